@@ -184,7 +184,9 @@ PyObject* scale_image(PyObject*, PyObject* args, PyObject* kwargs) {
 
     PyObject* dst = PyBytes_FromStringAndSize(NULL, dstW * dstH * sizeof(uint32_t));
     uint8_t* dstBuf = reinterpret_cast<uint8_t*>(PyBytes_AS_STRING(dst));
+    Py_BEGIN_ALLOW_THREADS
     _scale_image(srcBuf, srcW, srcH, dstBuf, dstW, dstH);
+    Py_END_ALLOW_THREADS
     return dst;
 }
 
@@ -379,6 +381,11 @@ static int _generate_detail_map(pyGLTexture* self, uint8_t* buf, size_t bufsz, G
         return -1;
 
     size_t detail_blend = PyLong_AsSize_t(pydetail_blend);
+    if (detail_blend > TEX_DETAIL_MULTIPLY)
+        return -1;
+
+    // Everything from here on out only touches the pixels, so let the other texture workers run.
+    Py_BEGIN_ALLOW_THREADS
     switch (detail_blend) {
     case TEX_DETAIL_ALPHA: {
             for (size_t i = 0; i < bufsz; i += 4) {
@@ -401,9 +408,8 @@ static int _generate_detail_map(pyGLTexture* self, uint8_t* buf, size_t bufsz, G
             }
         }
         break;
-    default:
-        return -1;
     }
+    Py_END_ALLOW_THREADS
     return 0;
 }
 
@@ -442,13 +448,18 @@ static PyObject* pyGLTexture_get_level_data(pyGLTexture* self, PyObject* args, P
         data = PyBytes_FromStringAndSize(NULL, bufsz);
         uint8_t* dstBuf = reinterpret_cast<uint8_t*>(PyBytes_AsString(data)); // AS_STRING :(
         uint8_t* srcBuf = reinterpret_cast<uint8_t*>(PyBytes_AsString(self->m_imageData));
+        Py_BEGIN_ALLOW_THREADS
         _scale_image(srcBuf, self->m_width, self->m_height, dstBuf, eWidth, eHeight);
+        Py_END_ALLOW_THREADS
     }
 
     // Make sure the level data is not flipped upside down...
     if (self->m_imageInverted && !fast) {
         _ensure_copy_bytes(self->m_blenderImage, data);
-        _flip_image(eWidth, bufsz, reinterpret_cast<uint8_t*>(PyBytes_AS_STRING(data)));
+        uint8_t* buf = reinterpret_cast<uint8_t*>(PyBytes_AS_STRING(data));
+        Py_BEGIN_ALLOW_THREADS
+        _flip_image(eWidth, bufsz, buf);
+        Py_END_ALLOW_THREADS
     }
 
     // Detail blend
@@ -468,8 +479,10 @@ static PyObject* pyGLTexture_get_level_data(pyGLTexture* self, PyObject* args, P
     if (calc_alpha) {
         _ensure_copy_bytes(self->m_imageData, data);
         char* buf = PyBytes_AS_STRING(data);
+        Py_BEGIN_ALLOW_THREADS
         for (size_t i = 0; i < bufsz; i += 4)
             buf[i + 3] = (buf[i + 0] + buf[i + 1] + buf[i + 2]) / 3;
+        Py_END_ALLOW_THREADS
     }
 
     return data;
@@ -0,0 +1,248 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Headless Age exporter.
+
+Exporting the Age in a single blend file, from inside Blender:
+    blender -b MyAge.blend --python-expr "import korman.batch; korman.batch.main()" -- \\
+        --filepath /path/to/game/dat/MyAge.age --version pvMoul --set lighting_method=skip
+
+Exporting many blend files at once, each in its own Blender process. This can be run with any
+Python 3 interpreter, not just Blender's:
+    python korman/batch.py --blender /path/to/blender --jobs 4 jobs.json
+
+where jobs.json is a list of objects with the keys "blend", "filepath", and, optionally,
+"version", "dat_only", "verbose", "timing", and "options" (a mapping of export settings).
+Jobs exporting the same blend file are run one after the other.
+
+Both print a machine readable JSON status and exit with a nonzero code if anything failed.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+_BLENDER_EXPR = "import korman.batch; korman.batch.main()"
+
+EXIT_OK = 0
+EXIT_NONFATAL = 1
+EXIT_FATAL = 2
+
+export_parser = argparse.ArgumentParser(description="Korman Headless Age Exporter")
+export_parser.add_argument("--filepath", type=str, required=True, help="Path to the .age or .zip to export")
+export_parser.add_argument("--version", type=str, default="pvPots", help="Plasma version to export for")
+export_parser.add_argument("--dat-only", action="store_true", help="Only export the Age PRPs")
+export_parser.add_argument("--verbose", action="store_true", help="Print the verbose export log")
+export_parser.add_argument("--timing", action="store_true", help="Write an export timing report")
+export_parser.add_argument("--set", type=str, action="append", default=[], metavar="NAME=VALUE",
+                           dest="options", help="Override an Age export setting, eg lighting_method=skip")
+export_parser.add_argument("--status", type=Path, help="Write the export status to this JSON file")
+
+batch_parser = argparse.ArgumentParser(description="Korman Batch Age Exporter")
+batch_parser.add_argument("jobs", type=Path, help="JSON file listing the Ages to export")
+batch_parser.add_argument("--blender", type=str, default="blender", help="Blender executable")
+batch_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, dest="num_workers",
+                          help="Number of Blender processes to run at once")
+
+
+class _ExportOptions:
+    """Stands in for the export operator when there's no UI to speak of"""
+
+    def __init__(self, filepath, version, dat_only, actions):
+        self.filepath = filepath
+        self.version = version
+        self.dat_only = dat_only
+        self.actions = actions
+
+        # There is no console window to toggle when running headless.
+        self.show_console = False
+
+    def __getattr__(self, attr):
+        import bpy
+        return getattr(bpy.context.scene.world.plasma_age, attr)
+
+
+def _apply_options(options):
+    import bpy
+    from .operators.op_export import PlasmaAgeExportOperator
+
+    age = bpy.context.scene.world.plasma_age
+    for name, value in options.items():
+        if name not in PlasmaAgeExportOperator._properties:
+            raise ValueError(f"'{name}' is not an Age export setting")
+
+        # Values from the command line are always strings...
+        prop_type = type(getattr(age, name))
+        if isinstance(value, str) and prop_type is not str:
+            if prop_type is bool:
+                value = value.lower() in {"1", "true", "yes", "on"}
+            else:
+                value = prop_type(value)
+        setattr(age, name, value)
+
+
+def _ensure_registered():
+    import bpy
+    if not hasattr(bpy.types.World, "plasma_age"):
+        import addon_utils
+        addon_utils.enable(__package__, default_set=False)
+
+
+def export(filepath, version="pvPots", dat_only=False, verbose=False, timing=False, options={}):
+    """Exports the Age in the currently open blend file. Returns a status dict."""
+    import bpy
+    from .exporter import Exporter, ExportError, NonfatalExportError
+    from .helpers import UiHelper
+    from . import korlib
+
+    status = {
+        "blend": bpy.data.filepath,
+        "filepath": str(filepath),
+        "version": version,
+        "status": "ok",
+        "message": "",
+    }
+    start = time.perf_counter()
+
+    try:
+        _ensure_registered()
+        if korlib.is_python_keyword(Path(filepath).stem):
+            raise ExportError(f"The Age name conflicts with the Python keyword '{Path(filepath).stem}'")
+        _apply_options(dict(options, verbose=verbose))
+
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        if bpy.context.mode != "OBJECT":
+            bpy.ops.object.mode_set(mode="OBJECT")
+
+        actions = {"EXPORT", "TIMING"} if timing else {"EXPORT"}
+        op = _ExportOptions(str(filepath), version, dat_only, actions)
+        age = bpy.context.scene.world.plasma_age
+        with UiHelper(bpy.context):
+            try:
+                age.export_active = True
+                Exporter(op).run()
+            finally:
+                age.export_active = False
+    except NonfatalExportError as error:
+        status["status"] = "warning"
+        status["message"] = str(error)
+    except ExportError as error:
+        status["status"] = "error"
+        status["message"] = str(error)
+    except Exception as error:
+        status["status"] = "error"
+        status["message"] = traceback.format_exc()
+    status["seconds"] = time.perf_counter() - start
+    return status
+
+
+def main(argv=None):
+    """Entry point when running inside of Blender"""
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+    args = export_parser.parse_args(argv)
+
+    options = dict((i.split("=", 1) for i in args.options))
+    status = export(args.filepath, args.version, args.dat_only, args.verbose, args.timing, options)
+
+    if args.status is not None:
+        with args.status.open("w") as handle:
+            json.dump(status, handle)
+    print(json.dumps(status))
+    sys.exit(_exit_code(status))
+
+
+def _exit_code(status):
+    if status["status"] == "ok":
+        return EXIT_OK
+    elif status["status"] == "warning":
+        return EXIT_NONFATAL
+    else:
+        return EXIT_FATAL
+
+
+def _run_job(blender, job):
+    fd, status_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+
+    args = [blender, "-b", job["blend"], "--python-expr", _BLENDER_EXPR, "--",
+            "--filepath", job["filepath"], "--version", job.get("version", "pvPots"),
+            "--status", status_path]
+    if job.get("dat_only", False):
+        args.append("--dat-only")
+    if job.get("verbose", False):
+        args.append("--verbose")
+    if job.get("timing", False):
+        args.append("--timing")
+    for name, value in job.get("options", {}).items():
+        args.extend(("--set", f"{name}={value}"))
+
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              universal_newlines=True)
+        try:
+            with open(status_path, "r") as handle:
+                status = json.load(handle)
+        except (OSError, ValueError):
+            # Blender died before the exporter could tell us anything useful.
+            status = {
+                "blend": job["blend"],
+                "filepath": job["filepath"],
+                "version": job.get("version", "pvPots"),
+                "status": "crashed",
+                "message": proc.stdout[-2000:],
+            }
+        status["returncode"] = proc.returncode
+    finally:
+        os.remove(status_path)
+    status["wall_seconds"] = time.perf_counter() - start
+    return status
+
+
+def run_batch(jobs, blender="blender", num_workers=None):
+    """Exports each job in its own Blender process. Returns a list of status dicts."""
+    # Exports of the same blend file share the caches stored next to it, so they have to be
+    # run one after another.
+    blend_jobs = {}
+    for i, job in enumerate(jobs):
+        blend_jobs.setdefault(os.path.realpath(job["blend"]), []).append(i)
+
+    results = [None] * len(jobs)
+    def run_jobs(indices):
+        for i in indices:
+            results[i] = _run_job(blender, jobs[i])
+
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count() or 1) as executor:
+        for future in [executor.submit(run_jobs, i) for i in blend_jobs.values()]:
+            future.result()
+    return results
+
+
+if __name__ == "__main__":
+    args = batch_parser.parse_args()
+    with args.jobs.open("r") as handle:
+        jobs = json.load(handle)
+
+    results = run_batch(jobs, args.blender, args.num_workers)
+    print(json.dumps(results, indent=2))
+    sys.exit(max((_exit_code(i) for i in results), default=EXIT_OK))
@@ -0,0 +1,75 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import *
+
+class AtlasRect(NamedTuple):
+    atlas: int
+    x: int
+    y: int
+    size: int
+
+
+def calc_chart_size(area: float, texel_density: float, min_size: int, max_size: int) -> int:
+    """Gets the power of two size of a square chart that covers a surface area at the
+       requested number of pixels per unit."""
+    size = min_size
+    target = (area ** 0.5) * texel_density
+    while size < target and size < max_size:
+        size *= 2
+    return size
+
+
+def pack_squares(sizes: Sequence[int], atlas_size: int) -> Tuple[List[AtlasRect], List[int]]:
+    """Packs power of two squares into as few power of two atlases as possible. Returns the
+       location of each square and the final size of each atlas."""
+    # Largest first so that splitting the free space never leaves anything unusable.
+    order = sorted(range(len(sizes)), key=lambda x: sizes[x], reverse=True)
+    rects: List[Optional[AtlasRect]] = [None] * len(sizes)
+    free: List[List[Tuple[int, int, int]]] = []
+    extents: List[int] = []
+
+    for i in order:
+        size = min(sizes[i], atlas_size)
+        for atlas, atlas_free in enumerate(free):
+            if atlas_free and atlas_free[-1][2] >= size:
+                break
+        else:
+            atlas, atlas_free = len(free), [(0, 0, atlas_size)]
+            free.append(atlas_free)
+            extents.append(0)
+
+        # Every free square is at least as large as this one because of the sort, so the
+        # last one is always the best fit. Split it down until it is the right size.
+        x, y, free_size = atlas_free.pop()
+        while free_size > size:
+            free_size //= 2
+            atlas_free.extend(((x + free_size, y + free_size, free_size),
+                               (x, y + free_size, free_size),
+                               (x + free_size, y, free_size)))
+        rects[i] = AtlasRect(atlas, x, y, size)
+        extents[atlas] = max(extents[atlas], x + size, y + size)
+
+    # Atlases that didn't fill up can be shrunk down to the smallest power of two that
+    # covers everything in them.
+    atlas_sizes = []
+    for extent in extents:
+        final_size = atlas_size
+        while final_size // 2 >= extent:
+            final_size //= 2
+        atlas_sizes.append(final_size)
+    return rects, atlas_sizes
@@ -0,0 +1,135 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bpy
+
+import hashlib
+import numpy as np
+import os
+from pathlib import Path
+import struct
+from typing import *
+import zlib
+
+_MAGICK = b"KBC\x00"
+_VERSION = 1
+_DIGEST_SIZE = 16
+
+_HEADER = struct.Struct(f"<4sI{_DIGEST_SIZE}s")
+_VCOL_HEADER = struct.Struct("<I")
+_LIGHTMAP_HEADER = struct.Struct("<III")
+
+
+def hash_mesh_geometry(mesh: bpy.types.Mesh, hasher, skip_layers: Container[str] = ()):
+    """Hashes everything about a mesh that can change how lighting is baked onto it, except for
+       the named UV and vertex color layers, which are usually the output of a previous bake."""
+    def hash_foreach(collection, attr, dtype, width=1):
+        buf = np.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attr, buf)
+        hasher.update(buf.tobytes())
+
+    hasher.update(repr((mesh.use_auto_smooth, mesh.auto_smooth_angle)).encode())
+    hash_foreach(mesh.vertices, "co", np.float32, 3)
+    hash_foreach(mesh.edges, "use_edge_sharp", np.int32)
+    hash_foreach(mesh.loops, "vertex_index", np.int32)
+    for attr in ("loop_start", "loop_total", "material_index", "use_smooth"):
+        hash_foreach(mesh.polygons, attr, np.int32)
+    for layer in mesh.uv_layers:
+        if layer.name not in skip_layers:
+            hasher.update(layer.name.encode())
+            hash_foreach(layer.data, "uv", np.float32, 2)
+    for layer in mesh.vertex_colors:
+        if layer.name not in skip_layers:
+            hasher.update(layer.name.encode())
+            hash_foreach(layer.data, "color", np.float32, 3)
+
+
+class BakedLighting(NamedTuple):
+    # Vertex colors: the RGB color of every loop
+    colors: Optional[np.ndarray] = None
+
+    # Lightmaps: the RGBA bytes of the image and the lightmap UV of every loop
+    width: int = 0
+    height: int = 0
+    pixels: Optional[np.ndarray] = None
+    uvs: Optional[np.ndarray] = None
+
+
+class BakeCache:
+    """Stores the results of static lighting bakes on disk so that objects whose lighting can't
+       have changed don't need to be baked again. Each object has a single entry, which is only
+       used if the fingerprint it was baked with still matches.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self.hits = 0
+        self.misses = 0
+
+    def _get_entry_path(self, bo: bpy.types.Object, kind: str) -> Path:
+        name = hashlib.blake2b(f"{kind}:{bo.name}".encode(), digest_size=8).hexdigest()
+        return self._path.joinpath(f"{name}.bin")
+
+    def get(self, bo: bpy.types.Object, kind: str, digest: bytes) -> Optional[BakedLighting]:
+        try:
+            data = self._get_entry_path(bo, kind).read_bytes()
+            result = self._read(memoryview(data), kind, digest)
+        except (OSError, ValueError, struct.error, zlib.error):
+            result = None
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def _read(self, buf: memoryview, kind: str, digest: bytes) -> Optional[BakedLighting]:
+        magick, version, entry_digest = _HEADER.unpack_from(buf, 0)
+        if magick != _MAGICK or version != _VERSION or entry_digest != digest:
+            return None
+
+        pos = _HEADER.size
+        if kind == "vcol":
+            num_loops, = _VCOL_HEADER.unpack_from(buf, pos)
+            pos += _VCOL_HEADER.size
+            colors = np.frombuffer(zlib.decompress(buf[pos:]), dtype="<f4")
+            return BakedLighting(colors=colors.reshape(num_loops, 3))
+        else:
+            width, height, num_loops = _LIGHTMAP_HEADER.unpack_from(buf, pos)
+            pos += _LIGHTMAP_HEADER.size
+            data = zlib.decompress(buf[pos:])
+            num_pixel_bytes = width * height * 4
+            pixels = np.frombuffer(data, dtype=np.uint8, count=num_pixel_bytes)
+            uvs = np.frombuffer(data, dtype="<f4", offset=num_pixel_bytes).reshape(num_loops, 2)
+            return BakedLighting(width=width, height=height, pixels=pixels, uvs=uvs)
+
+    def add(self, bo: bpy.types.Object, kind: str, digest: bytes, baked: BakedLighting):
+        if kind == "vcol":
+            header = _VCOL_HEADER.pack(len(baked.colors))
+            payload = baked.colors.astype("<f4").tobytes()
+        else:
+            header = _LIGHTMAP_HEADER.pack(baked.width, baked.height, len(baked.uvs))
+            payload = baked.pixels.astype(np.uint8).tobytes() + baked.uvs.astype("<f4").tobytes()
+
+        self._path.mkdir(parents=True, exist_ok=True)
+        path = self._get_entry_path(bo, kind)
+        temp_path = path.with_name(f"{path.name}.tmp")
+        with temp_path.open("wb") as handle:
+            handle.write(_HEADER.pack(_MAGICK, _VERSION, digest))
+            handle.write(header)
+            handle.write(zlib.compress(payload))
+        os.replace(temp_path, path)
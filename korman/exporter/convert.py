@@ -21,25 +21,31 @@ from collections import defaultdict
 from contextlib import ExitStack
 import functools
 import inspect
+import os
 from pathlib import Path
 from typing import *
 
 from ..helpers import TemporaryObject
+from .. import idprops
 from ..korlib import ConsoleToggler
 
 from PyHSPlasma import *
 
 from .animation import AnimationConverter
+from .bakecache import BakeCache
 from .camera import CameraConverter
 from .decal import DecalConverter
 from . import explosions
 from .etlight import LightBaker
+from .fingerprint import PageFingerprints
 from .gui import GuiConverter
 from .image import ImageCache
 from .locman import LocalizationConverter
 from . import logger
 from .manager import ExportManager
 from .mesh import MeshConverter
+from .meshcache import MeshCache
+from .objindex import ExportObjectIndex
 from .outfile import OutputFiles
 from .physics import PhysicsConverter
 from .rtlight import LightConverter
@@ -48,13 +54,16 @@ from . import utils
 class Exporter:
 
     if TYPE_CHECKING:
-        _objects: List[bpy.types.Object]
+        _objects: ExportObjectIndex
+        _skipped_objects: ExportObjectIndex
+        _generated_objects: Dict[str, bpy.types.Object]
         actors: Set[str]
         want_node_trees: defaultdict[str, Set[Tuple[bpy.types.Object, plSceneObject]]]
         report: logger._ExportLogger
         exit_stack: ExitStack
         mgr: ExportManager
         mesh: MeshConverter
+        mesh_cache: MeshCache
         physics: PhysicsConverter
         light: LightConverter
         animation: AnimationConverter
@@ -65,10 +74,13 @@ class Exporter:
         decal: DecalConverter
         oven: LightBaker
         gui: GuiConverter
+        fingerprints: PageFingerprints
 
     def __init__(self, op):
         self._op = op # Blender export operator
-        self._objects = []
+        self._objects = ExportObjectIndex()
+        self._skipped_objects = ExportObjectIndex()
+        self._generated_objects = {}
         self.actors = set()
         self.want_node_trees = defaultdict(set)
         self.exported_nodes = {}
@@ -76,9 +88,11 @@ class Exporter:
 
     def run(self):
         log = logger.ExportVerboseLogger if self._op.verbose else logger.ExportProgressLogger
-        with ConsoleToggler(self._op.show_console), log(self._op.filepath) as self.report, ExitStack() as self.exit_stack:
+        profile = "TIMING" in getattr(self._op, "actions", set())
+        with ConsoleToggler(self._op.show_console), log(self._op.filepath, profile) as self.report, ExitStack() as self.exit_stack:
             # Step 0: Init export resmgr and stuff
             self.mgr = ExportManager(self)
+            self.mesh_cache = MeshCache(self)
             self.mesh = MeshConverter(self)
             self.physics = PhysicsConverter(self)
             self.light = LightConverter(self)
@@ -88,8 +102,12 @@ class Exporter:
             self.image = ImageCache(self)
             self.locman = LocalizationConverter(self)
             self.decal = DecalConverter(self)
-            self.oven = LightBaker(mesh=self.mesh, report=self.report)
+            bake_cache = BakeCache(self.bakecache_path) if self.lighting_method != "skip" else None
+            self.oven = LightBaker(mesh=self.mesh, report=self.report, cache=bake_cache)
+            self.oven.atlas_size = self.lightmap_atlas_size
+            self.oven.texel_density = self.lightmap_texel_density
             self.gui = GuiConverter(self)
+            self.fingerprints = PageFingerprints(self)
 
             # Step 0.8: Init the progress mgr
             self.mesh.add_progress_presteps(self.report)
@@ -97,6 +115,8 @@ class Exporter:
             self.report.progress_add_step("Verify Competence")
             self.report.progress_add_step("Touching the Intangible")
             self.report.progress_add_step("Unifying Superstrings")
+            if self.incremental_export:
+                self.report.progress_add_step("Fingerprinting Pages")
             self.report.progress_add_step("Harvesting Actors")
             if self._op.lighting_method != "skip":
                 LightBaker.add_progress_steps(self.report)
@@ -112,6 +132,10 @@ class Exporter:
 
             # Step 0.9: Apply modifiers to all meshes temporarily.
             with self.mesh:
+                # Step 0.95: Data appended from old blend files doesn't go through the load handlers,
+                #            so make sure nothing new is still referencing objects by name.
+                idprops.upgrade_new_idprops()
+
                 # Step 1: Create the age info and the pages
                 self._export_age_info()
 
@@ -127,9 +151,17 @@ class Exporter:
                 #           In other words, generate any ephemeral Blender objects that need to be exported.
                 self._pre_export_scene_objects()
 
+                # Step 2.2.1: The objects and their modifiers are now set in stone, so there's no
+                #             need to go looking for the enabled modifiers every time we ask.
+                self._snapshot_modifiers()
+
                 # Step 2.3: Run through all the objects and export localization.
                 self._export_localization()
 
+                # Step 2.4: If this is an incremental export, set aside everything in the pages
+                #           that have not changed since the last export.
+                self._skip_unchanged_pages()
+
                 # Step 2.5: Run through all the objects we collected in Step 2 and see if any relationships
                 #           that the artist made requires something to have a CoordinateInterface
                 self._harvest_actors()
@@ -174,6 +206,10 @@ class Exporter:
         if self._op.lighting_method != "skip":
             self.oven.bake_static_lighting(self._objects)
 
+            # Baking adds UV and vertex color layers to the meshes, so anything that was evaluated
+            # beforehand (eg by the GUI cameras) doesn't match what the mesh exporter will see.
+            self.mesh_cache.invalidate()
+
     def claim_object(
         self,
         claimant: bpy.types.bpy_struct,
@@ -310,7 +346,7 @@ class Exporter:
                                 f"'{obj.name}' is not in the same page as its parent '{parent_name}' "
                                 f"({parent_page or 'Default'})"
                             )
-                        self._objects.append(obj)
+                        self._objects.add(obj)
                     else:
                         # Successful object ignore
                         pass
@@ -415,7 +451,7 @@ class Exporter:
         for bl_obj in self._objects:
             log_msg(f"\n[SceneObject '{bl_obj.name}']")
 
-            with indent():
+            with indent(), self.fingerprints.track(bl_obj):
                 # First pass: do things specific to this object type.
                 #             note the function calls: to export a MESH, it's _export_mesh_blobj
                 export_fn = "_export_{}_blobj".format(bl_obj.type.lower())
@@ -432,13 +468,13 @@ class Exporter:
                 # sort, and barf out a CI.
                 sceneobject = self.mgr.find_create_object(plSceneObject, bl=bl_obj)
                 self._export_actor(sceneobject, bl_obj)
-                with indent():
+                with indent(), self.report.profile("object", bl_obj.name, export_fn.__name__, bl_obj.name):
                     export_fn(sceneobject, bl_obj)
 
                 # And now we puke out the modifiers...
                 for mod in bl_obj.plasma_modifiers.modifiers:
                     log_msg(f"Exporting '{mod.bl_label}' modifier")
-                    with indent():
+                    with indent(), self.report.profile("modifier", mod.bl_label, "export", bl_obj.name):
                         mod.export(self, bl_obj, sceneobject)
             inc_progress()
 
@@ -480,14 +516,19 @@ class Exporter:
                 with indent():
                     tree = bpy.data.node_groups[tree_name]
                     for bo, so in references:
-                        tree.export(self, bo, so)
+                        with self.fingerprints.track(bo):
+                            tree.export(self, bo, so)
                 inc_progress()
 
-    def get_objects(self, page: Optional[str]) -> Iterator[bpy.types.Object]:
-        yield from filter(
-            lambda x: x.plasma_object.page == page,
-            self._objects
-        )
+    def get_objects(self, page: Optional[str], *, type: Optional[str] = None,
+                    modifier: Optional[str] = None) -> Iterator[bpy.types.Object]:
+        """Gets the exported objects in a page, optionally only those of the given Blender
+           object type or with the given Plasma modifier enabled"""
+        if modifier is not None:
+            objects = self._objects.by_modifier(modifier, page)
+            yield from (i for i in objects if type is None or i.type == type)
+        else:
+            yield from self._objects.by_page(page, type)
 
     def _harvest_actors(self):
         self.report.progress_advance()
@@ -510,6 +551,10 @@ class Exporter:
                     self.actors.add(viewpt.name)
             inc_progress()
 
+    def _snapshot_modifiers(self):
+        from ..properties.modifiers import PlasmaModifiers
+        self.exit_stack.enter_context(PlasmaModifiers.snapshot(self._objects))
+
     def has_coordiface(self, bo):
         if bo.type in {"CAMERA", "EMPTY", "LAMP"}:
             return True
@@ -520,20 +565,14 @@ class Exporter:
         if bo.plasma_object.has_transform_animation:
             return True
 
-        for mod in bo.plasma_modifiers.modifiers:
-            if mod.enabled:
-                if mod.requires_actor:
-                    return True
-        return False
+        return bo.plasma_modifiers.test_property("requires_actor")
 
     def is_enabled(self, bl: bpy.types.Object) -> bool:
         """
         Just because an object's Plasma Object checkbox is marked enabled doesn't mean it will
         be exported. This method returns a guaranteed YES when an object will be exported.
         """
-        # This is maybe not the most performant way to do this check, but it will give us the
-        # right answer. It's done infrequently enough that it shouldn't be a big deal.
-        return bl in self._objects
+        return bl in self._objects or bl in self._skipped_objects
 
     def _post_process_scene_objects(self):
         self.report.progress_advance()
@@ -561,12 +600,12 @@ class Exporter:
                         net.propagate_synch_options(sceneobject, layer)
 
             # Modifiers don't have to expose post-processing, but if they do, run it
-            with indent():
+            with indent(), self.fingerprints.track(bl_obj):
                 for mod in bl_obj.plasma_modifiers.modifiers:
                     proc = getattr(mod, "post_export", None)
                     if proc is not None:
                         self.report.msg(f"Post processing '{bl_obj.name}' modifier '{mod.bl_label}'")
-                        with indent():
+                        with indent(), self.report.profile("modifier", mod.bl_label, "post_export", bl_obj.name):
                             proc(self, bl_obj, sceneobject)
             inc_progress()
 
@@ -610,6 +649,7 @@ class Exporter:
             )
             if temporary.plasma_object.enabled:
                 new_objects.append(temporary)
+                self._generated_objects[temporary.name] = self._generated_objects.get(parent.name, parent)
 
                 # If the object is marked as a Plasma Object, be sure that we go into the same page
                 # as the requestor, unless the modifier decided it knows better.
@@ -658,22 +698,23 @@ class Exporter:
                     # yield my_object
                     # my_object.foo = bar
                     # ```
-                    pre_result = proc(self, bo)
-                    assert \
-                        inspect.isgenerator(pre_result) or pre_result is None, \
-                        "pre_export() should return a generator or None"
-                    try:
-                        gen_result = None
-                        while pre_result is not None:
-                            gen_result = pre_result.send(gen_result)
-                            if gen_result is not None:
-                                gen_result = handle_temporary(gen_result, bo)
-                    except StopIteration as e:
-                        if e.value is not None:
-                            handle_temporary(e.value, bo)
-                    finally:
-                        if pre_result is not None:
-                            pre_result.close()
+                    with self.report.profile("modifier", mod.bl_label, "pre_export", bo.name):
+                        pre_result = proc(self, bo)
+                        assert \
+                            inspect.isgenerator(pre_result) or pre_result is None, \
+                            "pre_export() should return a generator or None"
+                        try:
+                            gen_result = None
+                            while pre_result is not None:
+                                gen_result = pre_result.send(gen_result)
+                                if gen_result is not None:
+                                    gen_result = handle_temporary(gen_result, bo)
+                        except StopIteration as e:
+                            if e.value is not None:
+                                handle_temporary(e.value, bo)
+                        finally:
+                            if pre_result is not None:
+                                pre_result.close()
 
         with indent():
             for bl_obj in self._objects:
@@ -681,7 +722,7 @@ class Exporter:
                 inc_progress()
 
         log_msg(f"... {len(new_objects)} new object(s) were generated!")
-        self._objects += new_objects
+        self._objects.extend(new_objects)
 
     def _pack_ancillary_python(self):
         texts = bpy.data.texts
@@ -694,6 +735,22 @@ class Exporter:
                 self.output.add_python_code(i.name, text_id=i)
             inc_progress()
 
+    def _skip_unchanged_pages(self):
+        if not self.incremental_export:
+            return
+
+        export_objects = ExportObjectIndex(self.fingerprints.plan(self._objects, self._generated_objects))
+        self._skipped_objects = ExportObjectIndex(i for i in self._objects if i not in export_objects)
+        self._objects = export_objects
+
+        # Logic trees requested by skipped objects must not leak into the changed pages.
+        for tree_name, references in list(self.want_node_trees.items()):
+            references = {(bo, so) for bo, so in references if bo in export_objects}
+            if references:
+                self.want_node_trees[tree_name] = references
+            else:
+                del self.want_node_trees[tree_name]
+
     def _save_age(self):
         self.report.progress_advance()
         self.report.msg("\nWriting Age data...")
@@ -705,6 +762,8 @@ class Exporter:
                 self.locman.save()
                 self.mgr.save_age()
                 self.output.save()
+                self.fingerprints.save()
+                self.physics.cache.save()
             finally:
                 self.image.save()
 
@@ -719,6 +778,10 @@ class Exporter:
     def age_sdl(self) -> bool:
         return bpy.context.scene.world.plasma_age.age_sdl
 
+    @property
+    def bakecache_path(self) -> Path:
+        return self._sidecar_path(".kbc")
+
     @property
     def dat_only(self):
         return self._op.dat_only
@@ -727,6 +790,41 @@ class Exporter:
     def envmap_method(self):
         return bpy.context.scene.world.plasma_age.envmap_method
 
+    @property
+    def fingerprints_path(self) -> Path:
+        return self._sidecar_path(".kfp")
+
+    @property
+    def incremental_export(self) -> bool:
+        return bpy.context.scene.world.plasma_age.incremental_export
+
+    @property
+    def lighting_method(self):
+        return bpy.context.scene.world.plasma_age.lighting_method
+
+    @property
+    def lightmap_atlas_size(self) -> int:
+        return int(bpy.context.scene.world.plasma_age.lightmap_atlas_size)
+
+    @property
+    def lightmap_texel_density(self) -> float:
+        return bpy.context.scene.world.plasma_age.lightmap_texel_density
+
+    @property
+    def optimize_vertex_cache(self) -> bool:
+        return bpy.context.scene.world.plasma_age.optimize_vertex_cache
+
+    @property
+    def physcache_path(self) -> Path:
+        return self._sidecar_path(".kpc")
+
+    def _sidecar_path(self, suffix: str) -> Path:
+        """Gets the path of a file stored alongside the blend file (or the Age, if unsaved)"""
+        filepath = bpy.context.blend_data.filepath
+        if not filepath:
+            filepath = self._op.filepath
+        return Path(filepath).with_suffix(suffix)
+
     @property
     def python_method(self):
         return bpy.context.scene.world.plasma_age.python_method
@@ -741,13 +839,17 @@ class Exporter:
             valid_path = False
 
         if not valid_path:
-            filepath = bpy.context.blend_data.filepath
-            if not filepath:
-                filepath = self._op.filepath
-            filepath = str(Path(filepath).with_suffix(".ktc"))
+            filepath = str(self._sidecar_path(".ktc"))
             age.texcache_path = filepath
         return filepath
 
     @property
     def texcache_method(self):
         return bpy.context.scene.world.plasma_age.texcache_method
+
+    @property
+    def texture_threads(self) -> int:
+        num_threads = bpy.context.scene.world.plasma_age.texture_threads
+        if num_threads == 0:
+            num_threads = os.cpu_count() or 1
+        return num_threads
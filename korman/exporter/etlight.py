@@ -16,19 +16,41 @@
 import bpy
 
 from contextlib import contextmanager
+import hashlib
 import itertools
+import numpy as np
+from typing import *
 
+from .atlas import calc_chart_size, pack_squares
+from .bakecache import BakedLighting, hash_mesh_geometry
 from .explosions import *
+from .fingerprint import DataHasher
+from ..korlib import read_float_pixels
 from .logger import ExportProgressLogger, ExportVerboseLogger
 from .mesh import _MeshManager, _VERTEX_COLOR_LAYERS
+from .objindex import ExportObjectIndex
 from ..helpers import *
 
 _NUM_RENDER_LAYERS = 20
 
+
+# Lightmap atlas chart sizes, in pixels
+_MIN_ATLAS_CHART_SIZE = 16
+_ATLAS_CHART_PADDING = 2
+
+
+class _ShadowCaster(NamedTuple):
+    name: str
+    layers: FrozenSet[int]
+    bounds_min: np.ndarray
+    bounds_max: np.ndarray
+    digest: bytes
+
+
 class LightBaker:
     """ExportTime Lighting"""
 
-    def __init__(self, *, mesh=None, report=None, verbose=False):
+    def __init__(self, *, mesh=None, report=None, verbose=False, cache=None):
         self._lightgroups = {}
         if report is None:
             self._report = ExportVerboseLogger() if verbose else ExportProgressLogger()
@@ -50,9 +72,20 @@ class LightBaker:
         self.retain_lightmap_uvtex = True
         self.force = False
         self._lightmap_images = {}
+        self._lightmap_atlases = {}
         self._uvtexs = {}
         self._active_vcols = {}
 
+        # Lighting for objects that haven't changed since their last bake can be restored from
+        # a BakeCache instead of baking it again.
+        self._cache = cache
+        self._restored_lightmaps = []
+
+        # If nonzero, lightmaps are packed into shared atlases of up to this size instead
+        # of getting their own images.
+        self.atlas_size = 0
+        self.texel_density = 16.0
+
     def __del__(self):
         if self._own_report:
             self._report.progress_end()
@@ -112,6 +145,9 @@ class LightBaker:
 
         self._report.msg("\nBaking Static Lighting...")
 
+        if not isinstance(objs, ExportObjectIndex):
+            objs = ExportObjectIndex(objs)
+
         with GoodNeighbor() as toggle, self._report.indent():
             try:
                 # reduce the amount of indentation
@@ -140,18 +176,30 @@ class LightBaker:
         #           This prevents context operators from phailing.
         bpy.context.scene.layers = (True,) * _NUM_RENDER_LAYERS
 
+        # Step 0.95: Restore the lighting of anything that hasn't changed since it was last baked.
+        #            The fingerprints have to be taken before prep because it swaps out the
+        #            material light groups.
+        if self._cache is not None:
+            digests = self._restore_cached_lighting(bake)
+            num_restored = self._cache.hits
+        else:
+            digests = {}
+            num_restored = 0
+
         # Step 1: Prepare... Apply UVs, etc, etc, etc
         self._report.progress_advance()
         self._report.progress_range = len(bake)
         self._report.msg("Preparing to bake...")
         with self._report.indent():
-            for key, value in bake.items():
+            for pass_idx, (key, value) in enumerate(bake.items()):
                 if key[0] == "lightmap":
                     for i in range(len(value)-1, -1, -1):
                         obj = value[i]
                         if not self._prep_for_lightmap(obj, toggle):
                             self._report.msg(f"Lightmap '{obj.name}' will not be baked -- no applicable lights")
                             value.pop(i)
+                    if self.atlas_size and value:
+                        self._pack_lightmap_atlases(value, pass_idx)
                 elif key[0] == "vcol":
                     for i in range(len(value)-1, -1, -1):
                         obj = value[i]
@@ -178,16 +226,167 @@ class LightBaker:
                         with self._report.indent():
                             self._report.warn(f"Small lightmap bake pass! Bake Pass(es): {pass_msg}")
                     self._bake_lightmaps(value, key[1:])
+                    if self._cache is not None and not self.atlas_size:
+                        self._store_baked_lightmaps(value, digests)
                 elif key[0] == "vcol":
                     self._report.msg("{} Vertex Color(s) [H:{:X}]", len(value), hash(key[1:]))
                     self._bake_vcols(value, key[1:])
                     self._fix_vertex_colors(value)
+                    if self._cache is not None:
+                        self._store_baked_vcols(value, digests)
                 else:
                     raise RuntimeError(key[0])
             inc_progress()
 
         # Return how many thingos we baked
-        return sum(map(len, bake.values()))
+        return sum(map(len, bake.values())) + num_restored
+
+    def _apply_cached_lightmap(self, bo, baked):
+        mesh = bo.data
+        uv_textures = mesh.uv_textures
+
+        im = self._create_lightmap_image(self.get_lightmap_name(bo), baked.width, baked.height)
+        pixels = baked.pixels.astype(np.float32) / 255.0
+        if hasattr(im.pixels, "foreach_set"):
+            im.pixels.foreach_set(pixels)
+        else:
+            im.pixels = pixels.tolist()
+        im.pack(as_png=True)
+        self._lightmap_images[bo.name] = im
+
+        uvtex = uv_textures.get(self.lightmap_uvtex_name, None)
+        if uvtex is not None:
+            uv_textures.remove(uvtex)
+        if uv_textures.active is not None:
+            self._uvtexs[mesh.name] = uv_textures.active.name
+        uvtex = uv_textures.new(self.lightmap_uvtex_name)
+        mesh.uv_layers[uvtex.name].data.foreach_set("uv", baked.uvs.ravel())
+        self._associate_image_with_uvtex(uvtex, im)
+        self._restored_lightmaps.append(bo)
+
+    def _apply_cached_vcols(self, bo, baked):
+        vcols = bo.data.vertex_colors
+        autocolor = vcols.get(self.vcol_layer_name)
+        if autocolor is None:
+            autocolor = vcols.new(self.vcol_layer_name)
+            if not self.force:
+                self._mesh.context_stack.enter_context(TemporaryObject(autocolor.name, lambda layer_name: vcols.remove(vcols[layer_name])))
+        autocolor.data.foreach_set("color", baked.colors.ravel())
+
+    def _calc_bake_digest(self, bo, key, hasher, scene_digest, casters):
+        digest = hashlib.blake2b(scene_digest, digest_size=16)
+        digest.update(repr(key).encode())
+        digest.update(repr((tuple(itertools.chain.from_iterable(bo.matrix_world)), tuple(bo.layers))).encode())
+
+        mesh = bo.data
+        modifier = bo.plasma_modifiers.lightmap
+        if key[0] == "lightmap":
+            digest.update(repr((modifier.resolution, modifier.uv_map, self._mesh.is_collapsed(bo))).encode())
+        hash_mesh_geometry(mesh, digest, (self.lightmap_uvtex_name, self.vcol_layer_name))
+        self._hash_modifiers(bo, hasher, digest)
+        self._hash_materials(mesh, hasher, digest)
+
+        # Only the lamps that actually reach this object matter.
+        user_lg = modifier.lights if modifier.enabled else None
+        if user_lg:
+            lamps = user_lg.objects
+        else:
+            lamps = itertools.chain.from_iterable((self._filter_bake_lamps(bo, i.light_group)
+                                                   for i in mesh.materials if i is not None))
+        lamps = sorted(frozenset(lamps), key=lambda x: x.name)
+        for lamp in lamps:
+            hasher.hash_struct(lamp, digest)
+
+        # Only the meshes that can come between this object and its light can shadow it.
+        bounds_min, bounds_max = self._calc_shadow_bounds(bo, lamps)
+        pass_layers = frozenset((i for i, value in enumerate(key[1:]) if value))
+        for caster in casters:
+            if not caster.layers & pass_layers:
+                continue
+            if np.all(caster.bounds_min <= bounds_max) and np.all(bounds_min <= caster.bounds_max):
+                digest.update(caster.digest)
+        return digest.digest()
+
+    def _calc_bounds(self, bo):
+        matrix = np.array(bo.matrix_world, dtype=np.float64)
+        corners = np.array(bo.bound_box, dtype=np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+        return corners.min(axis=0), corners.max(axis=0)
+
+    def _calc_scene_digest(self, hasher):
+        scene = bpy.context.scene
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((self.vcol_layer_name, self.lightmap_uvtex_name)).encode())
+
+        render = scene.render
+        digest.update(repr((render.bake_margin, render.bake_bias, render.bake_aa_mode,
+                            render.use_bake_antialiasing)).encode())
+        world = scene.world
+        if world is not None:
+            hasher.hash_struct(world.light_settings, digest)
+            digest.update(repr((tuple(world.ambient_color), tuple(world.horizon_color),
+                                tuple(world.zenith_color))).encode())
+
+        return digest.digest()
+
+    def _calc_shadow_bounds(self, bo, lamps):
+        """Gets the world space box that anything shadowing an object has to be in"""
+        bounds_min, bounds_max = self._calc_bounds(bo)
+        unbounded = np.full(3, np.inf)
+
+        # Shadows from a lamp are cast along the lines between the lamp and the object, so they
+        # all fit in a box around both. The sun is infinitely far away, so it has no such box.
+        for lamp in (i for i in lamps if i.type == "LAMP"):
+            if lamp.data.type == "SUN":
+                return -unbounded, unbounded
+            pos = np.array(lamp.matrix_world.to_translation(), dtype=np.float64)
+            size = max(lamp.data.size, lamp.data.size_y) if lamp.data.type == "AREA" else 0.0
+            bounds_min = np.minimum(bounds_min, pos - size)
+            bounds_max = np.maximum(bounds_max, pos + size)
+
+        # Indirect lighting bounces off of everything. Ambient occlusion and environment lighting
+        # are occluded by anything within their ray distance.
+        world = bpy.context.scene.world
+        if world is not None:
+            light_settings = world.light_settings
+            if light_settings.use_indirect_light:
+                return -unbounded, unbounded
+            if light_settings.use_ambient_occlusion or light_settings.use_environment_light:
+                bounds_min = bounds_min - light_settings.distance
+                bounds_max = bounds_max + light_settings.distance
+        return bounds_min, bounds_max
+
+    def _collect_shadow_casters(self, hasher):
+        casters = []
+        for bo in bpy.context.scene.objects:
+            # Meshes without materials are hidden during the bake.
+            if bo.type != "MESH" or bo.hide_render or not self._has_valid_material(bo):
+                continue
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(repr((bo.name, tuple(itertools.chain.from_iterable(bo.matrix_world)))).encode())
+            hash_mesh_geometry(bo.data, digest, (self.lightmap_uvtex_name, self.vcol_layer_name))
+            self._hash_modifiers(bo, hasher, digest)
+            self._hash_materials(bo.data, hasher, digest)
+            bounds_min, bounds_max = self._calc_bounds(bo)
+            layers = frozenset((i for i, value in enumerate(bo.layers) if value))
+            casters.append(_ShadowCaster(bo.name, layers, bounds_min, bounds_max, digest.digest()))
+        casters.sort(key=lambda x: x.name)
+        return casters
+
+    def _hash_materials(self, mesh, hasher, digest):
+        # This includes the shadow settings, which matter just as much for the shadow casters.
+        for material in mesh.materials:
+            if material is None:
+                digest.update(b"\0")
+            else:
+                hasher.hash_struct(material, digest)
+
+    def _hash_modifiers(self, bo, hasher, digest):
+        # Objects collapsed by the mesh manager already have their modifiers applied to their
+        # mesh, but the modifiers were removed from the object, so hash what was set aside.
+        for mod in bo.modifiers:
+            hasher.hash_struct(mod, digest)
+        for props in self._mesh.get_collapsed_modifiers(bo):
+            digest.update(repr(sorted(props.items())).encode())
 
     @contextmanager
     def _bmesh_from_mesh(self, mesh):
@@ -200,6 +399,35 @@ class LightBaker:
         finally:
             bm.free()
 
+    def _create_lightmap_image(self, im_name, width, height):
+        data_images = bpy.data.images
+        im = data_images.get(im_name)
+        if im is None:
+            im = data_images.new(im_name, width=width, height=height)
+        elif tuple(im.size) != (width, height):
+            # Force delete and recreate the image because the size is out of date
+            data_images.remove(im)
+            im = data_images.new(im_name, width=width, height=height)
+        return im
+
+    def _filter_bake_lamps(self, bo, lg):
+        """Gets the lamps from a light group that should be baked onto an object"""
+        if not lg or bool(lg.objects) is False:
+            source = [i for i in bpy.context.scene.objects if i.type == "LAMP"]
+        else:
+            source = lg.objects
+
+        # Rules:
+        # 1) No animated lights, period.
+        # 2) If we accept runtime lighting, no Plasma Objects
+        rtl_mod = bo.plasma_modifiers.lighting
+        for obj in source:
+            if obj.plasma_object.has_animation_data:
+                continue
+            if rtl_mod.rt_lights and obj.plasma_object.is_tree_enabled:
+                continue
+            yield obj
+
     def _fix_vertex_colors(self, blender_objects):
         # Blender's lightmapper has a bug which allows vertices to "self-occlude" when shared between
         # two faces. See here https://forum.guildofwriters.org/viewtopic.php?f=9&t=6576&p=68939
@@ -276,25 +504,12 @@ class LightBaker:
                 self._lightgroups[mat_name] = lg
 
             if not user_lg:
-                if not lg or bool(lg.objects) is False:
-                    source = [i for i in bpy.context.scene.objects if i.type == "LAMP"]
-                else:
-                    source = lg.objects
                 dest = bpy.data.groups.new("_LIGHTMAPGEN_{}_{}".format(bo.name, mat_name))
-
-                # Rules:
-                # 1) No animated lights, period.
-                # 2) If we accept runtime lighting, no Plasma Objects
-                rtl_mod = bo.plasma_modifiers.lighting
-                for obj in source:
-                    if obj.plasma_object.has_animation_data:
-                        continue
-                    if rtl_mod.rt_lights and obj.plasma_object.is_tree_enabled:
-                        continue
+                for obj in self._filter_bake_lamps(bo, lg):
                     dest.objects.link(obj)
                     shouldibake = True
             else:
-                # The aforementioned rules do not apply. You better hope you know WTF you are
+                # The rules in _filter_bake_lamps do not apply. You better hope you know WTF you are
                 # doing. I'm not going to help!
                 dest = user_lg
             material.light_group = dest
@@ -303,6 +518,11 @@ class LightBaker:
     def get_lightmap(self, bo):
         return self._lightmap_images.get(bo.name)
 
+    def get_lightmap_atlas(self, bo):
+        """Gets a name identifying the lightmap atlas and UV channel used by an object. Objects
+           with the same name can share lightmapped materials."""
+        return self._lightmap_atlases.get(bo.name)
+
     def get_lightmap_name(self, bo):
         return self.lightmap_name.format(bo.name)
 
@@ -350,7 +570,7 @@ class LightBaker:
                 return False
             return True
 
-        for i in filter(lambda x: x.type == "MESH" and bool(x.data.materials), objs):
+        for i in filter(lambda x: bool(x.data.materials), objs.by_type("MESH")):
             mods = i.plasma_modifiers
             lightmap_mod = mods.lightmap
             if lightmap_mod.enabled:
@@ -389,6 +609,49 @@ class LightBaker:
             if im is not None and im.is_dirty:
                 im.pack(as_png=True)
 
+    def _pack_lightmap_atlases(self, objs, pass_idx):
+        # Objects using the same mesh share the same lightmap UVs, so they have to share a chart.
+        meshes = {}
+        for bo in objs:
+            meshes.setdefault(bo.data.name, bo)
+
+        sizes = []
+        for bo in meshes.values():
+            areas = np.empty(len(bo.data.polygons), dtype=np.float32)
+            bo.data.polygons.foreach_get("area", areas)
+            area = float(areas.sum()) * abs(bo.matrix_world.to_3x3().determinant()) ** (2.0 / 3.0)
+            max_size = min(bo.plasma_modifiers.lightmap.resolution, self.atlas_size)
+            sizes.append(calc_chart_size(area, self.texel_density, _MIN_ATLAS_CHART_SIZE, max_size))
+        rects, atlas_sizes = pack_squares(sizes, self.atlas_size)
+
+        atlas_names = [f"LightmapAtlas{pass_idx}_{i}" for i in range(len(atlas_sizes))]
+        images = [self._create_lightmap_image(self.lightmap_name.format(name), size, size)
+                  for name, size in zip(atlas_names, atlas_sizes)]
+
+        charts = {}
+        for (mesh_name, bo), rect in zip(meshes.items(), rects):
+            mesh, atlas_size = bo.data, atlas_sizes[rect.atlas]
+            charts[mesh_name] = rect
+
+            # Squish the unwrapped UVs into this object's square, leaving a bit of a border so
+            # that texture filtering doesn't bleed the neighbors into each other.
+            uv_layer = mesh.uv_layers[self.lightmap_uvtex_name]
+            uvs = np.empty(len(uv_layer.data) * 2, dtype=np.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+            uvs = uvs.reshape(-1, 2)
+            padding = min(_ATLAS_CHART_PADDING, rect.size // 8)
+            uvs *= (rect.size - padding * 2) / atlas_size
+            uvs += np.array((rect.x + padding, rect.y + padding), dtype=np.float32) / atlas_size
+            uv_layer.data.foreach_set("uv", uvs.ravel())
+            self._associate_image_with_uvtex(mesh.uv_textures[self.lightmap_uvtex_name], images[rect.atlas])
+
+        for bo in objs:
+            rect = charts[bo.data.name]
+            uvw_src = next(i for i, uvtex in enumerate(bo.data.uv_textures) if uvtex.name == self.lightmap_uvtex_name)
+            self._lightmap_images[bo.name] = images[rect.atlas]
+            self._lightmap_atlases[bo.name] = f"{atlas_names[rect.atlas]}_UV{uvw_src}"
+        self._report.msg("Packed {} lightmap(s) into {} atlas(es)", len(objs), len(images))
+
     def _pop_lightgroups(self):
         materials = bpy.data.materials
         for mat_name, lg in self._lightgroups.items():
@@ -421,19 +684,14 @@ class LightBaker:
         if not self._generate_lightgroup(bo, modifier.lights):
             return False
 
-        # We need to ensure that we bake onto the "BlahObject_LIGHTMAPGEN" image
-        data_images = bpy.data.images
-        im_name = self.get_lightmap_name(bo)
-        size = modifier.resolution
-
-        im = data_images.get(im_name)
-        if im is None:
-            im = data_images.new(im_name, width=size, height=size)
-        elif im.size[0] != size:
-            # Force delete and recreate the image because the size is out of date
-            data_images.remove(im)
-            im = data_images.new(im_name, width=size, height=size)
-        self._lightmap_images[bo.name] = im
+        # We need to ensure that we bake onto the "BlahObject_LIGHTMAPGEN" image, unless this
+        # object is going into an atlas. Those are made once everything has been unwrapped.
+        if self.atlas_size:
+            im = None
+        else:
+            size = modifier.resolution
+            im = self._create_lightmap_image(self.get_lightmap_name(bo), size, size)
+            self._lightmap_images[bo.name] = im
 
         with self._report.indent():
             self._prep_for_lightmap_uvs(bo, im, toggle)
@@ -548,12 +806,40 @@ class LightBaker:
 
     def _remove_stale_uvtexes(self, bake):
         lightmap_iter = itertools.chain.from_iterable((value for key, value in bake.items() if key[0] == "lightmap"))
+        lightmap_iter = itertools.chain(lightmap_iter, self._restored_lightmaps)
         for bo in lightmap_iter:
             uv_textures = bo.data.uv_textures
             uvtex = uv_textures.get(self.lightmap_uvtex_name, None)
             if uvtex is not None:
                 uv_textures.remove(uvtex)
 
+    def _restore_cached_lighting(self, bake):
+        self._report.msg("Checking for cached lighting...")
+        with self._report.indent():
+            hasher = DataHasher(frozenset())
+            scene_digest = self._calc_scene_digest(hasher)
+            casters = self._collect_shadow_casters(hasher)
+            digests = {bo.name: self._calc_bake_digest(bo, key, hasher, scene_digest, casters)
+                       for key, value in bake.items() for bo in value}
+
+            for key, value in bake.items():
+                # Atlases have to be baked as a whole, so there's no restoring just some of them.
+                if key[0] == "lightmap" and self.atlas_size:
+                    continue
+                for i in range(len(value)-1, -1, -1):
+                    bo = value[i]
+                    baked = self._cache.get(bo, key[0], digests[bo.name])
+                    if baked is None:
+                        continue
+                    if key[0] == "lightmap":
+                        self._apply_cached_lightmap(bo, baked)
+                    else:
+                        self._apply_cached_vcols(bo, baked)
+                    self._report.msg("'{}': Restored {} from the cache", bo.name, key[0])
+                    value.pop(i)
+        self._report.msg("Bake cache: {} restored, {} to bake", self._cache.hits, self._cache.misses)
+        return digests
+
     def _restore_uvtexs(self):
         for mesh_name, uvtex_name in self._uvtexs.items():
             mesh = bpy.data.meshes[mesh_name]
@@ -581,6 +867,7 @@ class LightBaker:
                 if isinstance(i.data, bpy.types.Mesh) and not self._has_valid_material(i):
                     toggle.track(i, "hide_render", True)
         else:
+            objs = ExportObjectIndex(objs)
             for i in bpy.data.objects:
                 value = i in objs
                 if value:
@@ -599,3 +886,24 @@ class LightBaker:
             yield
         finally:
             bpy.ops.object.mode_set(mode="OBJECT")
+
+    def _store_baked_lightmaps(self, objs, digests):
+        for bo in objs:
+            im = self.get_lightmap(bo)
+            width, height = im.size
+            pixels = read_float_pixels(im.pixels, width * height * im.channels)
+            pixels = np.clip(np.rint(pixels * 255.0), 0, 255).astype(np.uint8)
+
+            uv_layer = bo.data.uv_layers[self.lightmap_uvtex_name]
+            uvs = np.empty(len(uv_layer.data) * 2, dtype=np.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+
+            baked = BakedLighting(width=width, height=height, pixels=pixels, uvs=uvs.reshape(-1, 2))
+            self._cache.add(bo, "lightmap", digests[bo.name], baked)
+
+    def _store_baked_vcols(self, objs, digests):
+        for bo in objs:
+            autocolor = bo.data.vertex_colors[self.vcol_layer_name]
+            colors = np.empty(len(autocolor.data) * 3, dtype=np.float32)
+            autocolor.data.foreach_get("color", colors)
+            self._cache.add(bo, "vcol", digests[bo.name], BakedLighting(colors=colors.reshape(-1, 3)))
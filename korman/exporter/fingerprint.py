@@ -0,0 +1,525 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bpy
+
+from collections import defaultdict
+from contextlib import contextmanager
+import hashlib
+import json
+import numpy as np
+import os
+from pathlib import Path
+from typing import *
+import weakref
+
+from .. import bl_info
+from ..korlib import read_float_pixels
+
+_FINGERPRINT_VERSION = 1
+_DIGEST_SIZE = 16
+
+# Blender structs that are not IDs or PropertyGroups can nest quite deeply (and circularly),
+# so we only descend a few levels into them.
+_MAX_STRUCT_DEPTH = 3
+
+# Collections of plain Blender structs that are worth walking. Everything else is either
+# handled explicitly (mesh geometry, animation curves, ...) or irrelevant to the export.
+_WALK_COLLECTIONS = frozenset({
+    "constraints",
+    "inputs",
+    "material_slots",
+    "modifiers",
+    "nodes",
+    "outputs",
+    "texture_slots",
+})
+
+# Properties that only reflect the state of Blender's UI, that are derived from data we hash
+# explicitly, or that only change how the exporter runs. None of these change the PRPs.
+_VOLATILE_PROPS = frozenset({
+    "rna_type",
+    "active_material_index",
+    "active_shape_key_index",
+    "bindcode",
+    "current_character",
+    "current_line",
+    "current_line_index",
+    "export_active",
+    "factory",
+    "has_data",
+    "hide",
+    "hide_select",
+    "incremental_export",
+    "is_dirty",
+    "is_editmode",
+    "is_library_indirect",
+    "is_updated",
+    "is_updated_data",
+    "packed_file",
+    "packed_files",
+    "pixels",
+    "select",
+    "select_end_character",
+    "select_end_line",
+    "show_console",
+    "show_expanded",
+    "tag",
+    "texcache_method",
+    "texcache_path",
+    "texture_threads",
+    "total_edge_sel",
+    "total_face_sel",
+    "total_vert_sel",
+    "use_fake_user",
+    "users",
+    "verbose",
+})
+
+# Meshes with modifiers are swapped for temporary copies during the export, so their names
+# are not stable from one export to the next.
+_VOLATILE_TYPE_PROPS = {
+    "Mesh": frozenset({"name"}),
+}
+
+
+def _plain(value):
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    try:
+        return tuple(_plain(i) for i in value)
+    except TypeError:
+        return repr(value)
+
+
+class DataHasher:
+    """Hashes Blender data by walking its RNA. References to the objects named in `exported`
+       are hashed by name only, because those objects are hashed as part of their own pages.
+    """
+
+    def __init__(self, exported: Set[str]):
+        self._exported = exported
+        self._ids = {}
+        self._props = {}
+
+        self._id_handlers = (
+            (bpy.types.Action, self._hash_action),
+            (bpy.types.Curve, self._hash_curve),
+            (bpy.types.Image, self._hash_image),
+            (bpy.types.Key, self._hash_shape_keys),
+            (bpy.types.Mesh, self._hash_mesh),
+            (bpy.types.NodeTree, self._hash_node_links),
+            (bpy.types.Sound, self._hash_sound),
+            (bpy.types.Text, self._hash_text),
+        )
+
+    def hash_object(self, bo: bpy.types.Object) -> Tuple[bytes, FrozenSet[Tuple[str, str]]]:
+        """Hashes an exported Blender Object. Returns the digest and the set of tokens that
+           link this object to other pages."""
+        hasher = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+        tokens = set()
+        self._walk(bo, hasher, tokens, 0, set())
+        return hasher.digest(), frozenset(tokens)
+
+    def hash_struct(self, struct, hasher):
+        """Feeds any Blender struct into the given hasher"""
+        self._walk(struct, hasher, set(), 0, set())
+
+    def _get_props(self, struct):
+        rna = struct.bl_rna
+        props = self._props.get(rna.identifier)
+        if props is None:
+            volatile = _VOLATILE_PROPS | _VOLATILE_TYPE_PROPS.get(rna.identifier, frozenset())
+            props = tuple((i.identifier, i.type) for i in rna.properties
+                          if i.identifier not in volatile)
+            self._props[rna.identifier] = props
+        return props
+
+    def _hash_id(self, id_data: bpy.types.ID, tokens: Set[Tuple[str, str]]) -> bytes:
+        if isinstance(id_data, bpy.types.Object) and id_data.name in self._exported:
+            # Exported objects are hashed as part of their own page. All we need to know
+            # here is that there is a link to that page.
+            tokens.add(("OB", id_data.name))
+            return id_data.name.encode()
+        if isinstance(id_data, bpy.types.NodeTree):
+            # Logic trees can generate keys shared by every object that uses them.
+            tokens.add(("NT", id_data.name))
+
+        key = (id_data.bl_rna.identifier, id_data.name)
+        result = self._ids.get(key)
+        if result is None:
+            # Guard against circular references while this ID is being walked.
+            self._ids[key] = (id_data.name.encode(), frozenset())
+
+            hasher = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+            id_tokens = set()
+            self._walk(id_data, hasher, id_tokens, 0, set())
+            for id_type, handler in self._id_handlers:
+                if isinstance(id_data, id_type):
+                    handler(id_data, hasher, id_tokens)
+            result = (hasher.digest(), frozenset(id_tokens))
+            self._ids[key] = result
+
+        digest, id_tokens = result
+        tokens.update(id_tokens)
+        return digest
+
+    def _walk(self, struct, hasher, tokens, depth, visited):
+        update = hasher.update
+        for identifier, prop_type in self._get_props(struct):
+            try:
+                value = getattr(struct, identifier)
+            except AttributeError:
+                continue
+
+            if prop_type == "POINTER":
+                update(identifier.encode())
+                self._walk_pointer(value, hasher, tokens, depth, visited)
+            elif prop_type == "COLLECTION":
+                first = next(iter(value), None)
+                if first is None:
+                    continue
+                if identifier in _WALK_COLLECTIONS or isinstance(first, bpy.types.PropertyGroup):
+                    update(identifier.encode())
+                    for i in value:
+                        self._walk_pointer(i, hasher, tokens, depth, visited)
+                elif isinstance(first, bpy.types.ID):
+                    update(identifier.encode())
+                    for i in value:
+                        update(self._hash_id(i, tokens))
+            else:
+                update(repr((identifier, _plain(value))).encode())
+
+    def _walk_pointer(self, value, hasher, tokens, depth, visited):
+        if value is None:
+            hasher.update(b"\0")
+        elif isinstance(value, bpy.types.ID):
+            hasher.update(self._hash_id(value, tokens))
+        elif isinstance(value, bpy.types.PropertyGroup):
+            self._walk(value, hasher, tokens, depth, visited)
+        else:
+            ptr = value.as_pointer()
+            if ptr in visited or depth >= _MAX_STRUCT_DEPTH:
+                name = getattr(value, "identifier", None) or getattr(value, "name", "")
+                hasher.update(repr((value.bl_rna.identifier, name)).encode())
+            else:
+                visited.add(ptr)
+                self._walk(value, hasher, tokens, depth + 1, visited)
+
+    def _hash_foreach(self, hasher, collection, attr, dtype, width=1):
+        buf = np.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attr, buf)
+        hasher.update(buf.tobytes())
+
+    def _hash_action(self, action, hasher, tokens):
+        for fcurve in action.fcurves:
+            hasher.update(repr((fcurve.data_path, fcurve.array_index)).encode())
+            keyframes = fcurve.keyframe_points
+            for attr in ("co", "handle_left", "handle_right"):
+                self._hash_foreach(hasher, keyframes, attr, np.float32, 2)
+            self._hash_foreach(hasher, keyframes, "interpolation", np.int32)
+
+    def _hash_curve(self, curve, hasher, tokens):
+        for spline in curve.splines:
+            self._walk(spline, hasher, tokens, 1, set())
+            self._hash_foreach(hasher, spline.points, "co", np.float32, 4)
+            for attr in ("co", "handle_left", "handle_right"):
+                self._hash_foreach(hasher, spline.bezier_points, attr, np.float32, 3)
+
+    def _hash_image(self, image, hasher, tokens):
+        # Unlike the texture cache, we only need to know whether or not the image changed, so
+        # the file's stats are good enough when the image is on disk and unmodified.
+        if image.packed_file is not None:
+            hasher.update(image.packed_file.data)
+        elif image.source == "FILE" and not image.is_dirty:
+            try:
+                stat = Path(image.filepath_from_user()).stat()
+            except OSError:
+                hasher.update(b"\0")
+            else:
+                hasher.update(repr((stat.st_size, stat.st_mtime_ns)).encode())
+        elif image.has_data or image.source == "GENERATED":
+            pixels = image.pixels
+            hasher.update(read_float_pixels(pixels, len(pixels)).tobytes())
+
+    def _hash_mesh(self, mesh, hasher, tokens):
+        self._hash_foreach(hasher, mesh.vertices, "co", np.float32, 3)
+        self._hash_foreach(hasher, mesh.edges, "use_edge_sharp", np.int32)
+        self._hash_foreach(hasher, mesh.loops, "vertex_index", np.int32)
+        for attr in ("loop_start", "loop_total", "material_index", "use_smooth"):
+            self._hash_foreach(hasher, mesh.polygons, attr, np.int32)
+        for layer in mesh.uv_layers:
+            hasher.update(layer.name.encode())
+            self._hash_foreach(hasher, layer.data, "uv", np.float32, 2)
+        for layer in mesh.vertex_colors:
+            hasher.update(layer.name.encode())
+            self._hash_foreach(hasher, layer.data, "color", np.float32, 3)
+
+    def _hash_node_links(self, tree, hasher, tokens):
+        for link in tree.links:
+            hasher.update(repr((link.from_socket.path_from_id(), link.to_socket.path_from_id())).encode())
+
+    def _hash_shape_keys(self, key, hasher, tokens):
+        for block in key.key_blocks:
+            self._walk(block, hasher, tokens, 1, set())
+            self._hash_foreach(hasher, block.data, "co", np.float32, 3)
+
+    def _hash_sound(self, sound, hasher, tokens):
+        if sound.packed_file is not None:
+            hasher.update(sound.packed_file.data)
+        else:
+            try:
+                stat = Path(bpy.path.abspath(sound.filepath)).stat()
+            except OSError:
+                hasher.update(b"\0")
+            else:
+                hasher.update(repr((stat.st_size, stat.st_mtime_ns)).encode())
+
+    def _hash_text(self, text, hasher, tokens):
+        hasher.update(text.as_string().encode())
+
+
+class PageFingerprints:
+    """Tracks what went into each page so that unchanged pages can be reused on the next export"""
+
+    def __init__(self, exporter):
+        self._exporter = weakref.ref(exporter)
+        self._global_digest = None
+        self._fingerprints = {}
+        self._previous = {}
+        self._outputs = defaultdict(list)
+        self._page = None
+        self.reused_pages = frozenset()
+
+    @property
+    def enabled(self) -> bool:
+        return self._global_digest is not None
+
+    def _calc_global_digest(self, hasher: DataHasher) -> bytes:
+        exporter = self._exporter()
+        digest = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+        digest.update(repr((_FINGERPRINT_VERSION, bl_info["version"], str(exporter.mgr.getVer()),
+                            exporter.age_name, exporter.dat_only)).encode())
+
+        scene = bpy.context.scene
+        digest.update(repr(scene.frame_current).encode())
+        hasher.hash_struct(scene.world, digest)
+
+        # Static lighting can be cast from any lamp in the scene onto any object in the scene,
+        # and any mesh can shadow any other, so when we're baking, any lamp or mesh change means
+        # everything needs to be redone. The bake cache keeps that from being too painful.
+        if exporter.lighting_method != "skip":
+            for bo in scene.objects:
+                if bo.type == "LAMP":
+                    hasher.hash_struct(bo, digest)
+                elif bo.type == "MESH" and not bo.hide_render:
+                    digest.update(repr((bo.name, _plain(bo.matrix_world), _plain(bo.layers))).encode())
+                    hasher._hash_foreach(digest, bo.data.vertices, "co", np.float32, 3)
+        return digest.digest()
+
+    def _load(self, path: Path):
+        try:
+            with path.open("r") as handle:
+                sidecar = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(sidecar, dict) or sidecar.get("version") != _FINGERPRINT_VERSION:
+            return {}
+        return sidecar
+
+    def plan(self, objects: Sequence[bpy.types.Object],
+             generated: Dict[str, bpy.types.Object]) -> List[bpy.types.Object]:
+        """Fingerprints every page and returns the objects that actually need to be exported."""
+        exporter = self._exporter()
+        report = exporter.report
+        mgr, output = exporter.mgr, exporter.output
+
+        report.progress_advance()
+        report.progress_range = len(objects)
+        inc_progress = report.progress_increment
+
+        report.msg("\nFingerprinting pages...")
+        with report.indent():
+            if bpy.context.scene.world.plasma_age.use_texture_page:
+                report.warn("Incremental export is not available when the Textures page is used. Exporting all pages.")
+                return list(objects)
+            if output.is_zip:
+                report.warn("Incremental export is not available when exporting to a zip file. Exporting all pages.")
+                return list(objects)
+
+            hasher = DataHasher(frozenset((i.name for i in objects)))
+            self._global_digest = self._calc_global_digest(hasher)
+            sidecar = self._load(exporter.fingerprints_path)
+            if sidecar.get("global") == self._global_digest.hex():
+                self._previous = sidecar.get("pages", {})
+            else:
+                self._previous = {}
+
+            page_objects = defaultdict(list)
+            page_digests = defaultdict(list)
+            links = defaultdict(set)
+            owners = {}
+            dirty_roots = set()
+
+            # Objects generated during pre_export are derived entirely from the object that
+            # generated them, so we only need to tie them to that object's page.
+            for bo in objects:
+                page = mgr.get_page_name(bo)
+                root = generated.get(bo.name)
+                if page is None:
+                    # Something generated an object into a page that hasn't been created yet.
+                    # The whole page needs to be reconsidered, so don't reuse anything related.
+                    dirty_roots.add(bo.name if root is None else root.name)
+                    inc_progress()
+                    continue
+
+                page_objects[page].append(bo)
+                if root is None:
+                    digest, tokens = hasher.hash_object(bo)
+                    page_digests[page].append((bo.name, digest))
+                    owners[bo.name] = page
+                    for token in tokens:
+                        links[token].add(page)
+                else:
+                    links[("OB", root.name)].add(page)
+                inc_progress()
+
+            # Pages that refer to each other must be exported together, otherwise the keys
+            # in the reused page could be dangling.
+            groups = {page: {page} for page in page_objects}
+            def merge(lhs, rhs):
+                lhs_group, rhs_group = groups[lhs], groups[rhs]
+                if lhs_group is not rhs_group:
+                    lhs_group.update(rhs_group)
+                    for i in rhs_group:
+                        groups[i] = lhs_group
+
+            for token, pages in links.items():
+                owner = owners.get(token[1]) if token[0] == "OB" else None
+                pages = list(pages) if owner is None else [owner] + list(pages)
+                for page in pages[1:]:
+                    merge(pages[0], page)
+
+            for page in page_objects:
+                digest = hashlib.blake2b(self._global_digest, digest_size=_DIGEST_SIZE)
+                for name, obj_digest in sorted(page_digests[page]):
+                    digest.update(name.encode())
+                    digest.update(obj_digest)
+                self._fingerprints[page] = digest.hexdigest()
+
+            clean = frozenset(filter(self._is_page_clean, page_objects))
+            clean -= frozenset((owners[i] for i in dirty_roots if i in owners))
+            self.reused_pages = frozenset((page for page in page_objects if groups[page] <= clean))
+
+            for page in sorted(page_objects):
+                if page in self.reused_pages:
+                    report.msg(f"Page '{page}' is unchanged, reusing the existing PRP")
+                    self._restore_outputs(page)
+                elif page in clean:
+                    report.msg(f"Page '{page}' is unchanged, but it references a changed page")
+                else:
+                    report.msg(f"Page '{page}' has changed")
+
+        return [i for i in objects if mgr.get_page_name(i) not in self.reused_pages]
+
+    def _is_page_clean(self, page: str) -> bool:
+        previous = self._previous.get(page)
+        if previous is None or previous.get("fingerprint") != self._fingerprints[page]:
+            return False
+
+        # Be sure that nobody has futzed with the file since we wrote it.
+        exporter = self._exporter()
+        path = exporter.output.get_dat_path(exporter.mgr.get_page_filename(page))
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        if previous.get("path") != str(path) or previous.get("stat") != [stat.st_size, stat.st_mtime_ns]:
+            return False
+
+        # The Python and sounds that we previously packed for this page must still be around.
+        for kind, filename, id_name in previous.get("outputs", []):
+            collection = bpy.data.sounds if kind == "sfx" else bpy.data.texts
+            if id_name not in collection:
+                return False
+        return True
+
+    def _restore_outputs(self, page: str):
+        output = self._exporter().output
+        outputs = self._previous[page].get("outputs", [])
+        for kind, filename, id_name in outputs:
+            if kind == "python_mod":
+                text_id = bpy.data.texts[id_name]
+                if output.want_py_text(text_id):
+                    output.add_python_mod(filename, text_id=text_id)
+            elif kind == "sdl":
+                output.add_sdl(filename, text_id=bpy.data.texts[id_name])
+            elif kind == "sfx":
+                output.add_sfx(bpy.data.sounds[id_name])
+        self._outputs[page].extend(outputs)
+
+    def record_output(self, kind: str, filename: str, id_data: Optional[bpy.types.ID]):
+        """Remembers an ancillary file requested by the page currently being exported"""
+        if self.enabled and self._page is not None and id_data is not None:
+            self._outputs[self._page].append((kind, filename, id_data.name))
+
+    def save(self):
+        if not self.enabled:
+            return
+        exporter = self._exporter()
+        if exporter.report.has_errors:
+            return
+
+        pages = {}
+        for page, fingerprint in self._fingerprints.items():
+            path = exporter.output.get_dat_path(exporter.mgr.get_page_filename(page))
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            pages[page] = {
+                "fingerprint": fingerprint,
+                "path": str(path),
+                "stat": [stat.st_size, stat.st_mtime_ns],
+                "outputs": self._outputs[page],
+            }
+        sidecar = {
+            "version": _FINGERPRINT_VERSION,
+            "global": self._global_digest.hex(),
+            "pages": pages,
+        }
+
+        path = exporter.fingerprints_path
+        temp_path = path.with_name(f"{path.name}.tmp")
+        with temp_path.open("w") as handle:
+            json.dump(sidecar, handle, indent=2)
+        os.replace(str(temp_path), str(path))
+
+    @contextmanager
+    def track(self, bo: bpy.types.Object):
+        """Attributes any ancillary files requested inside this context to the object's page"""
+        if not self.enabled:
+            yield
+            return
+
+        prev_page, self._page = self._page, self._exporter().mgr.get_page_name(bo)
+        try:
+            yield
+        finally:
+            self._page = prev_page
@@ -95,12 +95,9 @@ class GuiConverter:
         # give us some three dimensional crap as a GUI. Therefore, to come up with a camera matrix,
         # we'll use the average area-weighted inverse normal of all the polygons they give us. That
         # way, the camera *always* should face the GUI as would be expected.
-        remove_mesh = bpy.data.meshes.remove
         avg_normal = mathutils.Vector()
         for i in objects:
-            mesh = i.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
-            with helpers.TemporaryObject(mesh, remove_mesh):
-                utils.transform_mesh(mesh, i.matrix_world)
+            with self._get_world_mesh(i) as mesh:
                 for polygon in mesh.polygons:
                     avg_normal += (polygon.normal * polygon.area)
         avg_normal.normalize()
@@ -244,8 +241,8 @@ class GuiConverter:
                 camera_object.data.lens_unit = "FOV"
 
                 visible_objects = [
-                    i for i in self._parent().get_objects(gui_page)
-                    if i.type == "MESH" and i.data.materials
+                    i for i in self._parent().get_objects(gui_page, type="MESH")
+                    if i.data.materials
                 ]
                 camera_object.matrix_world = self.calc_camera_matrix(
                     bpy.context.scene,
@@ -315,6 +312,18 @@ class GuiConverter:
             toggle.track(scene.render, "pixel_aspect_y", 11.0)
             yield
 
+    @contextmanager
+    def _get_world_mesh(self, bo: bpy.types.Object) -> Iterator[bpy.types.Mesh]:
+        # Outside of an export, there's no mesh cache to share.
+        if self._parent is not None:
+            with self._parent().mesh_cache.get(bo, bo.matrix_world) as mesh:
+                yield mesh
+        else:
+            mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
+            with helpers.TemporaryObject(mesh, bpy.data.meshes.remove):
+                utils.transform_mesh(mesh, bo.matrix_world)
+                yield mesh
+
     @property
     def _report(self) -> ExportLogger:
         return self._parent().report
@@ -13,18 +13,37 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 import enum
+import hashlib
+import mmap
+import os
 from pathlib import Path
 from PyHSPlasma import *
+import struct
 import time
 import weakref
 
+from ..korlib import read_float_pixels
+
 _HEADER_MAGICK = b"KTH\x00"
 _INDEX_MAGICK = b"KTI\x00"
 _DATA_MAGICK = b"KTC\x00"
 _ENTRY_MAGICK = b"KTE\x00"
 _IMAGE_MAGICK = b"KTT\x00"
 _MIP_MAGICK = b"KTM\x00"
+_ALPHA_MAGICK = b"KTA\x00"
+
+_DIGEST_SIZE = 16
+_HASH_CHUNK_SIZE = 0x100000
+
+# Number of images whose mip layout is remembered while the cache is mapped
+_MAX_DECODED_IMAGES = 64
+
+# The cache file is rewritten from scratch once this fraction of it is dead weight
+_COMPACT_GARBAGE_RATIO = 0.5
+
+_UINT32 = struct.Struct("<I")
 
 @enum.unique
 class _HeaderBits(enum.IntEnum):
@@ -35,6 +54,8 @@ class _HeaderBits(enum.IntEnum):
 @enum.unique
 class _IndexBits(enum.IntEnum):
     image_count = 0
+    garbage_size = 1
+    alpha_count = 2
 
 
 @enum.unique
@@ -48,6 +69,8 @@ class _EntryBits(enum.IntEnum):
     last_export = 6
     image_count = 7
     tag_string = 8
+    content_digest = 9
+    data_size = 10
 
 
 class _CachedImage:
@@ -55,14 +78,16 @@ class _CachedImage:
         self.name = None
         self.mip_levels = 1
         self.data_pos = None
+        self.data_size = None
         self.image_data = None
         self.source_size = None
         self.export_size = None
         self.compression = None
         self.export_time = None
-        self.modify_time = None
         self.image_count = 1
         self.tag = None
+        self.digest = None
+        self.in_use = False
 
     def __str__(self):
         return self.name
@@ -72,23 +97,39 @@ class ImageCache:
     def __init__(self, exporter):
         self._exporter = weakref.ref(exporter)
         self._images = {}
-        self._read_stream = hsFileStream()
+        self._digests = {}
+        self._file_digests = {}
+        self._loaded = False
+
+        # Alpha classifications of image contents, keyed by digest
+        self._alpha_types = {}
+        self._alpha_used = set()
+        self._decoded = OrderedDict()
+        self._mmap = None
+        self._buffer = None
         self._stream_handles = 0
 
+        # Bookkeeping for appending to the existing cache file
+        self._header_index_pos = None
+        self._index_pos = None
+        self._garbage_size = 0
+        self._needs_compaction = False
+        self._index_dirty = False
+
     def add_texture(self, texture, num_levels, export_size, compression, images):
         image, tag = texture.image, texture.tag
-        image_name = str(texture)
-        key = (image_name, tag, compression)
         ex_method, im_method = self._exporter().texcache_method, image.plasma_image.texcache_method
-        method = set((ex_method, im_method))
-        if texture.ephemeral or "skip" in method:
-            self._images.pop(key, None)
+        if texture.ephemeral or ex_method == "skip":
+            return
+        digest = self._get_texture_digest(texture, compression)
+        if im_method == "skip":
+            self._images.pop(digest, None)
             return
         elif im_method == "rebuild":
             image.plasma_image.texcache_method = "use"
 
         image = _CachedImage()
-        image.name = image_name
+        image.name = str(texture)
         image.mip_levels = num_levels
         image.compression = compression
         image.source_size = texture.image.size
@@ -96,84 +137,225 @@ class ImageCache:
         image.image_data = images
         image.image_count = len(images)
         image.tag = tag
-        self._images[key] = image
+        image.digest = digest
+        image.in_use = True
+        self._discard(self._images.get(digest))
+        self._images[digest] = image
+        self._index_dirty = True
+
+    def add_alpha_type(self, bl_image, alpha_type):
+        ex_method, im_method = self._exporter().texcache_method, bl_image.plasma_image.texcache_method
+        if ex_method == "skip" or im_method == "skip":
+            return
+        digest = self._get_alpha_digest(bl_image)
+        if digest is None:
+            return
+        if self._alpha_types.get(digest) != int(alpha_type):
+            self._alpha_types[digest] = int(alpha_type)
+            self._index_dirty = True
+        self._alpha_used.add(digest)
 
     def _compact(self):
         for key, image in self._images.copy().items():
-            if image.image_data is None:
-                self._images.pop(key)
+            if not image.in_use:
+                self._discard(self._images.pop(key))
+        for digest in self._alpha_types.keys() - self._alpha_used:
+            del self._alpha_types[digest]
+            self._index_dirty = True
+
+    def _discard(self, image):
+        """Accounts for the data of an image that is no longer referenced by the cache index"""
+        if image is not None:
+            self._index_dirty = True
+        if image is not None and image.data_pos is not None:
+            if image.data_size is None:
+                self._needs_compaction = True
+            else:
+                self._garbage_size += image.data_size
 
     def __enter__(self):
         if self._stream_handles == 0:
             path = self._exporter().texcache_path
             if Path(path).is_file():
-                self._read_stream.open(path, fmRead)
+                self._map_cache(path)
         self._stream_handles += 1
         return self
 
     def __exit__(self, type, value, tb):
         self._stream_handles -= 1
         if self._stream_handles == 0:
-            self._read_stream.close()
+            self._unmap_cache()
 
-    def get_from_texture(self, texture, compression):
-        bl_image, tag = texture.image, texture.tag
+    def _map_cache(self, path):
+        with open(path, "rb") as handle:
+            try:
+                self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped.
+                return
+        self._buffer = memoryview(self._mmap)
+
+    def _unmap_cache(self):
+        self._decoded.clear()
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Someone is still holding onto a mip level. The map will be
+                # closed when the last reference goes away.
+                pass
+            self._mmap = None
 
+    def get_from_texture(self, texture, compression):
         # If the texture is ephemeral (eg a lightmap) or has been marked "rebuild" or "skip"
         # in the UI, we don't want anything from the cache. In the first two cases, we never
         # want to cache that crap. In the latter case, we just want to signal a recache is needed.
         ex_method, im_method = self._exporter().texcache_method, texture.image.plasma_image.texcache_method
-        method = set((ex_method, im_method))
-        if method != {"use"} or texture.ephemeral:
+        if ex_method not in {"use", "compact"} or im_method != "use" or texture.ephemeral:
             return None
 
-        key = (str(texture), tag, compression)
-        cached_image = self._images.get(key)
+        # The cache is keyed by the contents of the image and everything that affects how
+        # it is exported, so identical images share an entry, and any change to the source
+        # (even for packed images) simply results in a cache miss.
+        digest = self._get_texture_digest(texture, compression)
+        cached_image = self._images.get(digest)
         if cached_image is None:
             return None
 
-        # ensure the texture key generally matches up with our copy of this image.
-        # if not, a recache will likely be triggered implicitly.
-        if tuple(bl_image.size) != cached_image.source_size:
-            return None
-
-        # if the image is on the disk, we can check the its modify time for changes
-        if cached_image.modify_time is None:
-            # if the image is packed, the filepath will be some garbage beginning with
-            # the string "//". There isn't much we can do with that, unless the user
-            # happens to have an unpacked copy lying around somewheres...
-            path = Path(bl_image.filepath_from_user())
-            try:
-                exists = path.is_file()
-            except OSError:
-                exists = False
-            finally:
-                if exists:
-                    cached_image.modify_time = path.stat().st_mtime
-                    if cached_image.export_time and cached_image.export_time < cached_image.modify_time:
-                        return None
-                else:
-                    cached_image.modify_time = 0
-
-        # ensure the data has been loaded from the cache
+        # ensure the data is actually present in the cache
         if cached_image.image_data is None:
             try:
-                cached_image.image_data = tuple(self._read_image_data(cached_image, self._read_stream))
+                self._get_mapped_image_data(cached_image)
             except AssertionError:
                 self._report.warn(f"Cached copy of '{cached_image.name}' is corrupt and will be discarded")
-                self._images.pop(key)
+                self._discard(self._images.pop(digest))
                 return None
+        cached_image.in_use = True
         return cached_image
 
+    def get_alpha_type(self, bl_image):
+        """Gets the alpha classification of an image's pixels from a previous export, if any."""
+        ex_method, im_method = self._exporter().texcache_method, bl_image.plasma_image.texcache_method
+        if ex_method not in {"use", "compact"} or im_method != "use":
+            return None
+        digest = self._get_alpha_digest(bl_image)
+        alpha_type = self._alpha_types.get(digest)
+        if alpha_type is not None:
+            self._alpha_used.add(digest)
+        return alpha_type
+
+    def _get_alpha_digest(self, bl_image):
+        # Only images backed by a file are worth remembering. Anything else would have to be
+        # hashed from its pixels, which is just as expensive as classifying them again.
+        file_digest = self._calc_file_digest(bl_image)
+        if file_digest is None:
+            return None
+        params = [tuple(bl_image.size), bl_image.channels, bl_image.alpha_mode]
+        hasher = hashlib.blake2b(repr(params).encode(), digest_size=_DIGEST_SIZE)
+        hasher.update(file_digest)
+        return hasher.digest()
+
+    def get_image_data(self, image):
+        """Gets the mip levels of a cached image. Images that were read from the cache
+           are returned as views of the cache file, which are only valid while the cache
+           is held open."""
+        if image.image_data is not None:
+            return image.image_data
+        return self._get_mapped_image_data(image)
+
+    def _get_mapped_image_data(self, image):
+        image_data = self._decoded.get(image.digest)
+        if image_data is None:
+            image_data = self._read_image_data(image)
+            self._decoded[image.digest] = image_data
+            if len(self._decoded) > _MAX_DECODED_IMAGES:
+                self._decoded.popitem(last=False)
+        else:
+            self._decoded.move_to_end(image.digest)
+        return image_data
+
+    def _get_texture_digest(self, texture, compression):
+        key = (str(texture), texture.tag, compression)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._calc_texture_digest(texture, compression)
+            self._digests[key] = digest
+        return digest
+
+    def _calc_texture_digest(self, texture, compression):
+        bl_image = texture.image
+        params = [
+            compression, texture.mipmap, texture.calc_alpha, int(texture.alpha_type),
+            texture.is_cube_map, texture.tag, tuple(bl_image.size), bl_image.use_alpha,
+            bl_image.alpha_mode, bl_image.colorspace_settings.name,
+        ]
+        if texture.is_detail_map:
+            params.extend((texture.detail_blend, texture.detail_fade_start, texture.detail_fade_stop,
+                           texture.detail_opacity_start, texture.detail_opacity_stop))
+
+        hasher = hashlib.blake2b(repr(params).encode(), digest_size=_DIGEST_SIZE)
+        hasher.update(self._calc_source_digest(bl_image))
+        return hasher.digest()
+
+    def _calc_source_digest(self, bl_image):
+        digest = self._calc_file_digest(bl_image)
+        if digest is not None:
+            return digest
+
+        pixels = bl_image.pixels
+        hasher = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+        hasher.update(read_float_pixels(pixels, len(pixels)).tobytes())
+        return hasher.digest()
+
+    def _calc_file_digest(self, bl_image):
+        """Hashes the file backing an image, if it has one. Images are not edited during the
+           export, so this is only done once per image."""
+        try:
+            return self._file_digests[bl_image.name]
+        except KeyError:
+            pass
+
+        # Hashing the source file is much cheaper than pulling the pixels out of Blender.
+        # Any unsaved changes only exist in Blender's copy of the image, however.
+        hasher, digest = hashlib.blake2b(digest_size=_DIGEST_SIZE), None
+        if bl_image.packed_file is not None and not bl_image.is_dirty:
+            hasher.update(bl_image.packed_file.data)
+            digest = hasher.digest()
+        elif bl_image.source == "FILE" and not bl_image.is_dirty:
+            try:
+                with Path(bl_image.filepath_from_user()).open("rb") as handle:
+                    data = handle.read(_HASH_CHUNK_SIZE)
+                    while data:
+                        hasher.update(data)
+                        data = handle.read(_HASH_CHUNK_SIZE)
+            except OSError:
+                pass
+            else:
+                digest = hasher.digest()
+        self._file_digests[bl_image.name] = digest
+        return digest
+
     def load(self):
-        if self._exporter().texcache_method == "skip":
+        if self._loaded or self._exporter().texcache_method == "skip":
+            return
+        self._loaded = True
+        path = self._exporter().texcache_path
+        if not Path(path).is_file():
             return
+
+        # Only the header and the index are read here. The mip levels are
+        # pulled out of the memory mapped cache as they are needed.
         try:
-            with self:
-                self._read(self._read_stream)
+            with hsFileStream().open(path, fmRead) as stream:
+                self._read(stream)
         except AssertionError:
             self._report.warn("Texture Cache is corrupt and will be regenerated")
             self._images.clear()
+            self._alpha_types.clear()
+            self._index_pos = None
 
     def _read(self, stream):
         if stream.size == 0:
@@ -191,44 +373,41 @@ class ImageCache:
         if flags[_HeaderBits.last_export]:
             self.last_export = stream.readDouble()
         if flags[_HeaderBits.index_pos]:
+            self._header_index_pos = stream.pos
             index_pos = stream.readInt()
             self._read_index(index_pos, stream)
+            self._index_pos = index_pos
 
-    def _read_image_data(self, image, stream):
-        if image.data_pos is None:
-            return None
+    def _read_image_data(self, image):
+        buf = self._buffer
+        assert buf is not None and image.data_pos is not None
 
-        assert stream.size > 0
-        stream.seek(image.data_pos)
-        assert stream.read(4) == _IMAGE_MAGICK
+        pos = image.data_pos
+        assert buf[pos:pos+4] == _IMAGE_MAGICK
+        pos += 4
 
-        # unused currently
-        image_flags = hsBitVector()
-        image_flags.read(stream)
+        # unused currently, so just skip over the flags bit vector
+        assert pos + _UINT32.size <= len(buf)
+        num_words = _UINT32.unpack_from(buf, pos)[0]
+        pos += _UINT32.size * (num_words + 1)
 
-        # given this is a generator, someone else might change our stream position
-        # between iterations, so we'd best bookkeep the position
-        pos = stream.pos
-
-        def _read_image_mips():
+        images = []
+        for _ in range(image.image_count):
+            mips = []
             for _ in range(image.mip_levels):
-                nonlocal pos
-                if stream.pos != pos:
-                    stream.seek(pos)
-                assert stream.read(4) == _MIP_MAGICK
+                assert buf[pos:pos+4] == _MIP_MAGICK
+                pos += 4
 
                 # this should only ever be image data...
                 # store your flags somewhere else!
-                size = stream.readInt()
-                data = stream.read(size)
-                pos = stream.pos
-                yield data
-
-        for _ in range(image.image_count):
-            if stream.pos != pos:
-                stream.seek(pos)
-            yield tuple(_read_image_mips())
-
+                assert pos + _UINT32.size <= len(buf)
+                size = _UINT32.unpack_from(buf, pos)[0]
+                pos += _UINT32.size
+                assert pos + size <= len(buf)
+                mips.append(buf[pos:pos+size])
+                pos += size
+            images.append(tuple(mips))
+        return tuple(images)
 
     def _read_index(self, index_pos, stream):
         stream.seek(index_pos)
@@ -240,12 +419,19 @@ class ImageCache:
 
         # ALWAYS ADD NEW FIELDS TO THE END OF THIS SECTION!!!!!!!
         image_count = stream.readInt() if flags[_IndexBits.image_count] else 0
+        self._garbage_size = stream.readInt() if flags[_IndexBits.garbage_size] else 0
 
         # Here begins the image map
         assert stream.read(4) == _DATA_MAGICK
         for i in range(image_count):
             self._read_index_entry(stream)
 
+        if flags[_IndexBits.alpha_count]:
+            assert stream.read(4) == _ALPHA_MAGICK
+            for i in range(stream.readInt()):
+                digest = stream.read(stream.readByte())
+                self._alpha_types[digest] = stream.readByte()
+
     def _read_index_entry(self, stream):
         assert stream.read(4) == _ENTRY_MAGICK
         image = _CachedImage()
@@ -274,9 +460,17 @@ class ImageCache:
         if flags[_EntryBits.tag_string]:
             # tags should not contain user data, so we will use a latin_1 backed string
             image.tag = stream.readSafeStr()
-
-        # do we need to check for duplicate images?
-        self._images[(image.name, image.tag, image.compression)] = image
+        if flags[_EntryBits.content_digest]:
+            image.digest = stream.read(stream.readByte())
+        if flags[_EntryBits.data_size]:
+            image.data_size = stream.readInt()
+
+        # Entries from before content digests cannot be validated, so they will be tossed
+        # the next time the cache is saved.
+        if image.digest is not None:
+            self._images[image.digest] = image
+        else:
+            self._needs_compaction = True
 
     @property
     def _report(self):
@@ -293,8 +487,48 @@ class ImageCache:
         # Assume all read operations are done (don't be within' my cache while you savin')
         assert self._stream_handles == 0
 
-        with hsFileStream().open(self._exporter().texcache_path, fmWrite) as stream:
-            self._write(stream)
+        path = self._exporter().texcache_path
+        if self._should_compact(path):
+            self._report.msg("Compacting texture cache...")
+
+            # Images we did not touch this time around still live in the old cache file,
+            # so the new one has to be written next to it.
+            temp_path = f"{path}.tmp"
+            with self, hsFileStream().open(temp_path, fmWrite) as stream:
+                self._write(stream)
+            os.replace(temp_path, path)
+        elif self._index_dirty:
+            with hsFileStream().open(path, fmReadWrite) as stream:
+                self._append(stream)
+
+    def _should_compact(self, path):
+        if self._exporter().texcache_method in {"compact", "rebuild"}:
+            return True
+        if self._index_pos is None or self._needs_compaction:
+            return True
+        try:
+            file_size = Path(path).stat().st_size
+        except OSError:
+            return True
+        return self._garbage_size > file_size * _COMPACT_GARBAGE_RATIO
+
+    def _append(self, stream):
+        # The new data and index are tacked onto the end of the file. The header is only
+        # pointed at the new index once everything else is written, so the old index remains
+        # valid should something go wrong in the meantime.
+        self._garbage_size += stream.size - self._index_pos
+        stream.seek(stream.size)
+
+        for image in self._images.values():
+            if image.data_pos is None:
+                self._write_image_data(image, stream)
+
+        index_pos = stream.pos
+        self._write_index(stream)
+        stream.seek(self._header_index_pos)
+        stream.writeInt(index_pos)
+        self._index_pos = index_pos
+        self._index_dirty = False
 
     def _write(self, stream):
         flags = hsBitVector()
@@ -311,36 +545,56 @@ class ImageCache:
 
         # fix the index position
         index_pos = stream.pos
+        self._garbage_size = 0
+        self._needs_compaction = False
         self._write_index(stream)
         stream.seek(header_index_pos)
         stream.writeInt(index_pos)
+        self._header_index_pos = header_index_pos
+        self._index_pos = index_pos
+        self._index_dirty = False
 
     def _write_image_data(self, image, stream):
         # unused currently
         flags = hsBitVector()
 
+        # must be grabbed before the data position changes
+        image_data = self.get_image_data(image)
+
         image.data_pos = stream.pos
         stream.write(_IMAGE_MAGICK)
         flags.write(stream)
 
-        for i in image.image_data:
+        for i in image_data:
             for j in i:
                 stream.write(_MIP_MAGICK)
                 stream.writeInt(len(j))
-                stream.write(j)
+                stream.write(bytes(j))
+        image.data_size = stream.pos - image.data_pos
 
     def _write_index(self, stream):
         flags = hsBitVector()
         flags[_IndexBits.image_count] = True
+        flags[_IndexBits.garbage_size] = True
+        flags[_IndexBits.alpha_count] = True
 
         pos = stream.pos
         stream.write(_INDEX_MAGICK)
         flags.write(stream)
         stream.writeInt(len(self._images))
+        stream.writeInt(min(self._garbage_size, 0xFFFFFFFF))
 
         stream.write(_DATA_MAGICK)
         for image in self._images.values():
             self._write_index_entry(image, stream)
+
+        # Older versions of Korman stop reading after the image entries, so this has to go last.
+        stream.write(_ALPHA_MAGICK)
+        stream.writeInt(len(self._alpha_types))
+        for digest, alpha_type in self._alpha_types.items():
+            stream.writeByte(len(digest))
+            stream.write(digest)
+            stream.writeByte(alpha_type)
         return pos
 
     def _write_index_entry(self, image, stream):
@@ -354,6 +608,8 @@ class ImageCache:
         flags[_EntryBits.last_export] = True
         flags[_EntryBits.image_count] = True
         flags[_EntryBits.tag_string] = image.tag is not None
+        flags[_EntryBits.content_digest] = True
+        flags[_EntryBits.data_size] = True
 
         stream.write(_ENTRY_MAGICK)
         flags.write(stream)
@@ -369,3 +625,6 @@ class ImageCache:
         stream.writeInt(image.image_count)
         if image.tag is not None:
             stream.writeSafeStr(image.tag)
+        stream.writeByte(len(image.digest))
+        stream.write(image.digest)
+        stream.writeInt(image.data_size)
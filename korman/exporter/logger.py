@@ -16,10 +16,14 @@
 from __future__ import annotations
 
 import abc
+from collections import defaultdict
 from contextlib import contextmanager
+import csv
+import json
 from pathlib import Path
 import threading
 import time
+import tracemalloc
 from typing import *
 
 if TYPE_CHECKING:
@@ -31,9 +35,10 @@ from .explosions import NonfatalExportError
 _HEADING_SIZE = 60
 _MAX_ELIPSES = 3
 _MAX_TIME_UNTIL_ELIPSES = 2.0
+_NUM_SLOWEST_OBJECTS = 20
 
 class _ExportLogger(abc.ABC):
-    def __init__(self, print_logs: bool, age_path: Optional[str] = None):
+    def __init__(self, print_logs: bool, age_path: Optional[str] = None, profile: bool = False):
         self._errors: List[str] = []
         self._porting: List[str] = []
         self._warnings: List[str] = []
@@ -43,6 +48,14 @@ class _ExportLogger(abc.ABC):
         self._time_start_overall: float = 0.0
         self._indent_level: int = 0
 
+        # Timing report
+        self._profile = profile
+        self._profile_records: List[Dict[str, Any]] = []
+        self._profile_steps: List[str] = []
+        self._profile_step_id: int = -1
+        self._profile_step_start: Optional[Tuple[float, Optional[int]]] = None
+        self._profile_tracemalloc: bool = False
+
     def __enter__(self):
         if self._age_path is not None:
             # Make the log file name from the age file path -- this ensures we're not trying to write
@@ -54,6 +67,9 @@ class _ExportLogger(abc.ABC):
     def __exit__(self, type, value, traceback):
         if value is not None:
             ConsoleToggler().keep_console = not isinstance(value, NonfatalExportError)
+        if self._profile_tracemalloc:
+            tracemalloc.stop()
+            self._profile_tracemalloc = False
         if self._file is not None:
             self._file.close()
         return False
@@ -66,6 +82,10 @@ class _ExportLogger(abc.ABC):
         finally:
             self._indent_level -= 1
 
+    @property
+    def has_errors(self) -> bool:
+        return bool(self._errors)
+
     @property
     def indent_level(self) -> int:
         return self._indent_level
@@ -108,16 +128,65 @@ class _ExportLogger(abc.ABC):
         self._porting.append(cache)
 
 
+    @contextmanager
+    def profile(self, category: str, name: str, action: str = "", owner: Optional[str] = None):
+        """Records how long the enclosed block takes in the timing report"""
+        if not self._profile:
+            yield
+            return
+
+        start = self._profile_sample()
+        try:
+            yield
+        finally:
+            self._profile_record(start, category, name, action, owner)
+
+    def _profile_record(self, start, category, name, action="", owner=None):
+        start_time, start_memory = start
+        end_time, end_memory = self._profile_sample()
+        memory = end_memory - start_memory if start_memory is not None and end_memory is not None else None
+
+        # This is threadsafe because CPython's list.append is atomic.
+        self._profile_records.append({
+            "category": category,
+            "name": name,
+            "action": action,
+            "owner": owner,
+            "seconds": end_time - start_time,
+            "memory": memory,
+        })
+
+    def _profile_sample(self) -> Tuple[float, Optional[int]]:
+        # tracemalloc's counters are process wide, so allocations can only be attributed to
+        # whatever is running on the main thread.
+        if self._profile_tracemalloc and threading.current_thread() is threading.main_thread():
+            memory, _ = tracemalloc.get_traced_memory()
+        else:
+            memory = None
+        return time.perf_counter(), memory
+
+    def _profile_step_end(self):
+        if self._profile_step_start is not None:
+            step_name = self._profile_steps[self._profile_step_id]
+            self._profile_record(self._profile_step_start, "step", step_name)
+            self._profile_step_start = None
+
     def progress_add_step(self, name):
-        pass
+        self._profile_steps.append(name)
 
     def progress_advance(self):
-        pass
+        if self._profile:
+            self._profile_step_end()
+            self._profile_step_id += 1
+            self._profile_step_start = self._profile_sample()
 
     def progress_complete_step(self):
-        pass
+        if self._profile:
+            self._profile_step_end()
 
     def progress_end(self):
+        if self._profile:
+            self._profile_step_end()
         if self._age_path is not None:
             export_time = time.perf_counter() - self._time_start_overall
             self.msg(f"\nExported '{self._age_path.name}' in {export_time:.2f}s")
@@ -138,6 +207,9 @@ class _ExportLogger(abc.ABC):
     def progress_start(self, action):
         if self._age_path is not None:
             self.msg(f"Exporting '{self._age_path.name}'")
+        if self._profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._profile_tracemalloc = True
         self._time_start_overall = time.perf_counter()
 
     def raise_errors(self):
@@ -149,8 +221,37 @@ class _ExportLogger(abc.ABC):
                                          {}""", num_errors, self._file.name)
 
     def save(self):
-        # TODO
-        pass
+        if self._profile and self._age_path is not None:
+            self._save_profile()
+
+    def _save_profile(self):
+        records = self._profile_records
+        age_stem = self._age_path.stem
+
+        # Objects are the sum of their own export and all of their modifiers.
+        object_times = defaultdict(float)
+        for record in records:
+            if record["category"] in {"object", "modifier"}:
+                object_times[record["owner"]] += record["seconds"]
+        slowest_objects = sorted(object_times.items(), key=lambda x: x[1], reverse=True)[:_NUM_SLOWEST_OBJECTS]
+
+        json_path = self._age_path.with_name(f"{age_stem}_timing.json")
+        with open(str(json_path), "w") as handle:
+            json.dump({
+                "records": records,
+                "slowest_objects": [{"name": name, "seconds": seconds} for name, seconds in slowest_objects],
+            }, handle, indent=2)
+
+        csv_path = self._age_path.with_name(f"{age_stem}_timing.csv")
+        with open(str(csv_path), "w", newline="") as handle:
+            writer = csv.DictWriter(handle, ("category", "name", "action", "owner", "seconds", "memory"))
+            writer.writeheader()
+            writer.writerows(records)
+
+        self.msg(f"\nTiming report saved to '{json_path.name}' and '{csv_path.name}'", indent=0)
+        self.msg(f"Top {len(slowest_objects)} slowest objects:", indent=0)
+        for name, seconds in slowest_objects:
+            self.msg(f"{seconds:8.3f}s  {name}", indent=1)
 
     def warn(self, *args, **kwargs):
         assert args
@@ -177,8 +278,8 @@ class _ExportLogger(abc.ABC):
 
 
 class ExportProgressLogger(_ExportLogger):
-    def __init__(self, age_path=None):
-        super().__init__(False, age_path)
+    def __init__(self, age_path=None, profile=False):
+        super().__init__(False, age_path, profile)
 
         # Long running operations like the Blender bake_image call make it seem like we've hung
         # because it is difficult to inspect the progress of Blender's internal operators. The best
@@ -212,10 +313,12 @@ class ExportProgressLogger(_ExportLogger):
 
     def progress_add_step(self, name):
         assert self._step_id == -1
+        super().progress_add_step(name)
         self._progress_steps.append(name)
 
     def progress_advance(self):
         """Advances the progress bar to the next step"""
+        super().progress_advance()
         if self._step_id != -1:
             self._progress_print_step(done=True)
         assert self._step_id < len(self._progress_steps)
@@ -229,9 +332,12 @@ class ExportProgressLogger(_ExportLogger):
     def progress_complete_step(self):
         """Manually completes the current step"""
         assert self._step_id != -1
+        super().progress_complete_step()
         self._progress_print_step(done=True)
 
     def progress_end(self):
+        if self._profile:
+            self._profile_step_end()
         self._progress_print_step(done=True)
         assert self._step_id+1 == len(self._progress_steps)
 
@@ -370,8 +476,8 @@ class ExportProgressLogger(_ExportLogger):
 
 
 class ExportVerboseLogger(_ExportLogger):
-    def __init__(self, age_path=None):
-        super().__init__(True, age_path)
+    def __init__(self, age_path=None, profile=False):
+        super().__init__(True, age_path, profile)
 
     def __exit__(self, type, value, traceback):
         if value is not None and not isinstance(value, NonfatalExportError):
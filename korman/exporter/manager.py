@@ -329,6 +329,18 @@ class ExportManager:
         """Returns the Page Location of a given Blender Object"""
         return self._pages[bl.plasma_object.page]
 
+    def get_page_filename(self, page_name: str) -> str:
+        """Returns the PRP filename of a given Plasma Page"""
+        chapter = "_District_" if self.mgr.getVer() <= pvMoul else "_"
+        return f"{self._age_info.name}{chapter}{page_name}.prp"
+
+    def get_page_name(self, bl) -> Optional[str]:
+        """Returns the name of the Plasma Page a given Blender Object is exported into, if it exists"""
+        location = self._pages.get(bl.plasma_object.page)
+        if location is None:
+            return None
+        return self.mgr.FindPage(location).page
+
     def get_scene_node(
             self, location: Optional[plLocation] = None,
             bl: Optional[bpy.types.Object]=None
@@ -409,12 +421,16 @@ class ExportManager:
                     stream.writeLine("Graphics.Renderer.Fog.SetDefExp2 {:.2f} {:.2f}".format(fni.fog_end, fni.fog_density))
 
     def _write_pages(self):
-        age_name = self._age_info.name
         output = self._exporter().output
+        reused_pages = self._exporter().fingerprints.reused_pages
         for loc in self._pages.values():
             page = self.mgr.FindPage(loc) # not cached because it's C++ owned
-            chapter = "_District_" if self.mgr.getVer() <= pvMoul else "_"
-            f = "{}{}{}.prp".format(age_name, chapter, page.page)
+            f = self.get_page_filename(page.page)
+
+            # Unchanged pages from an incremental export are already sitting on disk.
+            if page.page in reused_pages:
+                output.reuse_dat_file(f)
+                continue
 
             with output.generate_dat_file(f) as stream:
                 self.mgr.WritePage(stream, page)
@@ -18,10 +18,13 @@ from __future__ import annotations
 import bpy
 import mathutils
 
+import collections
 from collections import defaultdict
+import concurrent.futures
 import functools
 import itertools
 import math
+import numpy as np
 from pathlib import Path
 from typing import *
 import weakref
@@ -43,6 +46,36 @@ _MAX_STENCILS = 6
 BLENDER_CUBE_MAP = ("leftFace", "backFace", "rightFace",
                     "bottomFace", "topFace", "frontFace")
 
+class _DeferredReport:
+    """Holds on to log messages from a texture worker so they can be logged in order later"""
+
+    def __init__(self):
+        self._messages = []
+
+    def msg(self, *args, **kwargs):
+        self._messages.append(("msg", args, kwargs))
+
+    def warn(self, *args, **kwargs):
+        self._messages.append(("warn", args, kwargs))
+
+    def replay(self, report):
+        for func, args, kwargs in self._messages:
+            getattr(report, func)(*args, **kwargs)
+        self._messages.clear()
+
+
+class _SerialExecutor(concurrent.futures.Executor):
+    """Executes texture jobs immediately on the calling thread"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
 class _Texture:
     _DETAIL_BLEND = {
         TEX_DETAIL_ALPHA: "AL",
@@ -210,7 +243,11 @@ class MaterialConverter:
             else:
                 mat_prefix = ""
             mat_prefix2 = "NonVtxP_" if self._exporter().mesh.is_nonpreshaded(bo, bm) else ""
-            mat_name = "".join((mat_prefix, mat_prefix2, bm.name))
+
+            # Objects sharing a lightmap atlas can also share the lightmapped material.
+            lightmap_atlas = self._exporter().oven.get_lightmap_atlas(bo)
+            mat_prefix3 = f"{lightmap_atlas}_" if lightmap_atlas else ""
+            mat_name = "".join((mat_prefix3, mat_prefix, mat_prefix2, bm.name))
             self._report.msg(f"Exporting Material '{mat_name}'")
             hsgmat = self._mgr.find_key(hsGMaterial, name=mat_name, bl=bo)
             if hsgmat is not None:
@@ -1088,60 +1125,95 @@ class MaterialConverter:
         self._report.progress_advance()
         self._report.progress_range = len(self._pending)
         inc_progress = self._report.progress_increment
-        mgr = self._mgr
+
+        num_threads = self._exporter().texture_threads
+        if num_threads > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+        else:
+            executor = _SerialExecutor()
 
         # This with statement causes the texture cache to hold open a
         # read stream for the cache file, preventing spurious open-close
         # spin washing during this tight loop. Note that the cache still
         # has to actually be loaded ^_^
-        with self._texcache as texcache:
+        with self._texcache as texcache, executor:
             texcache.load()
 
+            # Uncached textures are scaled and compressed on the worker pool, but anything that
+            # touches OpenGL or the PRPs has to happen right here. The results are handled in the
+            # same order as the serial path. Limit the number of textures in flight, otherwise
+            # we'd be holding the raw pixels of every texture in the Age at once.
+            in_flight = collections.deque()
+            max_in_flight = num_threads * 2
+
             for key, owners in self._pending.items():
-                name = str(key)
-                pClassName = "CubicEnvironmap" if key.is_cube_map else "Mipmap"
-                self._report.msg("\n[{} '{}']", pClassName, name)
+                compression, dxt = self._get_texture_compression(key)
+
+                # Mayhaps we have a cached version of this that has already been exported
+                cached_image = texcache.get_from_texture(key, compression)
+                if cached_image is None:
+                    report = _DeferredReport()
+                    with self._report.profile("texture", str(key), "load"):
+                        image_data = self._load_image_data(key, key.image, compression)
+                    future = executor.submit(self._compress_image, key, str(key), compression,
+                                             dxt, image_data, report)
+                else:
+                    report, future = None, None
 
-                with self._report.indent():
-                    image = key.image
-
-                    # Now we try to use the pile of hints we were given to figure out what format to use
-                    allowed_formats = key.allowed_formats
-                    if key.mipmap:
-                        compression = plBitmap.kDirectXCompression
-                    elif "PNG" in allowed_formats and self._mgr.getVer() == pvMoul:
-                        compression = plBitmap.kPNGCompression
-                    elif "DDS" in allowed_formats:
-                        compression = plBitmap.kDirectXCompression
-                    elif "JPG" in allowed_formats:
-                        compression = plBitmap.kJPEGCompression
-                    elif "BMP" in allowed_formats:
-                        compression = plBitmap.kUncompressed
-                    else:
-                        raise RuntimeError(allowed_formats)
-                    dxt = plBitmap.kDXT5 if key.alpha_type == TextureAlpha.full else plBitmap.kDXT1
+                in_flight.append((key, owners, compression, dxt, cached_image, report, future))
+                while len(in_flight) > max_in_flight:
+                    self._finalize_texture(texcache, *in_flight.popleft())
+                    inc_progress()
+
+            while in_flight:
+                self._finalize_texture(texcache, *in_flight.popleft())
+                inc_progress()
+
+    def _finalize_texture(self, texcache, key, owners, compression, dxt, cached_image, report, future):
+        with self._report.profile("texture", str(key), "finalize"):
+            name = str(key)
+            pClassName = "CubicEnvironmap" if key.is_cube_map else "Mipmap"
+            self._report.msg("\n[{} '{}']", pClassName, name)
 
-                    # Mayhaps we have a cached version of this that has already been exported
-                    cached_image = texcache.get_from_texture(key, compression)
+            with self._report.indent():
+                if cached_image is None:
+                    try:
+                        numLevels, width, height, data = future.result()
+                    finally:
+                        report.replay(self._report)
+                    texcache.add_texture(key, numLevels, (width, height), compression, data)
+                    self._finalize_bitmap(key, owners, name, numLevels, width, height, compression, dxt, data)
+                else:
+                    width, height = cached_image.export_size
+                    data = texcache.get_image_data(cached_image)
+                    numLevels = cached_image.mip_levels
 
-                    if cached_image is None:
-                        numLevels, width, height, data = self._finalize_cache(texcache, key, image, name, compression, dxt)
+                    # If the cached image data is junk, PyHSPlasma will raise a RuntimeError,
+                    # so we'll attempt a recache...
+                    try:
+                        self._finalize_bitmap(key, owners, name, numLevels, width, height, compression, dxt, data)
+                    except RuntimeError:
+                        self._report.warn("Cached image is corrupted! Recaching image...")
+                        numLevels, width, height, data = self._finalize_cache(texcache, key, key.image, name, compression, dxt)
                         self._finalize_bitmap(key, owners, name, numLevels, width, height, compression, dxt, data)
-                    else:
-                        width, height = cached_image.export_size
-                        data = cached_image.image_data
-                        numLevels = cached_image.mip_levels
-
-                        # If the cached image data is junk, PyHSPlasma will raise a RuntimeError,
-                        # so we'll attempt a recache...
-                        try:
-                            self._finalize_bitmap(key, owners, name, numLevels, width, height, compression, dxt, data)
-                        except RuntimeError:
-                            self._report.warn("Cached image is corrupted! Recaching image...")
-                            numLevels, width, height, data = self._finalize_cache(texcache, key, image, name, compression, dxt)
-                            self._finalize_bitmap(key, owners, name, numLevels, width, height, compression, dxt, data)
 
-                inc_progress()
+    def _get_texture_compression(self, key):
+        # Now we try to use the pile of hints we were given to figure out what format to use
+        allowed_formats = key.allowed_formats
+        if key.mipmap:
+            compression = plBitmap.kDirectXCompression
+        elif "PNG" in allowed_formats and self._mgr.getVer() == pvMoul:
+            compression = plBitmap.kPNGCompression
+        elif "DDS" in allowed_formats:
+            compression = plBitmap.kDirectXCompression
+        elif "JPG" in allowed_formats:
+            compression = plBitmap.kJPEGCompression
+        elif "BMP" in allowed_formats:
+            compression = plBitmap.kUncompressed
+        else:
+            raise RuntimeError(allowed_formats)
+        dxt = plBitmap.kDXT5 if key.alpha_type == TextureAlpha.full else plBitmap.kDXT1
+        return compression, dxt
 
     def _finalize_bitmap(self, key, owners, name, numLevels, width, height, compression, dxt, data):
         mgr = self._mgr
@@ -1192,14 +1264,13 @@ class MaterialConverter:
                     raise NotImplementedError(owner.ClassName())
 
     def _finalize_cache(self, texcache, key, image, name, compression, dxt):
-        if key.is_cube_map:
-            numLevels, width, height, data = self._finalize_cube_map(key, image, name, compression, dxt)
-        else:
-            numLevels, width, height, data = self._finalize_single_image(key, image, name, compression, dxt)
+        image_data = self._load_image_data(key, image, compression)
+        numLevels, width, height, data = self._compress_image(key, name, compression, dxt, image_data, self._report)
         texcache.add_texture(key, numLevels, (width, height), compression, data)
         return numLevels, width, height, data
 
-    def _finalize_cube_map(self, key, image, name, compression, dxt):
+    def _load_image_data(self, key, image, compression):
+        """Grabs the raw pixels of an image from Blender or OpenGL. This must be done on the main thread."""
         oWidth, oHeight = image.size
         if oWidth == 0 and oHeight == 0:
             raise ExportError(f"Image '{image.name}' could not be loaded.")
@@ -1207,42 +1278,48 @@ class MaterialConverter:
         # Non-DXT images are BGRA in Plasma
         bgra = compression != plBitmap.kDirectXCompression
 
-        # Grab the cube map data from OpenGL and prepare to begin...
+        if use_pixel_loader(image):
+            try:
+                return (oWidth, oHeight), load_image_pixels(image, bgra=bgra)
+            except RuntimeError:
+                raise ExportError(f"Image '{image.name}' could not be loaded.")
         with GLTexture(key, bgra=bgra) as glimage:
-            cWidth, cHeight, data = glimage.image_data
+            return (oWidth, oHeight), glimage.image_data
+
+    def _compress_image(self, key, name, compression, dxt, image_data, report):
+        """Generates the mip levels of a texture from its raw pixels. This is safe to call from
+           any thread because it does not touch Blender or OpenGL."""
+        with self._report.profile("texture", name, "compress"):
+            if key.is_cube_map:
+                return self._finalize_cube_map(key, name, compression, dxt, image_data, report)
+            else:
+                return self._finalize_single_image(key, name, compression, dxt, image_data, report)
+
+    def _finalize_cube_map(self, key, name, compression, dxt, image_data, report):
+        (oWidth, oHeight), (cWidth, cHeight, data) = image_data
 
         # On some platforms, Blender will be "helpful" and scale the image to a POT.
         # That's great, but we have 3 faces as a width, which will certainly be NPOT
         # in the case of POT faces. So, we will scale the image AGAIN, if Blender did
         # something funky.
         if oWidth != cWidth or oHeight != cHeight:
-            self._report.warn("Image was resized by Blender to ({}x{})--resizing the resize to ({}x{})",
-                              cWidth, cHeight, oWidth, oHeight)
+            report.warn("Image was resized by Blender to ({}x{})--resizing the resize to ({}x{})",
+                        cWidth, cHeight, oWidth, oHeight)
             data = scale_image(data, cWidth, cHeight, oWidth, oHeight)
 
         # Face dimensions
         fWidth, fHeight = oWidth // 3, oHeight // 2
 
-        # Copy each of the six faces into a separate image buffer.
-        # NOTE: At present, I am well pleased with the speed of this functionality.
-        #       According to my profiling, it takes roughly 0.7 seconds to process a
-        #       cube map whose faces are 1024x1024 (3072x2048 total). Maybe a later
-        #       commit will move this into korlib. We'll see.
+        # Slice each of the six faces out of the atlas. The slices are strided views into the
+        # atlas, so the only copy made is the contiguous one handed to the GLTexture helper.
+        atlas = np.frombuffer(data, dtype=np.uint8).reshape(oHeight, oWidth, 4)
         face_num = len(BLENDER_CUBE_MAP)
         face_images = [None] * face_num
         for i in range(face_num):
             col_id = i if i < 3 else i - 3
             row_start = 0 if i < 3 else fHeight
-            row_end = fHeight if i < 3 else oHeight
-
-            face_data = bytearray(fWidth * fHeight * 4)
-            for row_current in range(row_start, row_end, 1):
-                src_start_idx = (row_current * oWidth * 4) + (col_id * fWidth * 4)
-                src_end_idx = src_start_idx + (fWidth * 4)
-                dst_start_idx = (row_current - row_start) * fWidth * 4
-                dst_end_idx = dst_start_idx + (fWidth * 4)
-                face_data[dst_start_idx:dst_end_idx] = data[src_start_idx:src_end_idx]
-            face_images[i] = bytes(face_data)
+            col_start = col_id * fWidth
+            face_images[i] = atlas[row_start:row_start+fHeight, col_start:col_start+fWidth].tobytes()
 
         # Now that we have our six faces, we'll toss them into the GLTexture helper
         # to generate mipmaps, if needed...
@@ -1253,56 +1330,50 @@ class MaterialConverter:
             name = face_name[:-4].upper()
             if compression == plBitmap.kDirectXCompression:
                 numLevels = glimage.num_levels
-                self._report.msg("Generating mip levels for cube face '{}'", name)
+                report.msg("Generating mip levels for cube face '{}'", name)
 
                 # If we're compressing this mofo, we'll need a temporary mipmap to do that here...
                 mipmap = plMipmap(name=name, width=eWidth, height=eHeight, numLevels=numLevels,
                                   compType=compression, format=plBitmap.kRGB8888, dxtLevel=dxt)
             else:
                 numLevels = 1
-                self._report.msg("Compressing single level for cube face '{}'", name)
+                report.msg("Compressing single level for cube face '{}'", name)
 
             face_images[i] = [None] * numLevels
             for j in range(numLevels):
-                level_data = glimage.get_level_data(j, key.calc_alpha, report=self._report)
+                level_data = glimage.get_level_data(j, key.calc_alpha, report=report)
                 if compression == plBitmap.kDirectXCompression:
                     mipmap.CompressImage(j, level_data)
                     level_data = mipmap.getLevel(j)
                 face_images[i][j] = level_data
         return numLevels, eWidth, eHeight, face_images
 
-    def _finalize_single_image(self, key, image, name, compression, dxt):
-        oWidth, oHeight = image.size
-        if oWidth == 0 and oHeight == 0:
-            raise ExportError("Image '{}' could not be loaded.".format(image.name))
+    def _finalize_single_image(self, key, name, compression, dxt, image_data, report):
+        glimage = GLTexture(key)
+        glimage.image_data = image_data[1]
 
-        # Non-DXT images are BGRA in Plasma
-        bgra = compression != plBitmap.kDirectXCompression
+        eWidth, eHeight = glimage.size_pot
+        if compression == plBitmap.kDirectXCompression:
+            numLevels = glimage.num_levels
+            report.msg("Generating mip levels")
 
-        # Grab the image data from OpenGL and stuff it into the plBitmap
-        with GLTexture(key, bgra=bgra) as glimage:
-            eWidth, eHeight = glimage.size_pot
+            # If this is a DXT-compressed mipmap, we need to use a temporary mipmap
+            # to do the compression. We'll then steal the data from it.
+            mipmap = plMipmap(name=name, width=eWidth, height=eHeight, numLevels=numLevels,
+                              compType=compression, format=plBitmap.kRGB8888, dxtLevel=dxt)
+        else:
+            numLevels = 1
+            report.msg("Compressing single level")
+
+        # Hold the uncompressed level data for now. We may have to make multiple copies of
+        # this mipmap for per-page textures :(
+        data = [None] * numLevels
+        for i in range(numLevels):
+            level_data = glimage.get_level_data(i, key.calc_alpha, report=report)
             if compression == plBitmap.kDirectXCompression:
-                numLevels = glimage.num_levels
-                self._report.msg("Generating mip levels")
-
-                # If this is a DXT-compressed mipmap, we need to use a temporary mipmap
-                # to do the compression. We'll then steal the data from it.
-                mipmap = plMipmap(name=name, width=eWidth, height=eHeight, numLevels=numLevels,
-                                  compType=compression, format=plBitmap.kRGB8888, dxtLevel=dxt)
-            else:
-                numLevels = 1
-                self._report.msg("Compressing single level")
-
-            # Hold the uncompressed level data for now. We may have to make multiple copies of
-            # this mipmap for per-page textures :(
-            data = [None] * numLevels
-            for i in range(numLevels):
-                level_data = glimage.get_level_data(i, key.calc_alpha, report=self._report)
-                if compression == plBitmap.kDirectXCompression:
-                    mipmap.CompressImage(i, level_data)
-                    level_data = mipmap.getLevel(i)
-                data[i] = level_data
+                mipmap.CompressImage(i, level_data)
+                level_data = mipmap.getLevel(i)
+            data[i] = level_data
         return numLevels, eWidth, eHeight, [data,]
 
     def get_materials(self, bo: bpy.types.Object, bm: Optional[bpy.types.Material] = None) -> Iterator[plKey[hsGMaterial]]:
@@ -1504,14 +1575,29 @@ class MaterialConverter:
         if image.channels != 4 or not image.use_alpha:
             result = TextureAlpha.opaque
         else:
-            # Using bpy.types.Image.pixels is VERY VERY VERY slow...
-            key = _Texture(image=image)
-            with GLTexture(key, fast=True) as glimage:
-                result = glimage.has_alpha
+            # Maybe a previous export already looked at these pixels?
+            texcache = self._texcache
+            texcache.load()
+            result = texcache.get_alpha_type(image)
+            if result is not None:
+                result = TextureAlpha(result)
+            else:
+                result = self._calc_image_alpha(image)
+                texcache.add_alpha_type(image, result)
 
         self._alphatest[image] = result
         return result
 
+    def _calc_image_alpha(self, image):
+        # Using bpy.types.Image.pixels is VERY VERY VERY slow, unless we can bulk load them...
+        key = _Texture(image=image)
+        if use_pixel_loader(image):
+            glimage = GLTexture(key, fast=True)
+            glimage.image_data = load_image_pixels(image, inverted=True)
+            return glimage.has_alpha
+        with GLTexture(key, fast=True) as glimage:
+            return glimage.has_alpha
+
     @property
     def _texcache(self):
         return self._exporter().image
@@ -15,17 +15,19 @@
 
 import bpy
 from contextlib import ExitStack
+import functools
+import hashlib
 import itertools
+import numpy as np
 from PyHSPlasma import *
 from math import fabs
-from typing import Iterable
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence
 import weakref
 
 from ..exporter.logger import ExportProgressLogger
 from . import explosions
-from .. import helpers
 from . import material
-from . import utils
+from . import vertexcache
 
 _MAX_VERTS_PER_SPAN = 0xFFFF
 _WARN_VERTS_PER_SPAN = 0x8000
@@ -33,10 +35,14 @@ _WARN_VERTS_PER_SPAN = 0x8000
 _VERTEX_COLOR_LAYERS = {"col", "color", "colour"}
 
 class _GeoSpan:
-    def __init__(self, bo, bm, geospan, pass_index=None):
+    def __init__(self, bo, bm, geospan, pass_index=None, factory=None):
         self.geospan = geospan
+        self.chunks = [geospan]
+        # The unclamped vertex normals of each converted chunk, for reuse by instanced copies.
+        self.normals: List[np.ndarray] = []
         self.pass_index = pass_index if pass_index is not None else 0
         self.mult_color = self._determine_mult_color(bo, bm)
+        self._factory = factory
 
     def _determine_mult_color(self, bo, bm):
         """Determines the color all vertex colors should be multipled by in this span."""
@@ -48,6 +54,22 @@ class _GeoSpan:
             return (0.0, 0.0, 0.0, 0.0)
         return (1.0, 1.0, 1.0, 1.0)
 
+    def split(self, count):
+        """Ensures that there are enough plGeometrySpans to hold `count` chunks of geometry"""
+        while len(self.chunks) < count:
+            self.chunks.append(self._factory())
+
+
+class _SpanCorners(NamedTuple):
+    """The face corners of a span and the unique span vertices they map to"""
+    corner_mask: np.ndarray
+    vertex_ids: np.ndarray
+    normals: np.ndarray
+    uvws: np.ndarray
+    vertex_colors: np.ndarray
+    first_corners: np.ndarray
+    corner2gs: np.ndarray
+
 
 class _RenderLevel:
     MAJOR_OPAQUE = 0
@@ -153,10 +175,65 @@ class _DrawableCriteria:
 
 
 class _GeoData:
-    def __init__(self, numVtxs):
-        self.blender2gs = [{} for i in range(numVtxs)]
-        self.triangles = []
-        self.vertices = []
+    """Per-face data pulled out of a Blender mesh's tessfaces in bulk"""
+
+    def __init__(self, mesh, color_layer, alpha_layer):
+        num_faces = len(mesh.tessfaces)
+
+        self.positions = self._foreach_get(mesh.vertices, "co", np.float32, len(mesh.vertices), 3)
+        self.face_verts = self._foreach_get(mesh.tessfaces, "vertices_raw", np.int32, num_faces, 4)
+        self.face_mats = self._foreach_get(mesh.tessfaces, "material_index", np.int32, num_faces)
+        self.normals = self._foreach_get(mesh.tessfaces, "split_normals", np.float32, num_faces, 4, 3)
+
+        # Blender marks a triangle by leaving its fourth vertex index as zero.
+        self.is_quad = self.face_verts[:, 3] != 0
+        self.corner_mask = np.ones((num_faces, 4), dtype=bool)
+        self.corner_mask[:, 3] = self.is_quad
+
+        # NOTE: Blender has no third (W) coordinate
+        # Layout: face, corner, UV layer, component
+        uvs = [self._foreach_get(i.data, "uv_raw", np.float32, num_faces, 4, 2) for i in mesh.tessface_uv_textures]
+        if uvs:
+            self.uvs = np.stack(uvs, axis=2)
+        else:
+            self.uvs = np.empty((num_faces, 4, 0, 2), dtype=np.float32)
+
+        if color_layer is None:
+            self.colors = None
+        else:
+            self.colors = self._get_face_colors(color_layer, num_faces)
+
+        if alpha_layer is None:
+            self.alphas = None
+        else:
+            # Some time between 2.79b and 2.80, vertex alpha colors appeared in Blender. However,
+            # there is no way to actually visually edit them. That means that we need to keep that
+            # fact in mind because we're just averaging the color to make alpha.
+            alpha_colors = self._get_face_colors(alpha_layer, num_faces).astype(np.float64)
+            self.alphas = (alpha_colors[:, :, 0] + alpha_colors[:, :, 1] + alpha_colors[:, :, 2]) / 3
+
+    def _foreach_get(self, collection, attr, dtype, *shape):
+        result = np.empty(np.prod(shape), dtype=dtype)
+        collection.foreach_get(attr, result)
+        return result.reshape(shape)
+
+    def _get_face_colors(self, layer, num_faces):
+        colors = [self._foreach_get(layer, f"color{i}", np.float32, num_faces, 3) for i in range(1, 5)]
+        return np.stack(colors, axis=1)
+
+
+def _unique_rows(rows):
+    """Finds the unique rows of a 2D array. Returns the index of the first occurence of each
+       unique row and a mapping of every row to its unique row, all in order of first appearance."""
+    rows = np.ascontiguousarray(rows)
+    void_rows = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(void_rows, return_index=True, return_inverse=True)
+
+    # numpy sorts the unique rows by value, but we want them in the order that they appeared.
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return first[order], remap[inverse.ravel()]
 
 
 class _MeshManager:
@@ -237,6 +314,11 @@ class _MeshManager:
     def is_collapsed(self, bo) -> bool:
         return bo.name in self._overrides
 
+    def get_collapsed_modifiers(self, bo) -> Sequence[Dict[str, Any]]:
+        """Gets the settings of the modifiers that were removed from a collapsed object"""
+        override = self._overrides.get(bo.name)
+        return override["modifiers"] if override is not None else ()
+
 
 class MeshConverter(_MeshManager):
     def __init__(self, exporter):
@@ -244,9 +326,14 @@ class MeshConverter(_MeshManager):
         self.material = material.MaterialConverter(exporter)
 
         self._dspans = {}
-        self._mesh_geospans = {}
         self._non_preshaded = {}
 
+        # Converted geometry, keyed by a digest of the mesh data and the spans it went into
+        self._instances = {}
+        self._instance_shapes = set()
+        self._num_instanced_spans = 0
+        self._num_instanced_verts = 0
+
         # _report is a property on this subclass
         super().__init__()
 
@@ -361,6 +448,9 @@ class MeshConverter(_MeshManager):
 
         log_msg("\nFinalizing Geometry")
         with indent():
+            if self._num_instanced_spans:
+                log_msg("Reused {} vertices in {} spans from identical meshes",
+                        self._num_instanced_verts, self._num_instanced_spans)
             for loc in self._dspans.values():
                 for dspan in loc.values():
                     log_msg("[DrawableSpans '{}']", dspan.key.name)
@@ -373,172 +463,352 @@ class MeshConverter(_MeshManager):
                     dspan.composeGeometry(True, True)
                 inc_progress()
 
-    def _export_geometry(self, bo, mesh, materials, geospans, mat2span_LUT):
+    def _export_geometry(self, bo, mesh, materials, geospans, mat2span_LUT, matrix=None):
+        """Converts a mesh into the given geometry spans. If a matrix is given, the mesh is in local
+           space and will be transformed by it."""
         self._report.msg(f"Converting geometry from '{mesh.name}'...")
 
-        # Recall that materials is a mapping of exported materials to blender material indices.
-        # Therefore, geodata maps blender material indices to working geometry data.
-        # Maybe the logic is a bit inverted, but it keeps the inner loop simple.
-        geodata = { idx: _GeoData(len(mesh.vertices)) for idx, _ in materials }
         bumpmap = self.material.get_bump_layer(bo)
+        span_params = self._get_span_params(materials, geospans, bumpmap)
+
+        # Identical meshes exported into identical spans always produce the same vertices, so
+        # there's no need to go through all the trouble below for every copy of a mesh. Copies
+        # that only differ by their transform can reuse the vertices, too, as long as the
+        # transform doesn't change the shape of the mesh. Finding them means hashing the local
+        # space mesh, which is wasted effort for transformed meshes that turn out to be unique,
+        # so those are only hashed once something of the same size has been seen.
+        shape = (len(mesh.vertices), len(mesh.tessfaces), len(mesh.tessface_uv_textures), tuple(span_params))
+        if matrix is None or shape in self._instance_shapes:
+            # Pull everything we need out of Blender in one go. Everything below this point works on
+            # flat arrays of face corners, so we never have to poke at the RNA for individual faces.
+            data = self._get_geo_data(bo, mesh)
+
+            space = np.identity(4) if matrix is None else np.array(matrix, dtype=np.float64)
+            digest = self._calc_geometry_digest(data, span_params)
+            instance = self._instances.get(digest)
+            if instance is not None:
+                source_name, source_space, source_geospans = instance
+                relative = space.dot(np.linalg.inv(source_space))
+                if self._is_rigid_transform(relative):
+                    self._report.msg(f"Reusing geometry converted from '{source_name}'")
+                    self._copy_instance_geometry(geospans, source_geospans, relative, bumpmap is not None)
+                    return
+            else:
+                self._instances[digest] = (bo.name, space, geospans)
+        self._instance_shapes.add(shape)
+
+        if matrix is None:
+            self._convert_geometry(bo, mesh, data, materials, geospans, mat2span_LUT, bumpmap)
+        else:
+            with self._exporter().mesh_cache.get(bo, matrix) as mesh:
+                mesh.calc_normals_split()
+                mesh.calc_tessface()
+                data = self._get_geo_data(bo, mesh)
+                self._convert_geometry(bo, mesh, data, materials, geospans, mat2span_LUT, bumpmap)
+
+    def _convert_geometry(self, bo, mesh, data, materials, geospans, mat2span_LUT, bumpmap):
+        # Recall that materials is a mapping of exported materials to blender material indices.
+        for i, (blmat_idx, _) in enumerate(materials):
+            faces = np.flatnonzero(data.face_mats == blmat_idx)
+
+            # Calculate vertex colors.
+            if mat2span_LUT:
+                mult_color = geospans[mat2span_LUT[blmat_idx]].mult_color
+            else:
+                mult_color = (1.0, 1.0, 1.0, 1.0)
+            corners = self._collect_span_corners(data, faces, mult_color)
 
+            # There is a soft limit of 0x8000 vertices per span in Plasma, but the limit is
+            # theoretically 0xFFFF because this field is a 16-bit integer. However, bad things
+            # happen in MOUL when we have over 0x8000 vertices. I've also received tons of reports
+            # of stack dumps in PotS when modifiers are applied, so we're going to limit to 0x8000.
+            # Anything bigger than that gets busted up into several spans.
+            numVerts = len(corners.first_corners)
+            if numVerts > _WARN_VERTS_PER_SPAN:
+                chunks = self._split_span_faces(data, faces, corners)
+                self._report.msg("Splitting {} vertices using '{}' into {} spans",
+                                 numVerts, geospans[i].geospan.material.name, len(chunks))
+                chunk_corners = [self._collect_span_corners(data, j, mult_color) for j in chunks]
+            else:
+                chunks, chunk_corners = [faces], [corners]
+
+            geospans[i].split(len(chunks))
+            geospans[i].normals = [
+                self._convert_span_geometry(bo, geospan, mesh, data, chunk, span_corners, bumpmap)
+                for geospan, chunk, span_corners in zip(geospans[i].chunks, chunks, chunk_corners)
+            ]
+
+    def _collect_span_corners(self, data, faces, mult_color):
+        """Finds the unique span vertices used by the corners of the requested tessfaces"""
+        corner_mask = data.corner_mask[faces]
+        num_user_uvs = data.uvs.shape[2]
+
+        # Unpack the per-corner data for this material. The corners are in the same order that
+        # the old per-face loop visited them, which keeps the vertex order stable.
+        vertex_ids = data.face_verts[faces][corner_mask]
+        normals = data.normals[faces][corner_mask]
+        uvws = data.uvs[faces][corner_mask].reshape(len(vertex_ids), num_user_uvs * 2)
+        vertex_colors = self._calc_vertex_colors(data, faces, corner_mask, mult_color)
+
+        # Now, we'll find the unique combination of Blender vertex and per-face elements. The
+        # floats are compared by their bits, so scrub away any negative zeroes first because the
+        # old code compared them as Python floats. Remember, -0.0 == 0.0.
+        keys = np.empty((len(vertex_ids), 8 + num_user_uvs * 2), dtype=np.uint32)
+        keys[:, 0] = vertex_ids
+        keys[:, 1:4] = (normals + np.float32(0.0)).view(np.uint32)
+        keys[:, 4:8] = vertex_colors
+        keys[:, 8:] = (uvws + np.float32(0.0)).view(np.uint32)
+        first_corners, corner2gs = _unique_rows(keys)
+        return _SpanCorners(corner_mask, vertex_ids, normals, uvws, vertex_colors,
+                            first_corners, corner2gs)
+
+    def _convert_span_geometry(self, bo, geospan, mesh, data, faces, corners, bumpmap):
+        """Converts the requested tessfaces into the vertices and indices of a plGeometrySpan.
+           Returns the unclamped normals of the span's vertices."""
+        numVerts = len(corners.first_corners)
+        num_user_uvs = data.uvs.shape[2]
+        first_corners, corner2gs = corners.first_corners, corners.corner2gs
+
+        # If we have a bump mapping layer, then every vertex gets the sum of the bump gradients
+        # of all the faces using it in its magic channels.
+        if bumpmap is not None:
+            face_du, face_dv = self._calc_bump_gradients(bumpmap, mesh, data, faces)
+            corners_per_face = corners.corner_mask.sum(axis=1)
+            vtx_du = self._sum_corner_gradients(np.repeat(face_du, corners_per_face, axis=0), first_corners, corner2gs)
+            vtx_dv = self._sum_corner_gradients(np.repeat(face_dv, corners_per_face, axis=0), first_corners, corner2gs)
+        else:
+            vtx_du, vtx_dv = None, None
+
+        source_normals = corners.normals[first_corners].astype(np.float64)
+        vtx_normals = self._clamp_normals(source_normals)
+
+        vtx_uvws = corners.uvws[first_corners].astype(np.float64).reshape(numVerts, num_user_uvs, 2)
+        vtx_uvws[:, :, 1] = 1.0 - vtx_uvws[:, :, 1]
+
+        vertices = self._make_temp_vertices(
+            data.positions[corners.vertex_ids[first_corners]],
+            vtx_normals, corners.vertex_colors[first_corners], vtx_uvws,
+            vtx_du, vtx_dv
+        )
+        indices = self._triangulate(data.is_quad[faces], corners.corner_mask, corner2gs)
+
+        # Face sorted spans get their triangles reordered every frame anyway.
+        sort_faces = (geospan.props & plGeometrySpan.kRequiresBlending and
+                      not bo.plasma_modifiers.test_property("no_face_sort"))
+        if self._exporter().optimize_vertex_cache and not sort_faces:
+            vertices, indices, order = self._optimize_vertex_cache(vertices, indices)
+            source_normals = source_normals[order]
+
+        geospan.vertices = vertices
+        geospan.indices = indices
+        return source_normals
+
+    def _clamp_normals(self, normals):
+        # MOUL/DX9 craps its pants if any element of the normal is exactly 0.0
+        return np.where(normals >= 0.0, np.maximum(normals, 0.01), np.minimum(normals, -0.01))
+
+    def _optimize_vertex_cache(self, vertices, indices):
+        acmr = vertexcache.calc_acmr(indices)
+        indices = vertexcache.optimize_triangles(indices, len(vertices))
+        indices, order = vertexcache.reorder_vertices(indices, len(vertices))
+        vertices = [vertices[i] for i in order]
+        self._report.msg("Optimized vertex cache: ACMR {:.3f} -> {:.3f}", acmr, vertexcache.calc_acmr(indices))
+        return vertices, indices, np.asarray(order, dtype=np.int64)
+
+    def _split_span_faces(self, data, faces, corners):
+        """Splits the tessfaces of a span that has too many vertices into spatially coherent chunks
+           that each fit into a single plGeometrySpan."""
+        corner_mask = corners.corner_mask
+        face_gs = np.full(corner_mask.shape, -1, dtype=np.int64)
+        face_gs[corner_mask] = corners.corner2gs
+
+        corners_per_face = corner_mask.sum(axis=1)
+        face_positions = data.positions[data.face_verts[faces]] * corner_mask[:, :, np.newaxis]
+        centroids = face_positions.sum(axis=1) / corners_per_face[:, np.newaxis]
+
+        def count_verts(subset):
+            used = np.unique(face_gs[subset])
+            return len(used) - int(used[0] == -1)
+
+        # Keep cutting the faces in half along the longest axis of their bounds until every chunk
+        # is small enough. Chunks stay compact this way, so the culling bounds stay nice and tight.
+        def split(subset):
+            if count_verts(subset) <= _WARN_VERTS_PER_SPAN:
+                return [subset]
+            subset_centroids = centroids[subset]
+            axis = np.argmax(subset_centroids.max(axis=0) - subset_centroids.min(axis=0))
+            order = subset[np.argsort(subset_centroids[:, axis], kind="stable")]
+            half = len(order) // 2
+            return split(np.sort(order[:half])) + split(np.sort(order[half:]))
+
+        return [faces[i] for i in split(np.arange(len(faces)))]
+
+    def _copy_instance_geometry(self, geospans, source_geospans, matrix, has_bumpmap):
+        is_identity = np.allclose(matrix, np.identity(4), rtol=0.0, atol=1e-9)
+        rotation = matrix[:3, :3] / np.cbrt(np.linalg.det(matrix[:3, :3]))
+
+        for geospan, source_geospan in zip(geospans, source_geospans):
+            source_chunks = source_geospan.chunks
+            geospan.split(len(source_chunks))
+            for chunk, source_chunk, source_normals in zip(geospan.chunks, source_chunks, source_geospan.normals):
+                vertices = source_chunk.vertices
+                if not is_identity:
+                    # The source vertices' normals have already been clamped, so rotate the
+                    # original normals instead and clamp those.
+                    normals = self._clamp_normals(source_normals.dot(rotation.T))
+                    for vertex, vertex_normal in zip(vertices, normals.tolist()):
+                        position = vertex.position
+                        position = matrix[:3, :3].dot((position.X, position.Y, position.Z)) + matrix[:3, 3]
+                        vertex.position = hsVector3(*position.tolist())
+
+                        normal = hsVector3(*vertex_normal)
+                        normal.normalize()
+                        vertex.normal = normal
+
+                        # The magic bump mapping channels are directions, too.
+                        if has_bumpmap:
+                            uvs = vertex.uvs
+                            for i in range(len(uvs) - 2, len(uvs)):
+                                uvs[i] = hsVector3(*rotation.dot((uvs[i].X, uvs[i].Y, uvs[i].Z)).tolist())
+                            vertex.uvs = uvs
+                chunk.vertices = vertices
+                chunk.indices = source_chunk.indices
+                self._num_instanced_verts += len(vertices)
+                self._num_instanced_spans += 1
+
+    def _get_geo_data(self, bo, mesh):
         # Locate relevant vertex color layers now...
         lm = bo.plasma_modifiers.lightmap
         color = self._find_vtx_color_layer(mesh.tessface_vertex_colors, autocolor=not lm.bake_lightmap, manual=True)
         alpha = self._find_vtx_alpha_layer(mesh.tessface_vertex_colors)
+        return _GeoData(mesh, color, alpha)
 
-        # Convert Blender faces into things we can stuff into libHSPlasma
-        for i, tessface in enumerate(mesh.tessfaces):
-            data = geodata.get(tessface.material_index)
-            if data is None:
-                continue
+    def _is_rigid_transform(self, matrix):
+        """Determines if a transform only moves, rotates, and uniformly scales"""
+        if not np.allclose(matrix[3], (0.0, 0.0, 0.0, 1.0)):
+            return False
+        linear = matrix[:3, :3]
+        det = np.linalg.det(linear)
+        if det <= 0.0:
+            return False
+        scale_sq = np.cbrt(det) ** 2
+        return np.allclose(linear.T.dot(linear), np.identity(3) * scale_sq, rtol=0.0, atol=scale_sq * 1e-5)
+
+    def _get_span_params(self, materials, geospans, bumpmap):
+        """Gets everything about a mesh's geometry spans that changes how its vertices are converted"""
+        span_params = [(blmat_idx, i.geospan.format, i.geospan.props, tuple(i.mult_color))
+                       for (blmat_idx, _), i in zip(materials, geospans)]
+        if bumpmap is not None:
+            # The bump gradients only depend on the mesh and the bump layer's UV channel
+            span_params.append(("bump", bumpmap[0]))
+        return span_params
+
+    def _calc_geometry_digest(self, data, span_params):
+        """Hashes everything that goes into the vertices and indices of a mesh's geometry spans"""
+        hasher = hashlib.blake2b(repr(span_params).encode(), digest_size=16)
+
+        arrays = (data.positions, data.face_verts, data.face_mats, data.normals, data.uvs,
+                  data.colors, data.alphas)
+        for i in arrays:
+            if i is None:
+                hasher.update(b"\x00")
+            else:
+                hasher.update(repr(i.shape).encode())
+                hasher.update(np.ascontiguousarray(i).tobytes())
+        return hasher.digest()
+
+    def _calc_bump_gradients(self, bumpmap, mesh, data, faces):
+        """Calculates the bump gradients (dPosDu, dPosDv) of the requested tessfaces."""
+        face_du = np.empty((len(faces), 3), dtype=np.float32)
+        face_dv = np.empty((len(faces), 3), dtype=np.float32)
+        face_iter = zip(data.face_verts[faces].tolist(), data.uvs[faces].tolist(), data.is_quad[faces].tolist())
 
-            face_verts = []
+        for i, (vids, uvws, is_quad) in enumerate(face_iter):
             dPosDu = hsVector3(0.0, 0.0, 0.0)
             dPosDv = hsVector3(0.0, 0.0, 0.0)
 
-            # Unpack normals
-            tessface_normals = tessface.split_normals
-
-            # Unpack the UV coordinates from each UV Texture layer
-            # NOTE: Blender has no third (W) coordinate
-            tessface_uvws = [uvtex.data[i].uv for uvtex in mesh.tessface_uv_textures]
-
-            # Unpack colors
-            if color is None:
-                tessface_colors = ((1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0))
+            if is_quad:
+                gradPass = (((vids[0], vids[1], vids[2]), (uvws[0], uvws[1], uvws[2])),
+                            ((vids[0], vids[2], vids[3]), (uvws[0], uvws[2], uvws[3])))
             else:
-                src = color[i]
-                tessface_colors = (src.color1, src.color2, src.color3, src.color4)
+                gradPass = (((vids[0], vids[1], vids[2]), (uvws[0], uvws[1], uvws[2])),)
 
-            # Unpack alpha values
-            if alpha is None:
-                tessface_alphas = (1.0, 1.0, 1.0, 1.0)
-            else:
-                src = alpha[i]
-                # Some time between 2.79b and 2.80, vertex alpha colors appeared in Blender. However,
-                # there is no way to actually visually edit them. That means that we need to keep that
-                # fact in mind because we're just averaging the color to make alpha.
-                tessface_alphas = ((sum(src.color1[:3]) / 3), (sum(src.color2[:3]) / 3),
-                                   (sum(src.color3[:3]) / 3), (sum(src.color4[:3]) / 3))
-
-            if bumpmap is not None:
-                gradPass = []
-                gradUVWs = []
-
-                if len(tessface.vertices) != 3:
-                    gradPass.append([tessface.vertices[0], tessface.vertices[1], tessface.vertices[2]])
-                    gradPass.append([tessface.vertices[0], tessface.vertices[2], tessface.vertices[3]])
-                    gradUVWs.append((tuple((uvw[0] for uvw in tessface_uvws)),
-                                     tuple((uvw[1] for uvw in tessface_uvws)),
-                                     tuple((uvw[2] for uvw in tessface_uvws))))
-                    gradUVWs.append((tuple((uvw[0] for uvw in tessface_uvws)),
-                                     tuple((uvw[2] for uvw in tessface_uvws)),
-                                     tuple((uvw[3] for uvw in tessface_uvws))))
-                else:
-                    gradPass.append(tessface.vertices)
-                    gradUVWs.append((tuple((uvw[0] for uvw in tessface_uvws)),
-                                     tuple((uvw[1] for uvw in tessface_uvws)),
-                                     tuple((uvw[2] for uvw in tessface_uvws))))
-
-                for p, vids in enumerate(gradPass):
-                    dPosDu += self._get_bump_gradient(bumpmap[1], gradUVWs[p], mesh, vids, bumpmap[0], 0)
-                    dPosDv += self._get_bump_gradient(bumpmap[1], gradUVWs[p], mesh, vids, bumpmap[0], 1)
-                dPosDv = -dPosDv
-
-            # Convert to per-material indices
-            for j, vertex in enumerate(tessface.vertices):
-                vertex_normal = tuple(tessface_normals[j])
-                uvws = tuple([tuple(uvw[j]) for uvw in tessface_uvws])
-
-                # Calculate vertex colors.
-                if mat2span_LUT:
-                    mult_color = geospans[mat2span_LUT[tessface.material_index]].mult_color
-                else:
-                    mult_color = (1.0, 1.0, 1.0, 1.0)
-                tessface_color, tessface_alpha = tessface_colors[j], tessface_alphas[j]
-                vertex_color = (int(tessface_color[0] * mult_color[0] * 255),
-                                int(tessface_color[1] * mult_color[1] * 255),
-                                int(tessface_color[2] * mult_color[2] * 255),
-                                int(tessface_alpha    * mult_color[0] * 255))
-
-                # Now, we'll index into the vertex dict using the per-face elements :(
-                # We're using tuples because lists are not hashable. The many mathutils and PyHSPlasma
-                # types are not either, and it's entirely too much work to fool with all that.
-                normcoluv = (vertex_normal, vertex_color, uvws)
-                if normcoluv not in data.blender2gs[vertex]:
-                    source = mesh.vertices[vertex]
-                    geoVertex = plGeometrySpan.TempVertex()
-                    geoVertex.position = hsVector3(*source.co)
-
-                    # MOUL/DX9 craps its pants if any element of the normal is exactly 0.0
-                    normal = map(lambda x: max(x, 0.01) if x >= 0.0 else min(x, -0.01), vertex_normal)
-                    normal = hsVector3(*normal)
-                    normal.normalize()
-                    geoVertex.normal = normal
-
-                    geoVertex.color = hsColor32(*vertex_color)
-                    uvs = [hsVector3(uv[0], 1.0 - uv[1], 0.0) for uv in uvws]
-                    if bumpmap is not None:
-                        uvs.append(dPosDu)
-                        uvs.append(dPosDv)
-                    geoVertex.uvs = uvs
-
-                    idx = len(data.vertices)
-                    data.blender2gs[vertex][normcoluv] = idx
-                    data.vertices.append(geoVertex)
-                    face_verts.append(idx)
-                else:
-                    # If we have a bump mapping layer, then we need to add the bump gradients for
-                    # this face to the vertex's magic channels
-                    if bumpmap is not None:
-                        num_user_uvs = len(uvws)
-                        geoVertex = data.vertices[data.blender2gs[vertex][normcoluv]]
-
-                        # Unfortunately, PyHSPlasma returns a copy of everything. Previously, editing
-                        # in place would result in silent failures; however, as of python_refactor,
-                        # PyHSPlasma now returns tuples to indicate this.
-                        geoUVs = list(geoVertex.uvs)
-                        geoUVs[num_user_uvs] += dPosDu
-                        geoUVs[num_user_uvs+1] += dPosDv
-                        geoVertex.uvs = geoUVs
-                    face_verts.append(data.blender2gs[vertex][normcoluv])
-
-            # Convert to triangles, if need be...
-            num_faces = len(face_verts)
-            if num_faces == 3:
-                data.triangles += face_verts
-            elif num_faces == 4:
-                data.triangles += (face_verts[0], face_verts[1], face_verts[2])
-                data.triangles += (face_verts[0], face_verts[2], face_verts[3])
-
-        # Time to finish it up...
-        for i, data in enumerate(geodata.values()):
-            geospan = geospans[i].geospan
-            numVerts = len(data.vertices)
-            numUVs = geospan.format & plGeometrySpan.kUVCountMask
+            for gradVids, gradUVWs in gradPass:
+                dPosDu += self._get_bump_gradient(bumpmap[1], gradUVWs, mesh, gradVids, bumpmap[0], 0)
+                dPosDv += self._get_bump_gradient(bumpmap[1], gradUVWs, mesh, gradVids, bumpmap[0], 1)
+            dPosDv = -dPosDv
 
-            # There is a soft limit of 0x8000 vertices per span in Plasma, but the limit is
-            # theoretically 0xFFFF because this field is a 16-bit integer. However, bad things
-            # happen in MOUL when we have over 0x8000 vertices. I've also received tons of reports
-            # of stack dumps in PotS when modifiers are applied, so we're going to limit to 0x8000.
-            #     TODO: consider busting up the mesh into multiple geospans?
-            #           or hack plDrawableSpans::composeGeometry to do it for us?
-            if numVerts > _WARN_VERTS_PER_SPAN:
-                raise explosions.TooManyVerticesError(bo.data.name, geospan.material.name, numVerts)
+            face_du[i] = (dPosDu.X, dPosDu.Y, dPosDu.Z)
+            face_dv[i] = (dPosDv.X, dPosDv.Y, dPosDv.Z)
+        return face_du, face_dv
 
-            # If we're bump mapping, we need to normalize our magic UVW channels
-            if bumpmap is not None:
-                for vtx in data.vertices:
-                    uvMap = vtx.uvs
-                    uvMap[numUVs - 2].normalize()
-                    uvMap[numUVs - 1].normalize()
-                    vtx.uvs = uvMap
+    def _calc_vertex_colors(self, data, faces, corner_mask, mult_color):
+        """Calculates the final hsColor32 components for each face corner."""
+        num_corners = np.count_nonzero(corner_mask)
 
-            # If we're still here, let's add our data to the GeometrySpan
-            geospan.indices = data.triangles
-            geospan.vertices = data.vertices
+        if data.colors is None:
+            colors = np.ones((num_corners, 3), dtype=np.float64)
+        else:
+            colors = data.colors[faces][corner_mask].astype(np.float64)
 
+        if data.alphas is None:
+            alphas = np.ones(num_corners, dtype=np.float64)
+        else:
+            alphas = data.alphas[faces][corner_mask]
+
+        # NOTE: the alpha is multiplied by the red channel of the multiply color. This is not a typo.
+        result = np.empty((num_corners, 4), dtype=np.float64)
+        for i in range(3):
+            result[:, i] = colors[:, i] * mult_color[i] * 255
+        result[:, 3] = alphas * mult_color[0] * 255
+        return np.trunc(result).astype(np.uint32)
+
+    def _make_temp_vertices(self, positions, normals, colors, uvws, dPosDu, dPosDv):
+        vertices = []
+        vtx_iter = zip(positions.tolist(), normals.tolist(), colors.tolist(), uvws.tolist())
+
+        for i, (position, vertex_normal, vertex_color, vertex_uvws) in enumerate(vtx_iter):
+            geoVertex = plGeometrySpan.TempVertex()
+            geoVertex.position = hsVector3(*position)
+
+            normal = hsVector3(*vertex_normal)
+            normal.normalize()
+            geoVertex.normal = normal
+
+            geoVertex.color = hsColor32(*vertex_color)
+            uvs = [hsVector3(uv[0], uv[1], 0.0) for uv in vertex_uvws]
+            if dPosDu is not None:
+                # The magic bump mapping channels need to be normalized
+                for gradient in (dPosDu[i], dPosDv[i]):
+                    uvw = hsVector3(*gradient.tolist())
+                    uvw.normalize()
+                    uvs.append(uvw)
+            geoVertex.uvs = uvs
+            vertices.append(geoVertex)
+        return vertices
+
+    def _sum_corner_gradients(self, corner_gradients, first_corners, corner2gs):
+        """Sums the bump gradients of every corner sharing a vertex, in face order."""
+        # This has to be done with float32 math in the exact same order as hsVector3 would
+        # do it, so start with the first corner and add in all of the rest one-by-one.
+        vtx_gradients = corner_gradients[first_corners]
+        remainder = np.ones(len(corner2gs), dtype=bool)
+        remainder[first_corners] = False
+        np.add.at(vtx_gradients, corner2gs[remainder], corner_gradients[remainder])
+        return vtx_gradients
+
+    def _triangulate(self, is_quad, corner_mask, corner2gs):
+        """Converts per-corner span vertex indices into a triangle list"""
+        num_faces = len(is_quad)
+        face_indices = np.zeros(corner_mask.shape, dtype=np.int64)
+        face_indices[corner_mask] = corner2gs
+
+        # Quads are split into (0, 1, 2) and (0, 2, 3), just like always.
+        triangles = np.empty((num_faces, 2, 3), dtype=np.int64)
+        triangles[:, 0] = face_indices[:, (0, 1, 2)]
+        triangles[:, 1] = face_indices[:, (0, 2, 3)]
+        keep = np.column_stack((np.ones(num_faces, dtype=bool), is_quad))
+        return triangles[keep].ravel().tolist()
 
     def _get_bump_gradient(self, xform, uvws, mesh, vIds, uvIdx, iUV):
         v0 = hsVector3(*mesh.vertices[vIds[0]].co)
@@ -586,14 +856,7 @@ class MeshConverter(_MeshManager):
         return sorted(((i, material_source[i]) for i in valid_materials), key=lambda x: x[0])
 
     def export_object(self, bo, so : plSceneObject):
-        # If this object has modifiers, then it's a unique mesh, and we don't need to try caching it
-        # Otherwise, let's *try* to share meshes as best we can...
-        if bo.modifiers:
-            drawables = self._export_object(bo)
-        else:
-            drawables = self._mesh_geospans.get(bo.data, None)
-            if drawables is None:
-                drawables = self._export_object(bo)
+        drawables = self._export_object(bo)
 
         # Create the DrawInterface
         if drawables:
@@ -607,12 +870,10 @@ class MeshConverter(_MeshManager):
         if self._exporter().has_coordiface(bo):
             return self._export_mesh(bo, bo.data)
         else:
-            mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
-            with helpers.TemporaryObject(mesh, bpy.data.meshes.remove):
-                utils.transform_mesh(mesh, bo.matrix_world)
-                return self._export_mesh(bo, mesh)
+            with self._exporter().mesh_cache.get(bo) as mesh:
+                return self._export_mesh(bo, mesh, bo.matrix_world)
 
-    def _export_mesh(self, bo, mesh):
+    def _export_mesh(self, bo, mesh, matrix=None):
         mesh.calc_normals_split()
         mesh.calc_tessface()
 
@@ -628,7 +889,7 @@ class MeshConverter(_MeshManager):
         geospans, mat2span_LUT = self._export_material_spans(bo, mesh, materials)
 
         # Step 2: Export Blender mesh data to Plasma GeometrySpans
-        self._export_geometry(bo, mesh, materials, geospans, mat2span_LUT)
+        self._export_geometry(bo, mesh, materials, geospans, mat2span_LUT, matrix)
 
         # Step 3: Add plGeometrySpans to the appropriate DSpan and create indices
         _diindices = {}
@@ -636,9 +897,9 @@ class MeshConverter(_MeshManager):
             dspan = self._find_create_dspan(bo, i.geospan, i.pass_index)
             self._report.msg("Exported hsGMaterial '{}' geometry into '{}'",
                              i.geospan.material.name, dspan.key.name)
-            idx = dspan.addSourceSpan(i.geospan)
             diidx = _diindices.setdefault(dspan, [])
-            diidx.append(idx)
+            for geospan in i.chunks:
+                diidx.append(dspan.addSourceSpan(geospan))
 
         # Step 3.1: Harvest Span indices and create the DIIndices
         drawables = []
@@ -658,22 +919,24 @@ class MeshConverter(_MeshManager):
             blmat = materials[0][1]
             self._check_vtx_nonpreshaded(bo, mesh, 0, blmat)
             matKey = self.material.export_waveset_material(bo, blmat)
-            geospan = self._create_geospan(bo, mesh, None, blmat, matKey)
 
-            # FIXME: Can some of this be generalized?
-            geospan.props |= (plGeometrySpan.kWaterHeight | plGeometrySpan.kLiteVtxNonPreshaded |
-                              plGeometrySpan.kPropReverseSort | plGeometrySpan.kPropNoShadow)
-            geospan.waterHeight = bo.matrix_world.translation[2]
-            return [_GeoSpan(bo, blmat, geospan)], None
+            def create_geospan():
+                geospan = self._create_geospan(bo, mesh, None, blmat, matKey)
+
+                # FIXME: Can some of this be generalized?
+                geospan.props |= (plGeometrySpan.kWaterHeight | plGeometrySpan.kLiteVtxNonPreshaded |
+                                  plGeometrySpan.kPropReverseSort | plGeometrySpan.kPropNoShadow)
+                geospan.waterHeight = bo.matrix_world.translation[2]
+                return geospan
+            return [_GeoSpan(bo, blmat, create_geospan(), factory=create_geospan)], None
         else:
             geospans = [None] * len(materials)
             mat2span_LUT = {}
             for i, (blmat_idx, blmat) in enumerate(materials):
                 self._check_vtx_nonpreshaded(bo, mesh, blmat_idx, blmat)
                 matKey = self.material.export_material(bo, blmat)
-                geospans[i] = _GeoSpan(bo, blmat,
-                                       self._create_geospan(bo, mesh, blmat_idx, blmat, matKey),
-                                       blmat.pass_index)
+                create_geospan = functools.partial(self._create_geospan, bo, mesh, blmat_idx, blmat, matKey)
+                geospans[i] = _GeoSpan(bo, blmat, create_geospan(), blmat.pass_index, create_geospan)
                 mat2span_LUT[blmat_idx] = i
             return geospans, mat2span_LUT
 
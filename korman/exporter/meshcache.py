@@ -0,0 +1,137 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bmesh
+import bpy
+import mathutils
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import itertools
+from typing import *
+import weakref
+
+from . import utils
+
+if TYPE_CHECKING:
+    from .convert import Exporter
+
+# Rough cost, in bytes, of each element of a Blender mesh. This doesn't need to be exact, it only
+# keeps the cache from holding onto every mesh in a large Age at once.
+_VERTEX_SIZE = 32
+_EDGE_SIZE = 16
+_LOOP_SIZE = 24
+_POLYGON_SIZE = 24
+
+_DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class _CachedMesh:
+    def __init__(self, mesh: bpy.types.Mesh):
+        self.mesh = mesh
+        self.users = 0
+        self.size = (len(mesh.vertices) * _VERTEX_SIZE + len(mesh.edges) * _EDGE_SIZE +
+                     len(mesh.loops) * _LOOP_SIZE + len(mesh.polygons) * _POLYGON_SIZE)
+
+
+class MeshCache:
+    """Evaluates objects into meshes for all of the converters that need them. Each object is only
+       evaluated once per modifier stack and transform, no matter how many times it's asked for.
+    """
+
+    def __init__(self, exporter: Exporter, max_size: int = _DEFAULT_MAX_SIZE):
+        self._exporter = weakref.ref(exporter)
+        self._entries: OrderedDict[Tuple, _CachedMesh] = OrderedDict()
+        self._size = 0
+        self._max_size = max_size
+
+        exporter.exit_stack.callback(self.clear)
+
+    def clear(self):
+        """Frees all of the cached meshes"""
+        for entry in self._entries.values():
+            bpy.data.meshes.remove(entry.mesh)
+        self._entries.clear()
+        self._size = 0
+
+    def invalidate(self):
+        """Forgets all of the cached meshes. This must be called if the source meshes are changed
+           during the export, otherwise meshes evaluated before the change will be handed out.
+        """
+        assert not any(i.users for i in self._entries.values()), "cached meshes are still in use"
+        self.clear()
+
+    def _evaluate(self, bo: bpy.types.Object, matrix: Optional[mathutils.Matrix]) -> bpy.types.Mesh:
+        if matrix is None:
+            return bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
+
+        # Transformed meshes are made from the local space mesh, so the modifiers are only ever
+        # applied once.
+        with self.get(bo) as local_mesh:
+            mesh = local_mesh.copy()
+        utils.transform_mesh(mesh, matrix)
+        return mesh
+
+    def _evict(self):
+        # Least recently used meshes go first, but anything that's still being used has to stay.
+        for key, entry in list(self._entries.items()):
+            if self._size <= self._max_size:
+                break
+            if entry.users == 0:
+                del self._entries[key]
+                self._size -= entry.size
+                bpy.data.meshes.remove(entry.mesh)
+
+    @contextmanager
+    def get(self, bo: bpy.types.Object, matrix: Optional[mathutils.Matrix] = None) -> Iterator[bpy.types.Mesh]:
+        """Gets an object's mesh with its modifiers applied, optionally transformed by the given
+           matrix. The mesh is shared with other converters, so it must not be changed, and it is
+           only valid until the end of the with statement.
+        """
+        key = self._make_key(bo, matrix)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _CachedMesh(self._evaluate(bo, matrix))
+            self._entries[key] = entry
+            self._size += entry.size
+        else:
+            self._entries.move_to_end(key)
+
+        entry.users += 1
+        try:
+            yield entry.mesh
+        finally:
+            entry.users -= 1
+            self._evict()
+
+    @contextmanager
+    def get_bmesh(self, bo: bpy.types.Object, matrix: Optional[mathutils.Matrix] = None) -> Iterator[bmesh.types.BMesh]:
+        """Gets a BMesh of an object with its modifiers applied, optionally transformed by the given
+           matrix. The BMesh is a private copy that may be changed at will.
+        """
+        mesh = bmesh.new()
+        try:
+            with self.get(bo, matrix) as source:
+                mesh.from_mesh(source)
+            yield mesh
+        finally:
+            mesh.free()
+
+    def _make_key(self, bo: bpy.types.Object, matrix: Optional[mathutils.Matrix]) -> Tuple:
+        modifiers = tuple((i.name, i.type, i.show_render) for i in bo.modifiers)
+        space = None if matrix is None else tuple(itertools.chain.from_iterable(matrix))
+        return (bo.name, bo.data.name, modifiers, space)
@@ -0,0 +1,91 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bpy
+
+from collections import defaultdict
+from typing import *
+
+
+class ExportObjectIndex:
+    """An ordered collection of Blender objects with constant time membership tests and
+       precomputed lists of the objects in each page, of each type, and with each modifier.
+    """
+
+    def __init__(self, objects: Iterable[bpy.types.Object] = ()):
+        self._objects: List[bpy.types.Object] = []
+        self._keys: Set[Tuple[str, Optional[str]]] = set()
+        self._pages: DefaultDict[Optional[str], List[bpy.types.Object]] = defaultdict(list)
+        self._page_types: DefaultDict[Tuple[Optional[str], str], List[bpy.types.Object]] = defaultdict(list)
+        self._types: DefaultDict[str, List[bpy.types.Object]] = defaultdict(list)
+
+        # Modifiers can still be enabled on objects after they've been added, so these are
+        # only collected the first time they're asked for.
+        self._modifiers: Optional[DefaultDict[Tuple[Optional[str], str], List[bpy.types.Object]]] = None
+
+        self.extend(objects)
+
+    def __contains__(self, bo: bpy.types.Object) -> bool:
+        return self._get_key(bo) in self._keys
+
+    def __iter__(self) -> Iterator[bpy.types.Object]:
+        return iter(self._objects)
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def add(self, bo: bpy.types.Object):
+        key = self._get_key(bo)
+        if key in self._keys:
+            return
+        self._objects.append(bo)
+        self._keys.add(key)
+        page = bo.plasma_object.page
+        self._pages[page].append(bo)
+        self._page_types[(page, bo.type)].append(bo)
+        self._types[bo.type].append(bo)
+        self._modifiers = None
+
+    def extend(self, objects: Iterable[bpy.types.Object]):
+        for i in objects:
+            self.add(i)
+
+    @staticmethod
+    def _get_key(bo: bpy.types.Object) -> Tuple[str, Optional[str]]:
+        # Objects linked in from other blend files can have the same name as local objects.
+        return (bo.name, None if bo.library is None else bo.library.name)
+
+    def by_modifier(self, pl_id: str, page: Optional[str] = None) -> Sequence[bpy.types.Object]:
+        """Gets all objects with the given Plasma modifier enabled, optionally only those in
+           the given page"""
+        if self._modifiers is None:
+            self._modifiers = defaultdict(list)
+            for bo in self._objects:
+                for mod in bo.plasma_modifiers.modifiers:
+                    self._modifiers[(None, mod.pl_id)].append(bo)
+                    self._modifiers[(bo.plasma_object.page, mod.pl_id)].append(bo)
+        return self._modifiers.get((page, pl_id), ())
+
+    def by_page(self, page: Optional[str], type: Optional[str] = None) -> Sequence[bpy.types.Object]:
+        """Gets all objects in the given page, optionally only those of the given type"""
+        if type is None:
+            return self._pages.get(page, ())
+        return self._page_types.get((page, type), ())
+
+    def by_type(self, type: str) -> Sequence[bpy.types.Object]:
+        """Gets all objects of the given Blender object type"""
+        return self._types.get(type, ())
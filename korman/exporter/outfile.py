@@ -13,6 +13,8 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 import enum
 from hashlib import md5
@@ -67,6 +69,7 @@ class _OutputFile:
         self.internal = kwargs.get("internal", False)
         self.file_path = None
         self.mod_time = None
+        self._pending = None
 
         if self.file_type in (_FileType.generated_dat, _FileType.generated_ancillary):
             self.file_data = kwargs.get("file_data", None)
@@ -153,7 +156,41 @@ class _OutputFile:
     def __hash__(self):
         return hash(str(self))
 
+    def hash_async(self, pool):
+        """Starts hashing this file on the given thread pool, if that hasn't already happened."""
+        if self._pending is None:
+            self._pending = pool.submit(self._hash_md5)
+
+    def write_async(self, pool, file_path):
+        """Writes the buffered file data to disk on the given thread pool, hashing it as we go."""
+        def write():
+            h = md5()
+            data = memoryview(self.file_data)
+            with open(file_path, "wb") as handle:
+                for i in range(0, len(data), _CHUNK_SIZE):
+                    chunk = data[i:i+_CHUNK_SIZE]
+                    h.update(chunk)
+                    handle.write(chunk)
+
+            # From here on, we're a file on disk like any other.
+            self.mod_time = Path(file_path).stat().st_mtime
+            self.file_path = file_path
+            self.file_data = None
+            return h.digest()
+
+        assert self._pending is None
+        self._pending = pool.submit(write)
+
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()
+
     def hash_md5(self):
+        if self._pending is not None:
+            return self._pending.result()
+        return self._hash_md5()
+
+    def _hash_md5(self):
         if self.file_path:
             with open(self.file_path, "rb") as handle:
                 h = md5()
@@ -187,6 +224,14 @@ class OutputFiles:
         self._py_files = set()
         self._time = time.time()
 
+        # Keep the Python compylers alive for the whole export, not just one file.
+        exporter.exit_stack.enter_context(korlib.CompyleSession())
+
+        # Writing, hashing, and reading files all release the GIL, so those things happen
+        # on worker threads while the next page is being serialized.
+        self._num_threads = os.cpu_count() or 1
+        self._pool = exporter.exit_stack.enter_context(ThreadPoolExecutor(max_workers=self._num_threads))
+
     def add_ancillary(self, filename, dirname="", text_id=None, str_data=None):
         of = _OutputFile(file_type=_FileType.generated_ancillary,
                          dirname=dirname, filename=filename,
@@ -214,6 +259,7 @@ class OutputFiles:
                          needs_glue=True)
         self._files.add(of)
         self._py_files.add(filename)
+        self._exporter().fingerprints.record_output("python_mod", filename, text_id)
 
     def add_sdl(self, filename, text_id=None, str_data=None):
         of = _OutputFile(file_type=_FileType.sdl,
@@ -221,6 +267,7 @@ class OutputFiles:
                          id_data=text_id, file_data=str_data,
                          enc=self.super_secure_encryption)
         self._files.add(of)
+        self._exporter().fingerprints.record_output("sdl", filename, text_id)
 
 
     def add_sfx(self, sound_id):
@@ -228,6 +275,7 @@ class OutputFiles:
                          dirname="sfx", filename=sound_id.name,
                          id_data=sound_id)
         self._files.add(of)
+        self._exporter().fingerprints.record_output("sfx", sound_id.name, sound_id)
 
     @contextmanager
     def generate_dat_file(self, filename, **kwargs):
@@ -235,18 +283,15 @@ class OutputFiles:
         dirname = kwargs.get("dirname", "dat")
         bogus = dat_only and dirname != "dat"
 
+        # Everything is serialized into memory. Actually writing the file to disk (and hashing
+        # it) is handed off to the thread pool so we can move on to the next file.
         if self._is_zip or bogus:
-            stream = hsRAMStream(self._version)
+            file_path = None
         else:
-            if dat_only:
-                file_path = self._export_file.parent.joinpath(filename)
-            else:
-                file_path = self._export_path.joinpath(dirname, filename)
+            file_path = self.get_dat_path(filename, dirname)
             file_path.parent.mkdir(parents=True, exist_ok=True)
-            file_path = str(file_path) # FIXME when we bump to Python 3.6+
-            stream = hsFileStream(self._version)
-            stream.open(file_path, fmCreate)
-        backing_stream = stream
+            file_path = str(file_path)
+        backing_stream = stream = hsRAMStream(self._version)
 
         # No sense in wasting time encrypting data that isn't going to be used in the export
         # Also, don't encrypt any MOUL files at all.
@@ -257,36 +302,48 @@ class OutputFiles:
                 stream.open(backing_stream, fmCreate, enc)
 
         # The actual export code is run at the "yield" statement. If an error occurs, we
-        # do not want to track this file. Note that the except block is required for the
-        # else block to be legal. ^_^
+        # do not want to track this file.
         try:
             yield stream
-        except:
-            raise
-        else:
-            # Not passing enc as a keyword argument to the output file definition. It makes more
-            # sense to yield an encrypted stream from this context manager and encrypt as we go
-            # instead of doing lots of buffer copying to encrypt as a post step.
-            if not bogus:
-                kwargs = {
-                    "file_type": _FileType.generated_dat if dirname == "dat" else
-                                 _FileType.generated_ancillary,
-                    "dirname": dirname,
-                    "filename": filename,
-                    "skip_hash": kwargs.get("skip_hash", False),
-                    "internal": kwargs.get("internal", False),
-                }
-                if isinstance(backing_stream, hsRAMStream):
-                    kwargs["file_data"] = backing_stream.buffer
-                else:
-                    kwargs["file_path"] = file_path
-                self._files.add(_OutputFile(**kwargs))
         finally:
             # Must call the EncryptedStream close to actually encrypt the data
             if isinstance(stream, plEncryptedStream):
                 stream.close()
-            if isinstance(backing_stream, hsFileStream):
-                backing_stream.close()
+
+        # Not passing enc as a keyword argument to the output file definition. It makes more
+        # sense to yield an encrypted stream from this context manager and encrypt as we go
+        # instead of doing lots of buffer copying to encrypt as a post step.
+        if not bogus:
+            of = _OutputFile(file_type=_FileType.generated_dat if dirname == "dat" else
+                                       _FileType.generated_ancillary,
+                             dirname=dirname, filename=filename,
+                             skip_hash=kwargs.get("skip_hash", False),
+                             internal=kwargs.get("internal", False),
+                             file_data=backing_stream.buffer)
+            if file_path is None:
+                of.hash_async(self._pool)
+            else:
+                of.write_async(self._pool, file_path)
+            self._files.add(of)
+
+    def get_dat_path(self, filename, dirname="dat"):
+        """Returns where a generated file is written on disk"""
+        if self._exporter().dat_only:
+            return self._export_file.parent.joinpath(filename)
+        else:
+            return self._export_path.joinpath(dirname, filename)
+
+    @property
+    def is_zip(self):
+        return self._is_zip
+
+    def reuse_dat_file(self, filename):
+        """Tracks a PRP that was left on disk by a previous export"""
+        of = _OutputFile(file_type=_FileType.generated_dat,
+                         dirname="dat", filename=filename,
+                         file_path=str(self.get_dat_path(filename)))
+        of.hash_async(self._pool)
+        self._files.add(of)
 
     def _generate_files(self, func=None):
         dat_only = self._exporter().dat_only
@@ -312,16 +369,16 @@ class OutputFiles:
         else:
             py_version = (2, 3)
 
-        try:
-            pyc_objects = []
+        def iter_sources():
             for i in self._generate_files(func):
                 if i.needs_glue:
-                    py_code = "{}\n\n{}\n".format(i.file_data, plasma_python_glue)
+                    yield i.filename, "{}\n\n{}\n".format(i.file_data, plasma_python_glue)
                 else:
-                    py_code = i.file_data
-                result, pyc = korlib.compyle(i.filename, py_code, py_version, report)
-                if result:
-                    pyc_objects.append((i.filename, pyc))
+                    yield i.filename, i.file_data
+
+        try:
+            pyc_objects = [(filename, pyc) for filename, result, pyc in
+                           korlib.compyle_many(iter_sources(), py_version, report) if result]
         except korlib.PythonNotAvailableError as error:
             report.warn(f"Python {error} is not available. Your Age scripts were not packaged.")
         else:
@@ -353,6 +410,10 @@ class OutputFiles:
         else:
             self._write_deps()
 
+        # Step 4: Be sure that everything has actually hit the disk
+        for i in self._files:
+            i.wait()
+
     @property
     def super_secure_encryption(self):
         version = self._version
@@ -423,6 +484,8 @@ class OutputFiles:
 
         with self.generate_dat_file(filename, enc=enc, skip_hash=True) as stream:
             files = list(self._generate_files(func))
+            for i in files:
+                i.hash_async(self._pool)
             stream.writeInt(len(files))
             stream.writeInt(0)
             for i in files:
@@ -432,8 +495,8 @@ class OutputFiles:
                     filename = i.filename
                 else:
                     filename = "{}\\{}".format(i.dirname, i.filename)
-                mod_time = i.mod_time if i.mod_time else self._time
                 hash_md5 = i.hash_md5()
+                mod_time = i.mod_time if i.mod_time else self._time
 
                 stream.writeSafeStr(filename)
                 stream.write(hash_md5)
@@ -449,20 +512,44 @@ class OutputFiles:
             func = lambda x: not x.internal
         report = self._exporter().report
 
+        def load(i, arcpath):
+            if i.file_data:
+                if isinstance(i.file_data, str):
+                    data = i.file_data.encode(_encoding)
+                else:
+                    data = i.file_data
+                zi = zipfile.ZipInfo(arcpath, export_time)
+            elif i.file_path:
+                with open(i.file_path, "rb") as handle:
+                    data = handle.read()
+                zi = zipfile.ZipInfo.from_file(i.file_path, arcpath)
+            else:
+                return None
+            zi.compress_type = zipfile.ZIP_DEFLATED
+            return zi, data
+
+        # Files are read in on the pool while the previous ones are being deflated into the
+        # archive. Limit the number of files in flight, otherwise we'd be holding the whole
+        # Age in memory at once.
+        in_flight = collections.deque()
+        max_in_flight = self._num_threads * 2
+
+        def write_next(zf):
+            arcpath, job = in_flight.popleft()
+            result = job.result()
+            if result is None:
+                report.warn(f"No data found for dependency file '{arcpath}'. It will not be archived.")
+            else:
+                zf.writestr(*result)
+
         with zipfile.ZipFile(str(self._export_file), 'w', zipfile.ZIP_DEFLATED) as zf:
             for i in self._generate_files(func):
                 arcpath = i.filename if dat_only else str(Path(i.dirname, i.filename))
-                if i.file_data:
-                    if isinstance(i.file_data, str):
-                        data = i.file_data.encode(_encoding)
-                    else:
-                        data = i.file_data
-                    zi = zipfile.ZipInfo(arcpath, export_time)
-                    zf.writestr(zi, data)
-                elif i.file_path:
-                    zf.write(i.file_path, arcpath)
-                else:
-                    report.warn(f"No data found for dependency file '{arcpath}'. It will not be archived.")
+                in_flight.append((arcpath, self._pool.submit(load, i, arcpath)))
+                while len(in_flight) > max_in_flight:
+                    write_next(zf)
+            while in_flight:
+                write_next(zf)
 
     @property
     def _version(self):
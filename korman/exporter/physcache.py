@@ -0,0 +1,166 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bpy
+
+import hashlib
+import numpy as np
+import os
+from PyHSPlasma import *
+import struct
+from typing import *
+import weakref
+
+if TYPE_CHECKING:
+    from .convert import Exporter
+
+_MAGICK = b"KPC\x00"
+_VERSION = 2
+_DIGEST_SIZE = 16
+
+_HEADER = struct.Struct("<4sII")
+_ENTRY = struct.Struct(f"<{_DIGEST_SIZE}sIII")
+_UINT32 = struct.Struct("<I")
+
+# Marks a cooked physical that has no index buffer
+_NO_INDICES = 0xFFFFFFFF
+
+# Incremental exports don't convert the colliders in reused pages, so entries are only dropped
+# once they've gone unused for this many exports in a row.
+_MAX_UNUSED_EXPORTS = 8
+
+
+class _CookedPhysical(NamedTuple):
+    verts: np.ndarray
+    indices: Optional[np.ndarray]
+
+
+class PhysicsCache:
+    """Remembers the vertices and indices of physicals between exports, keyed by the geometry
+       they were generated from.
+    """
+
+    def __init__(self, exporter: Exporter):
+        self._exporter = weakref.ref(exporter)
+        self._entries: Dict[bytes, _CookedPhysical] = {}
+        self._unused: Dict[bytes, int] = {}
+        self._used = set()
+        self._loaded = False
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, digest: bytes, verts: Sequence[hsVector3], indices: Optional[Sequence[int]] = None):
+        verts = np.array([(i.X, i.Y, i.Z) for i in verts], dtype=np.float32).reshape(-1, 3)
+        if indices is not None:
+            indices = np.array(indices, dtype=np.uint32)
+        self._entries[digest] = _CookedPhysical(verts, indices)
+        self._used.add(digest)
+        self._dirty = True
+
+    def calc_digest(self, mesh: bpy.types.Mesh, *params) -> bytes:
+        """Hashes a mesh's geometry along with anything else that affects how it is cooked"""
+        hasher = hashlib.blake2b(repr(params).encode(), digest_size=_DIGEST_SIZE)
+        for collection, attr, dtype, width in ((mesh.vertices, "co", np.float32, 3),
+                                               (mesh.loops, "vertex_index", np.uint32, 1),
+                                               (mesh.polygons, "loop_total", np.uint32, 1)):
+            data = np.empty(len(collection) * width, dtype=dtype)
+            collection.foreach_get(attr, data)
+            hasher.update(_UINT32.pack(len(data)))
+            hasher.update(data.tobytes())
+        return hasher.digest()
+
+    def get(self, digest: bytes) -> Optional[_CookedPhysical]:
+        self.load()
+        cooked = self._entries.get(digest)
+        if cooked is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._used.add(digest)
+        return cooked
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        path = self._exporter().physcache_path
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self._report.warn(f"Could not read the physics cache: {e}")
+            return
+
+        try:
+            self._read(memoryview(data))
+        except (AssertionError, ValueError, struct.error):
+            self._report.warn("Physics cache is corrupt and will be regenerated")
+            self._entries.clear()
+
+    def _read(self, buf: memoryview):
+        magick, version, count = _HEADER.unpack_from(buf, 0)
+        assert magick == _MAGICK
+        if version != _VERSION:
+            return
+
+        pos = _HEADER.size
+        for _ in range(count):
+            digest, num_verts, num_indices, unused = _ENTRY.unpack_from(buf, pos)
+            pos += _ENTRY.size
+            verts = np.frombuffer(buf, dtype="<f4", count=num_verts * 3, offset=pos).reshape(num_verts, 3)
+            pos += verts.nbytes
+            if num_indices == _NO_INDICES:
+                indices = None
+            else:
+                indices = np.frombuffer(buf, dtype="<u4", count=num_indices, offset=pos)
+                pos += indices.nbytes
+            self._entries[digest] = _CookedPhysical(verts, indices)
+            self._unused[digest] = unused
+
+    @property
+    def _report(self):
+        return self._exporter().report
+
+    def save(self):
+        self._report.msg(f"Physics cache: {self.hits} hits, {self.misses} misses")
+
+        # Colliders that haven't been exported in a while are tossed.
+        unused = {digest: 0 if digest in self._used else self._unused.get(digest, 0) + 1
+                  for digest in self._entries.keys()}
+        if unused == self._unused and not self._dirty:
+            return
+        for digest, count in unused.items():
+            if count > _MAX_UNUSED_EXPORTS:
+                del self._entries[digest]
+        self._unused = {digest: count for digest, count in unused.items() if digest in self._entries}
+
+        path = self._exporter().physcache_path
+        temp_path = path.with_name(f"{path.name}.tmp")
+        with temp_path.open("wb") as handle:
+            handle.write(_HEADER.pack(_MAGICK, _VERSION, len(self._entries)))
+            for digest, cooked in self._entries.items():
+                num_indices = _NO_INDICES if cooked.indices is None else len(cooked.indices)
+                handle.write(_ENTRY.pack(digest, len(cooked.verts), num_indices, self._unused[digest]))
+                handle.write(cooked.verts.astype("<f4").tobytes())
+                if cooked.indices is not None:
+                    handle.write(cooked.indices.astype("<u4").tobytes())
+        os.replace(temp_path, path)
+        self._dirty = False
+
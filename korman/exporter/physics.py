@@ -21,7 +21,7 @@ from PyHSPlasma import *
 import weakref
 
 from .explosions import ExportError, ExportAssertionError
-from ..helpers import bmesh_from_object, TemporaryObject
+from .physcache import PhysicsCache
 from . import utils
 
 def _set_phys_prop(prop, sim, phys, value=True):
@@ -38,6 +38,7 @@ class PhysicsConverter:
             "hull": self._export_hull,
             "trimesh": self._export_trimesh,
         }
+        self.cache = PhysicsCache(exporter)
 
     def _apply_props(self, simIface, physical, props):
         for i in props.get("properties", []):
@@ -61,34 +62,45 @@ class PhysicsConverter:
         return indices
 
     def _convert_mesh_data(self, bo, physical, local_space, mat, indices=True):
-        mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
-        with TemporaryObject(mesh, bpy.data.meshes.remove):
-            if local_space:
-                mesh.update(calc_tessface=indices)
-                physical.pos = hsVector3(*mat.to_translation())
-                physical.rot = utils.quaternion(mat.to_quaternion())
-
-                # Physicals can't have scale...
-                scale = mat.to_scale()
-                if scale[0] == 1.0 and scale[1] == 1.0 and scale[2] == 1.0:
-                    # Whew, don't need to do any math!
-                    vertices = [hsVector3(*i.co) for i in mesh.vertices]
+        if local_space:
+            physical.pos = hsVector3(*mat.to_translation())
+            physical.rot = utils.quaternion(mat.to_quaternion())
+
+            # Physicals can't have scale...
+            scale = mat.to_scale()
+        else:
+            scale = None
+
+        with self._mesh_cache.get(bo, None if local_space else mat) as mesh:
+            kind = "mesh" if indices else "points"
+            digest = self.cache.calc_digest(mesh, kind, local_space, None if scale is None else tuple(scale))
+            cooked = self.cache.get(digest)
+            if cooked is not None:
+                vertices = [hsVector3(*i) for i in cooked.verts.tolist()]
+                if indices:
+                    return (vertices, cooked.indices.tolist())
                 else:
-                    # Dagnabbit...
-                    vertices = [hsVector3(i.co.x * scale.x, i.co.y * scale.y, i.co.z * scale.z) for i in mesh.vertices]
-            else:
-                # apply the transform to the physical itself
-                utils.transform_mesh(mesh, mat)
-                mesh.update(calc_tessface=indices)
+                    return vertices
+
+            mesh.update(calc_tessface=indices)
+            if scale is None or (scale[0] == 1.0 and scale[1] == 1.0 and scale[2] == 1.0):
+                # Whew, don't need to do any math! Either this is a local space physical
+                # without any scale, or the transform was applied to the mesh itself.
                 vertices = [hsVector3(*i.co) for i in mesh.vertices]
+            else:
+                # Dagnabbit...
+                vertices = [hsVector3(i.co.x * scale.x, i.co.y * scale.y, i.co.z * scale.z) for i in mesh.vertices]
 
             # Trying to export a collider with no vertices, eh?
             if not vertices:
                 raise ExportError(f"[{bo.name}]: Cannot export a collision mesh with no vertices!")
 
             if indices:
-                return (vertices, self._convert_indices(mesh))
+                indices = self._convert_indices(mesh)
+                self.cache.add(digest, vertices, indices)
+                return (vertices, indices)
             else:
+                self.cache.add(digest, vertices)
                 return vertices
 
     def generate_flat_proxy(self, bo, so, **kwargs):
@@ -103,10 +115,8 @@ class PhysicsConverter:
             physical.object = so.key
             physical.sceneNode = self._mgr.get_scene_node(bl=bo)
 
-            mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=False)
-            with TemporaryObject(mesh, bpy.data.meshes.remove):
-                # No mass and no emedded xform, so we force worldspace collision.
-                utils.transform_mesh(mesh, bo.matrix_world)
+            # No mass and no emedded xform, so we force worldspace collision.
+            with self._mesh_cache.get(bo, bo.matrix_world) as mesh:
                 mesh.update(calc_tessface=True)
 
                 if z_coord is None:
@@ -305,7 +315,28 @@ class PhysicsConverter:
         # Only certain builds of libHSPlasma are able to take artist generated triangle soups and
         # bake them to convex hulls. Specifically, Windows 32-bit w/PhysX 2.6. Everything else just
         # needs to have us provide some friendlier data...
-        with bmesh_from_object(bo) as mesh:
+        if local_space:
+            physical.pos = hsVector3(*mat.to_translation())
+            physical.rot = utils.quaternion(mat.to_quaternion())
+            space = tuple(mat.to_scale())
+        else:
+            space = tuple(itertools.chain.from_iterable(mat))
+
+        with self._mesh_cache.get(bo) as mesh:
+            digest = self.cache.calc_digest(mesh, "hull", local_space, space)
+        cooked = self.cache.get(digest)
+        if cooked is not None:
+            if len(cooked.verts):
+                physical.verts = [hsVector3(*i) for i in cooked.verts.tolist()]
+                return
+
+            # Flat hulls are cached without any vertices.
+            self._report.warn("{}: Physical wants to be a convex hull but appears to be flat, forcing to triangle mesh...",
+                              bo.name)
+            self._export_trimesh(bo, physical, local_space, mat)
+            return
+
+        with self._mesh_cache.get_bmesh(bo) as mesh:
             # Don't export flat planes as convex hulls - force them to triangle meshes.
             volume = mesh.calc_volume()
             if volume < 0.001:
@@ -313,12 +344,11 @@ class PhysicsConverter:
                     "{}: Physical wants to be a convex hull but appears to be flat (volume={}), forcing to triangle mesh...",
                     bo.name, volume
                 )
+                self.cache.add(digest, [])
                 self._export_trimesh(bo, physical, local_space, mat)
                 return
 
             if local_space:
-                physical.pos = hsVector3(*mat.to_translation())
-                physical.rot = utils.quaternion(mat.to_quaternion())
                 bmesh.ops.scale(mesh, vec=mat.to_scale(), verts=mesh.verts)
             else:
                 mesh.transform(mat)
@@ -326,7 +356,9 @@ class PhysicsConverter:
             result = bmesh.ops.convex_hull(mesh, input=mesh.verts, use_existing_faces=False)
             BMVert = bmesh.types.BMVert
             verts = itertools.takewhile(lambda x: isinstance(x, BMVert), result["geom"])
-            physical.verts = [hsVector3(*i.co) for i in verts]
+            vertices = [hsVector3(*i.co) for i in verts]
+            physical.verts = vertices
+            self.cache.add(digest, vertices)
 
     def _export_sphere(self, bo, physical, local_space, mat):
         """Exports sphere bounds based on the object"""
@@ -362,6 +394,10 @@ class PhysicsConverter:
                 return False
         return subworld_mod.is_dedicated_subworld(self._exporter())
 
+    @property
+    def _mesh_cache(self):
+        return self._exporter().mesh_cache
+
     @property
     def _mgr(self):
         return self._exporter().mgr
@@ -40,7 +40,7 @@ class PythonPackageExporter:
             py_version = (2, 2)
         else:
             py_version = (2, 3)
-        py_code = []
+        py_sources = []
 
         for filename, source in self._pfms.items():
             if isinstance(source, Text):
@@ -52,11 +52,7 @@ class PythonPackageExporter:
                 code = source
 
             code = "{}\n\n{}\n".format(code, plasma_python_glue)
-            success, result = korlib.compyle(filename, code, py_version, report)
-            if not success:
-                raise ExportError("Failed to compyle '{}':\n{}".format(filename, result))
-            py_code.append((filename, result))
-            inc_progress()
+            py_sources.append((filename, code))
 
         for filename, source in self._modules.items():
             if isinstance(source, Text):
@@ -68,7 +64,11 @@ class PythonPackageExporter:
                 code = source
 
             # no glue needed here, ma!
-            success, result = korlib.compyle(filename, code, py_version, report)
+            py_sources.append((filename, code))
+
+        # Everything is handed to the compyle servers in one go.
+        py_code = []
+        for filename, success, result in korlib.compyle_many(py_sources, py_version, report):
             if not success:
                 raise ExportError("Failed to compyle '{}':\n{}".format(filename, result))
             py_code.append((filename, result))
@@ -132,7 +132,8 @@ class PythonPackageExporter:
         """Runs a stripped-down version of the Exporter that only handles Python files"""
         age_props = bpy.context.scene.world.plasma_age
         log = logger.ExportVerboseLogger if age_props.verbose else logger.ExportProgressLogger
-        with korlib.ConsoleToggler(age_props.show_console), log(self._filepath) as report:
+        with korlib.ConsoleToggler(age_props.show_console), korlib.CompyleSession(), \
+             log(self._filepath) as report:
             report.progress_add_step("Harvesting Plasma PythonFileMods")
             report.progress_add_step("Harvesting Helper Python Modules")
             report.progress_add_step("Compyling Python Code")
@@ -0,0 +1,151 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reorders triangle lists so that the GPU's post-transform vertex cache is actually useful.
+   The triangle ordering is Tom Forsyth's "Linear-Speed Vertex Cache Optimisation".
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from typing import *
+
+# Size of the simulated LRU cache used to score vertices
+_CACHE_SIZE = 32
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRI_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+
+# Size of the FIFO cache used to measure the result. This is in the ballpark of the post-transform
+# caches on the older cards that Plasma games tend to be played on.
+_ACMR_CACHE_SIZE = 16
+
+_CACHE_SCORES = [_LAST_TRI_SCORE] * 3 + [(1.0 - (i - 3) / (_CACHE_SIZE - 3)) ** _CACHE_DECAY_POWER
+                                         for i in range(3, _CACHE_SIZE)]
+
+
+def _calc_vertex_score(cache_pos: int, num_tris: int) -> float:
+    if num_tris == 0:
+        # No triangles left, so this vertex is useless.
+        return -1.0
+    score = _CACHE_SCORES[cache_pos] if cache_pos >= 0 else 0.0
+
+    # Vertices with only a few triangles left get a boost so that they get finished off and
+    # don't leave lonely triangles lying around.
+    return score + _VALENCE_BOOST_SCALE * num_tris ** -_VALENCE_BOOST_POWER
+
+
+def calc_acmr(indices: Sequence[int], cache_size: int = _ACMR_CACHE_SIZE) -> float:
+    """Calculates the average number of vertices transformed per triangle (ACMR) with a FIFO
+       vertex cache. Lower is better: 3.0 is the worst case and 0.5 is about the best case."""
+    if not indices:
+        return 0.0
+
+    cache = []
+    misses = 0
+    for i in indices:
+        if i not in cache:
+            misses += 1
+            cache.append(i)
+            if len(cache) > cache_size:
+                del cache[0]
+    return misses / (len(indices) // 3)
+
+
+def optimize_triangles(indices: Sequence[int], num_verts: int) -> List[int]:
+    """Reorders a triangle list for post-transform vertex cache locality"""
+    num_tris = len(indices) // 3
+    if num_tris == 0:
+        return list(indices)
+
+    # Build a vertex -> triangles adjacency table.
+    corners = np.asarray(indices, dtype=np.int64)
+    tri_ids = np.repeat(np.arange(num_tris), 3)
+    order = np.argsort(corners, kind="stable")
+    counts = np.bincount(corners, minlength=num_verts)
+    offsets = np.zeros(num_verts + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    sorted_tris = tri_ids[order].tolist()
+    offsets = offsets.tolist()
+    vtx_tris = [sorted_tris[offsets[i]:offsets[i+1]] for i in range(num_verts)]
+
+    tri_verts = corners.reshape(num_tris, 3).tolist()
+    remaining = counts.tolist()
+    cache_pos = [-1] * num_verts
+    vtx_scores = [_calc_vertex_score(-1, i) for i in remaining]
+    tri_scores = [vtx_scores[a] + vtx_scores[b] + vtx_scores[c] for a, b, c in tri_verts]
+    emitted = [False] * num_tris
+
+    cache = []
+    result = []
+    next_unemitted = 0
+    best_tri = max(range(num_tris), key=tri_scores.__getitem__)
+
+    while True:
+        emitted[best_tri] = True
+        tri = tri_verts[best_tri]
+        result.extend(tri)
+        for i in tri:
+            remaining[i] -= 1
+            vtx_tris[i].remove(best_tri)
+
+        # Move this triangle's vertices to the front of the cache. The cache can temporarily
+        # grow to three more than its size -- those are the vertices that just fell out.
+        new_cache = tri + [i for i in cache if i not in tri]
+        for pos, i in enumerate(new_cache):
+            cache_pos[i] = pos if pos < _CACHE_SIZE else -1
+
+        # Rescore everything that was touched and find the best triangle using those vertices.
+        best_tri, best_score = -1, -1.0
+        for i in new_cache:
+            score = _calc_vertex_score(cache_pos[i], remaining[i])
+            delta = score - vtx_scores[i]
+            vtx_scores[i] = score
+            for j in vtx_tris[i]:
+                tri_scores[j] += delta
+        for i in new_cache[:_CACHE_SIZE]:
+            for j in vtx_tris[i]:
+                if tri_scores[j] > best_score:
+                    best_tri, best_score = j, tri_scores[j]
+        cache = new_cache[:_CACHE_SIZE]
+
+        if best_tri == -1:
+            # Nothing in the cache is connected to anything we haven't emitted yet, so just pick
+            # the next triangle in the original order. This is what Forsyth recommends, too.
+            while next_unemitted < num_tris and emitted[next_unemitted]:
+                next_unemitted += 1
+            if next_unemitted == num_tris:
+                break
+            best_tri = next_unemitted
+    return result
+
+
+def reorder_vertices(indices: Sequence[int], num_verts: int) -> Tuple[List[int], List[int]]:
+    """Reorders vertices into the order that the triangles first use them for pre-transform
+       fetch locality. Returns the new indices and the old index of each new vertex."""
+    remap = [-1] * num_verts
+    order = []
+    for i in indices:
+        if remap[i] == -1:
+            remap[i] = len(order)
+            order.append(i)
+
+    # Don't drop any vertices that aren't used by any triangles.
+    for i in range(num_verts):
+        if remap[i] == -1:
+            remap[i] = len(order)
+            order.append(i)
+    return [remap[i] for i in indices], order
@@ -31,14 +31,16 @@ class IDPropMixin:
     the _idprop_mapping and _idprop_sources methods in your class. The mixin will handle upgrading
     the properties when a derived class is touched.
 
-    Unfortunately, it is not possible to easily batch convert everything on load or save, due to issues
+    Unfortunately, it is not possible to easily batch convert everything on save, due to issues
     in the way Blender's Python API functions. Long story short: PropertyGroups do not execute __new__
     or __init__. Furthermore, Blender's UI does not appreciate having ID Datablocks return from
     __getattribute__. To make matters worse, all properties are locked in a read-only state during
-    the UI draw stage.
+    the UI draw stage. What we can do is upgrade everything when a blend file is loaded (see
+    upgrade_all_idprops()). Once a file has been upgraded, the attribute access hooks are removed
+    from the class entirely so that everything else doesn't have to pay for them.
     """
 
-    def __getattribute__(self, attr):
+    def _checked_getattribute(self, attr):
         _getattribute = super().__getattribute__
 
         # Let's make sure no one is trying to access an old version...
@@ -59,7 +61,7 @@ class IDPropMixin:
         # Must be something regular. Just super it.
         return super().__getattribute__(attr)
 
-    def __setattr__(self, attr, value):
+    def _checked_setattr(self, attr, value):
         idprops = super().__getattribute__("_idprop_mapping")()
 
         # Disallow any attempts to set the old string property
@@ -72,6 +74,19 @@ class IDPropMixin:
         # Now, pass along our update
         super().__setattr__(attr, value)
 
+    @classmethod
+    def install_hooks(cls):
+        """Checks every attribute access for properties that need to be upgraded"""
+        IDPropMixin.__getattribute__ = IDPropMixin._checked_getattribute
+        IDPropMixin.__setattr__ = IDPropMixin._checked_setattr
+
+    @classmethod
+    def remove_hooks(cls):
+        """Stops checking attribute accesses once everything has been upgraded"""
+        for i in ("__getattribute__", "__setattr__"):
+            if i in IDPropMixin.__dict__:
+                delattr(IDPropMixin, i)
+
     @classmethod
     def register(cls):
         if hasattr(super(), "register"):
@@ -108,6 +123,9 @@ class IDPropMixin:
         return True
 
 
+IDPropMixin.install_hooks()
+
+
 class IDPropObjectMixin(IDPropMixin):
     """Like IDPropMixin, but with the assumption that all IDs can be found in bpy.data.objects"""
 
@@ -241,19 +259,99 @@ def triprop_texture(object_attr: str, material_attr: str, texture_attr: str, **k
         **kwargs
     )
 
+def _iter_property_groups(struct):
+    """Recursively yields all of the PropertyGroups hanging off of a Blender struct"""
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.type not in {"POINTER", "COLLECTION"}:
+            continue
+        value = getattr(struct, prop.identifier)
+        if prop.type == "POINTER":
+            if isinstance(value, bpy.types.PropertyGroup):
+                yield value
+                yield from _iter_property_groups(value)
+        else:
+            for item in value:
+                if not isinstance(item, bpy.types.PropertyGroup):
+                    break
+                yield item
+                yield from _iter_property_groups(item)
+
+# The datablocks that have been through an upgrade since the blend file was loaded, keyed by
+# their collection, name, and library. Names survive undo, unlike the datablocks' pointers.
+_upgraded_ids = set()
+
+def _iter_idprop_datablocks():
+    # All of our data hangs off of plasma_* properties on the ID datablocks...
+    id_collections = ("cameras", "images", "lamps", "materials", "objects", "scenes", "sounds",
+                      "texts", "textures", "worlds")
+    for collection_name in id_collections:
+        for datablock in getattr(bpy.data, collection_name):
+            yield collection_name, datablock
+
+    # ... and the logic nodes.
+    for tree in bpy.data.node_groups:
+        if tree.bl_idname == "PlasmaNodeTree":
+            yield "node_groups", tree
+
+def _get_id_key(collection_name, datablock):
+    library = datablock.library
+    return (collection_name, datablock.name, None if library is None else library.name)
+
+def _iter_idprop_users(datablock):
+    # Logic nodes appear to have issues with silently updating themselves. I expect that Blender is
+    # doing something strange in the UI code that causes our metaprogramming tricks to be bypassed.
+    if isinstance(datablock, bpy.types.NodeTree):
+        for node in datablock.nodes:
+            yield node
+            yield from _iter_property_groups(node)
+        return
+
+    for prop in datablock.bl_rna.properties:
+        if not prop.identifier.startswith("plasma_"):
+            continue
+        value = getattr(datablock, prop.identifier)
+        if isinstance(value, bpy.types.PropertyGroup):
+            yield value
+            yield from _iter_property_groups(value)
+
+def _upgrade_datablocks(datablocks):
+    for collection_name, datablock in datablocks:
+        for i in _iter_idprop_users(datablock):
+            if isinstance(i, IDPropMixin):
+                assert i._try_upgrade_idprops()
+        _upgraded_ids.add(_get_id_key(collection_name, datablock))
+
+def upgrade_all_idprops():
+    """Upgrades every legacy string property in the blend file to an ID property"""
+    _upgrade_datablocks(_iter_idprop_datablocks())
+
+def upgrade_new_idprops():
+    """Upgrades the legacy string properties of any datablocks that have not been upgraded since the
+       blend file was loaded, such as datablocks that were appended or linked from older files.
+    """
+    _upgrade_datablocks([i for i in _iter_idprop_datablocks() if _get_id_key(*i) not in _upgraded_ids])
+
 @bpy.app.handlers.persistent
-def _upgrade_node_trees(dummy):
+def _install_idprop_hooks(dummy):
+    # Whatever file is being loaded might not be upgraded yet.
+    IDPropMixin.install_hooks()
+bpy.app.handlers.load_pre.append(_install_idprop_hooks)
+
+@bpy.app.handlers.persistent
+def _upgrade_idprops(dummy):
     """
-    Logic node haxxor incoming!
-    Logic nodes appear to have issues with silently updating themselves. I expect that Blender is
-    doing something strange in the UI code that causes our metaprogramming tricks to be bypassed.
-    Therefore, we will loop through all Plasma node trees and forcibly update them on blend load.
+    Upgrades all ID properties in one go the first time a blend file is loaded, so that attribute
+    accesses don't have to be checked at all afterward.
     """
-
-    for tree in bpy.data.node_groups:
-        if tree.bl_idname != "PlasmaNodeTree":
-            continue
-        for node in tree.nodes:
-            if isinstance(node, IDPropMixin):
-                assert node._try_upgrade_idprops()
-bpy.app.handlers.load_post.append(_upgrade_node_trees)
+    _upgraded_ids.clear()
+    scenes = bpy.data.scenes
+    if not all(i.plasma_scene.idprops_upgraded for i in scenes):
+        upgrade_all_idprops()
+        for i in scenes:
+            i.plasma_scene.idprops_upgraded = True
+    else:
+        # Everything in the file was upgraded when it was last loaded. There's nothing to walk, but
+        # the exporter still needs to know what was already here.
+        _upgraded_ids.update(_get_id_key(*i) for i in _iter_idprop_datablocks())
+    IDPropMixin.remove_hooks()
+bpy.app.handlers.load_post.append(_upgrade_idprops)
@@ -76,6 +76,7 @@ finally:
     from .console import ConsoleCursor, ConsoleToggler
     from .python import *
     from .texture import TEX_DETAIL_ALPHA, TEX_DETAIL_ADD, TEX_DETAIL_MULTIPLY
+    from .texture import load_image_pixels, read_float_pixels, use_pixel_loader
 
     _IDENTIFIER_RANGES = ((ord('0'), ord('9')), (ord('A'), ord('Z')), (ord('a'), ord('z')))
     from keyword import kwlist as _kwlist
@@ -16,51 +16,208 @@
 from __future__ import generators # Python 2.2
 import marshal
 import os.path
+import struct
 import sys
 
 _python_executables = {}
+_compyle_servers = {}
+
+# Maximum number of compyler processes to keep alive per Python version
+_MAX_COMPYLE_SERVERS = 4
+
+# Compyle server pipe protocol:
+# request:  uint32_t nameSize, uint32_t codeSize, char name[nameSize], char code[codeSize]
+# response: uint8_t status, uint32_t dataSize, char data[dataSize]
+# Closing the server's stdin shuts it down.
+_REQUEST_FORMAT = ">II"
+_RESPONSE_FORMAT = ">BI"
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+# Number of lines of the server's stderr kept around for error messages
+_MAX_STDERR_LINES = 200
 
 class PythonNotAvailableError(Exception):
     pass
 
 
+class CompyleSession:
+    """Keeps the compyle servers alive until the context is exited"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutdown_compyle_servers()
+
+
+class _CompyleServer:
+    """A long-lived Python 2.x process that compyles source code sent over a pipe"""
+
+    def __init__(self, py_executable):
+        import subprocess
+        import threading
+
+        args = (py_executable, __file__, "--serve")
+        self._process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        self._pending = 0
+        self._writer = None
+
+        # stderr has to be read as it comes in. Otherwise, a compyler that prints lots of
+        # warnings fills up the pipe and blocks, and we wait forever for its response.
+        self._stderr = []
+        self._stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_reader.start()
+
+    def close(self):
+        import subprocess
+
+        if self.alive():
+            self._drain()
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._stderr_reader.join()
+        self._process.stdout.close()
+        self._process.stderr.close()
+
+    def alive(self):
+        return self._process.poll() is None
+
+    def _crashed(self):
+        self._pending = 0
+        self._process.wait()
+        self._stderr_reader.join()
+        error = b"".join(self._stderr).decode("utf-8", "replace")
+        return "Compyler process exited with code {}\n{}".format(self._process.returncode, error)
+
+    def _drain(self):
+        # Discard any responses left over from an abandoned batch so that
+        # the next response we read matches the next request we send. The
+        # responses must be read first, lest the writer block on a full pipe.
+        while self._pending:
+            self.receive()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def _read_stderr(self):
+        for line in iter(self._process.stderr.readline, b""):
+            self._stderr.append(line)
+            del self._stderr[:-_MAX_STDERR_LINES]
+
+    def receive(self):
+        stdout = self._process.stdout
+        header = _read_exactly(stdout, struct.calcsize(_RESPONSE_FORMAT))
+        if header is None:
+            return (False, self._crashed())
+        status, data_size = struct.unpack(_RESPONSE_FORMAT, header)
+        data = _read_exactly(stdout, data_size)
+        if data is None:
+            return (False, self._crashed())
+        self._pending -= 1
+
+        if status == _STATUS_OK:
+            return (True, data)
+        return (False, data.decode("utf-8", "replace").replace('\r\n', '\n'))
+
+    def submit(self, requests):
+        """Queues (module_name, py_code) byte string pairs for compylation.
+           Each request must be answered by a call to `receive`."""
+        import threading
+
+        self._drain()
+        self._pending += len(requests)
+
+        # The requests are fed from a separate thread so that neither side
+        # of the pipe can deadlock on a full buffer.
+        self._writer = threading.Thread(target=self._write_requests, args=(requests,), daemon=True)
+        self._writer.start()
+
+    def _write_requests(self, requests):
+        stdin = self._process.stdin
+        try:
+            for module_name, py_code in requests:
+                stdin.write(struct.pack(_REQUEST_FORMAT, len(module_name), len(py_code)))
+                stdin.write(module_name)
+                stdin.write(py_code)
+            stdin.flush()
+        except OSError:
+            # The server died. The reader will pick up the pieces.
+            pass
+
+
 def compyle(file_name, py_code, py_version, report=None):
+    for _, success, result in compyle_many(((file_name, py_code),), py_version, report):
+        return (success, result)
+
+def compyle_many(sources, py_version, report=None, num_servers=None):
+    """Compyles (file_name, py_code) pairs using long-lived compyle servers.
+       Returns an iterator of (file_name, success, result) in the order of `sources`."""
     # NOTE: Should never run under Python 2.x
     my_version = sys.version_info[:2]
     assert my_version == (2, 7) or my_version[0] > 2
 
-    # Remember: Python 2.2 file, so no single line if statements...
-    idx = file_name.find('.')
-    if idx == -1:
-        module_name = file_name
-    else:
-        module_name = file_name[:idx]
-
-    if report is not None:
-        report.msg("Compyling {}", file_name)
-
-    if my_version != py_version:
-        import subprocess
+    if my_version == py_version:
+        raise NotImplementedError()
 
-        py_executable = _find_python(py_version)
-        args = (py_executable, __file__, module_name)
+    # Remember: Python 2.2 file, so no single line if statements...
+    requests = []
+    for file_name, py_code in sources:
+        idx = file_name.find('.')
+        if idx == -1:
+            module_name = file_name
+        else:
+            module_name = file_name[:idx]
         try:
             py_code = py_code.encode("utf-8")
         except UnicodeError:
+            py_code = None
+        requests.append((file_name, module_name.encode("utf-8"), py_code))
+    if not requests:
+        return iter(())
+
+    if num_servers is None:
+        num_servers = min(len(requests), os.cpu_count() or 1, _MAX_COMPYLE_SERVERS)
+    servers = _get_compyle_servers(py_version, max(num_servers, 1))
+
+    # Spread the work round robin over the servers; the results are read back
+    # in the same order, so the output is independent of the number of servers.
+    batches = []
+    for i in range(len(servers)):
+        batches.append([])
+    for i in range(len(requests)):
+        file_name, module_name, py_code = requests[i]
+        if py_code is not None:
+            batches[i % len(servers)].append((module_name, py_code))
+    for i in range(len(servers)):
+        servers[i].submit(batches[i])
+
+    return _receive_compyled(requests, servers, report)
+
+def _receive_compyled(requests, servers, report):
+    for i in range(len(requests)):
+        file_name, module_name, py_code = requests[i]
+        if report is not None:
+            report.msg("Compyling {}", file_name)
+
+        if py_code is None:
             if report is not None:
                 report.error("Could not encode '{}'", file_name, indent=report.indent_level+1)
-            return (False, "Could not encode file")
-        result = subprocess.run(args, input=py_code, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        if result.returncode != 0:
-            try:
-                error = result.stdout.decode("utf-8").replace('\r\n', '\n')
-            except UnicodeError:
-                error = result.stdout
-            if report is not None:
-                report.error("Compylation Error in '{}'\n{}", file_name, error, indent=report.indent_level+1)
-        return (result.returncode == 0, result.stdout)
-    else:
-        raise NotImplementedError()
+            yield (file_name, False, "Could not encode file")
+            continue
+
+        success, result = servers[i % len(servers)].receive()
+        if not success and report is not None:
+            report.error("Compylation Error in '{}'\n{}", file_name, result, indent=report.indent_level+1)
+        yield (file_name, success, result)
 
 def _compyle(module_name, py_code):
     # Old python versions have major issues with Windows style newlines.
@@ -79,6 +236,18 @@ def _compyle(module_name, py_code):
     # Therefore, we simply return the marshalled data as a string.
     return marshal.dumps(code_object)
 
+def _get_compyle_servers(py_version, num_servers):
+    servers = _compyle_servers.setdefault(py_version, [])
+    for server in servers[:]:
+        if not server.alive():
+            server.close()
+            servers.remove(server)
+    if len(servers) < num_servers:
+        py_executable = _find_python(py_version)
+        while len(servers) < num_servers:
+            servers.append(_CompyleServer(py_executable))
+    return servers[:num_servers]
+
 def _find_python(py_version):
     def find_executable(py_version):
         # First, try to use Blender to find the Python executable
@@ -124,6 +293,45 @@ def _find_python_reg(reg_key, py_version):
     else:
         return os.path.join(python_dir, "python.exe")
 
+def _read_exactly(stream, size):
+    # NOTE: Shared with the Python 2.2 compyle server.
+    data = stream.read(size)
+    if len(data) == size:
+        return data
+    chunks = [data]
+    size = size - len(data)
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            return None
+        chunks.append(data)
+        size = size - len(data)
+    return chunks[0][:0].join(chunks)
+
+def _serve(stdin, stdout):
+    import traceback
+
+    header_size = struct.calcsize(_REQUEST_FORMAT)
+    while 1:
+        header = _read_exactly(stdin, header_size)
+        if header is None:
+            break
+        name_size, code_size = struct.unpack(_REQUEST_FORMAT, header)
+        module_name = _read_exactly(stdin, name_size)
+        py_code = _read_exactly(stdin, code_size)
+        if module_name is None or py_code is None:
+            break
+
+        try:
+            result = _compyle(module_name, py_code)
+            status = _STATUS_OK
+        except:
+            result = "".join(traceback.format_exception(*sys.exc_info()))
+            status = _STATUS_ERROR
+        stdout.write(struct.pack(_RESPONSE_FORMAT, status, len(result)))
+        stdout.write(result)
+        stdout.flush()
+
 def package_python(stream, pyc_objects):
     # Python.pak format:
     # uint32_t numFiles
@@ -165,6 +373,12 @@ def package_python(stream, pyc_objects):
         stream.writeInt(len(compyled_code))
         stream.write(compyled_code)
 
+def shutdown_compyle_servers():
+    for servers in _compyle_servers.values():
+        for server in servers:
+            server.close()
+    _compyle_servers.clear()
+
 def verify_python(py_version, py_exe):
     if not py_exe:
         return False
@@ -197,6 +411,11 @@ if __name__ == "__main__":
         module_name = sys.argv[1]
     except IndexError:
         module_name = "<string>"
-    py_code_source = sys.stdin.read()
-    py_code_object = _compyle(module_name, py_code_source)
-    sys.stdout.write(py_code_object)
+    if module_name == "--serve":
+        if sys.platform == "win32":
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        _serve(sys.stdin, sys.stdout)
+    else:
+        py_code_source = sys.stdin.read()
+        py_code_object = _compyle(module_name, py_code_source)
+        sys.stdout.write(py_code_object)
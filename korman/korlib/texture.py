@@ -13,11 +13,12 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
-import array
 import bgl
+import bpy
 import enum
 from ..helpers import ensure_power_of_two
 import math
+import numpy as np
 from PyHSPlasma import plBitmap
 
 # BGL doesn't know about this as of Blender 2.74
@@ -28,72 +29,119 @@ TEX_DETAIL_ALPHA = 0
 TEX_DETAIL_ADD = 1
 TEX_DETAIL_MULTIPLY = 2
 
+# Number of pixels checked at a time when looking for alpha
+_ALPHA_SCAN_CHUNK = 0x10000
+
+def _filter_taps(src_size, dst_size):
+    """Computes the source indices and weights contributing to each destination pixel along one
+       axis of the image. Mirrors the float math in _korlib's _scale_image.
+    """
+    scale = np.float32(src_size) / np.float32(dst_size)
+    filter_size = max(scale, np.float32(1.0))
+
+    src_pos = np.arange(dst_size, dtype=np.float32) * scale
+    start = np.maximum(np.trunc(src_pos - filter_size).astype(np.intp), 0)
+    end = np.minimum(np.trunc(src_pos + filter_size).astype(np.intp), src_size - 1)
+
+    num_taps = int((end - start).max()) + 1
+    indices = start[:, None] + np.arange(num_taps, dtype=np.intp)
+    weights = np.float32(1.0) - np.abs((indices.astype(np.float32) - src_pos[:, None]) / filter_size)
+
+    # Anything past the end of the filter window, or with a negative weight, doesn't contribute.
+    weights[(indices > end[:, None]) | (weights <= 0.0)] = 0.0
+    np.minimum(indices, src_size - 1, out=indices)
+    return indices, weights
+
+
 def scale_image(buf, srcW, srcH, dstW, dstH):
     """Scales an RGBA image using the algorithm from CWE's plMipmap::ScaleNicely"""
-    dst, dst_idx = bytearray(dstW * dstH * 4), 0
-    scaleX, scaleY = (srcW / dstW), (srcH / dstH)
-    filterW, filterH = max(scaleX, 1.0), max(scaleY, 1.0)
-
-    src_rowspan = srcW * 4
-    weightsY = array.array("f", [0.0] * 16)
-    weightsX = array.array("f", [0.0] * 16)
-
-    # I hope you're in no particular hurry...
-    for dstY in range(dstH):
-        srcY = dstY * scaleY
-        srcY_start = int(max(srcY - filterH, 0))
-        srcY_end = int(min(srcY + filterH, srcH - 1))
-
-        #weightsY = { i - srcY_start: 1.0 - abs(i - srcY) / scaleY \
-        #             for i in range(srcY_start, srcY_end+1, 1) if i - srcY_start < 16 }
-        for i in range(16):
-            idx = i + srcY_start
-            if idx > srcY_end:
-                break
-            weightsY[i] = 1.0 - abs(idx - srcY) / filterH
-
-        for dstX in range(dstW):
-            srcX = dstX * scaleX
-            srcX_start = int(max(srcX - filterW, 0))
-            srcX_end = int(min(srcX + filterW, srcW - 1))
-
-            #weightsX = { i - srcX_start: 1.0 - abs(i - srcX) / scaleX \
-            #             for i in range(srcX_start, srcX_end+1, 1) if i - srcX_start < 16 }
-            for i in range(16):
-                idx = i + srcX_start
-                if idx > srcX_end:
-                    break
-                weightsX[i] = 1.0 - abs(idx - srcX) / filterW
-
-            accum_color = [0.0, 0.0, 0.0, 0.0]
-            weight_total = 0.0
-            for i in range(srcY_start, srcY_end+1, 1):
-                weightY_idx = i - srcY_start
-                weightY = weightsY[weightY_idx] if weightY_idx < 16 else 1.0 - abs(i - srcY) / filterH
-                weightY = 1.0 - abs(i - srcY) / filterH
-
-                src_idx = (i * src_rowspan) + (srcX_start * 4)
-                for j in range(srcX_start, srcX_end+1, 1):
-                    weightX_idx = j - srcX_start
-                    weightX = weightsX[weightX_idx] if weightX_idx < 16 else 1.0 - abs(j - srcX) / filterW
-                    weight = weightY * weightX
-
-                    if weight > 0.0:
-                        # According to profiling, a list comprehension here doubles the execution time of this
-                        # function. I know this function is supposed to be slow, but dayum... I've unrolled it
-                        # to avoid all the extra allocations.
-                        for k in range(4):
-                            accum_color[k] = accum_color[k] + buf[src_idx+k] * weight
-                        weight_total += weight
-                    src_idx += 4
-
-            weight_total = max(weight_total, 0.0001)
-            for i in range(4):
-                accum_color[i] = int(accum_color[i] * (1.0 / weight_total))
-            dst[dst_idx:dst_idx+4] = accum_color
-            dst_idx += 4
-
-    return bytes(dst)
+    if len(buf) != srcW * srcH * 4:
+        raise ValueError("buf size ({} bytes) incorrect (expected: {} bytes)".format(len(buf), srcW * srcH * 4))
+
+    src = np.frombuffer(buf, dtype=np.uint8).reshape(srcH, srcW, 4).astype(np.float32)
+    src /= np.float32(255.0)
+
+    rows, weightsY = _filter_taps(srcH, dstH)
+    cols, weightsX = _filter_taps(srcW, dstW)
+
+    # Every destination pixel accumulates its taps row by row, then column by column, just like
+    # _korlib does. Float addition isn't associative, so any other order can change the result.
+    # Taps that _korlib skips have a weight of zero, which leaves the sums untouched.
+    accum = np.zeros((dstH, dstW, 4), dtype=np.float32)
+    weight_total = np.zeros((dstH, dstW), dtype=np.float32)
+    for tapY in range(rows.shape[1]):
+        src_rows = src[rows[:, tapY]]
+        for tapX in range(cols.shape[1]):
+            weight = weightsY[:, tapY, None] * weightsX[None, :, tapX]
+            accum += src_rows[:, cols[:, tapX]] * weight[:, :, None]
+            weight_total += weight
+
+    accum *= (np.float32(1.0) / np.maximum(weight_total, np.float32(0.0001)))[:, :, None]
+    accum *= np.float32(255.0)
+    return np.clip(accum, 0.0, 255.0).astype(np.uint8).tobytes()
+
+
+# Scratch space for reading Blender's float pixels. Images are only ever loaded on the
+# main thread, so one buffer is shared by all of them.
+_pixel_scratch = np.empty(0, dtype=np.float32)
+
+def read_float_pixels(pixels, count):
+    """Reads the float channels of a Blender image's pixels in bulk. The result is a view of a
+       scratch buffer that is reused by the next call, so copy it if it needs to stick around.
+    """
+    global _pixel_scratch
+    if _pixel_scratch.size < count:
+        _pixel_scratch = np.empty(count, dtype=np.float32)
+    buf = _pixel_scratch[:count]
+
+    # bpy_prop_array.foreach_get is not available in all versions of Blender. Slicing is
+    # much slower and creates a Python float for every channel, but it gets the job done.
+    if hasattr(pixels, "foreach_get"):
+        pixels.foreach_get(buf)
+    else:
+        buf[:] = pixels[:]
+    return buf
+
+def _linear_to_srgb(buf):
+    return np.where(buf <= 0.0031308, buf * 12.92, 1.055 * np.power(np.maximum(buf, 0.0), 1.0 / 2.4) - 0.055)
+
+def load_image_pixels(image, bgra=False, inverted=False):
+    """Reads the pixels of a Blender image without using OpenGL. Returns a tuple of the image
+       width, height, and RGBA (or BGRA) bytes, suitable for GLTexture.image_data.
+    """
+    width, height = image.size
+    channels = image.channels
+    pixels = image.pixels
+    count = width * height * channels
+    if count == 0 or len(pixels) != count:
+        raise RuntimeError("failed to load image")
+
+    src = read_float_pixels(pixels, count).reshape(height, width, channels)
+    if image.is_float and image.colorspace_settings.name == "Linear":
+        src = _linear_to_srgb(src)
+
+    # Blender stores images bottom row first, just like OpenGL does, so flip them right
+    # side up unless the caller doesn't care. Unlike OpenGL, we get the image at its actual
+    # size, so there is no need to undo Blender's power of two scaling.
+    if not inverted:
+        src = src[::-1]
+
+    dst = np.empty((height, width, 4), dtype=np.uint8)
+    if channels >= 3:
+        color = src[:, :, (2, 1, 0)] if bgra else src[:, :, :3]
+        alpha = src[:, :, 3] if channels == 4 else 1.0
+    else:
+        color = src[:, :, :1]
+        alpha = src[:, :, 1] if channels == 2 else 1.0
+    np.rint(np.clip(color, 0.0, 1.0) * 255.0, out=dst[:, :, :3], casting="unsafe")
+    np.rint(np.clip(alpha, 0.0, 1.0) * 255.0, out=dst[:, :, 3], casting="unsafe")
+    return width, height, dst.tobytes()
+
+def use_pixel_loader(image):
+    """Returns whether an image should be read by load_image_pixels instead of OpenGL"""
+    # There's no OpenGL context at all when running in the background. Otherwise, only
+    # skip OpenGL when Blender can hand us the pixels in bulk.
+    return bpy.app.background or hasattr(image.pixels, "foreach_get")
 
 
 @enum.unique
@@ -154,11 +202,12 @@ class GLTexture:
 
     @property
     def _detail_falloff(self):
-        num_levels = self.num_levels
-        return ((self._texkey.detail_fade_start / 100.0) * num_levels,
-                (self._texkey.detail_fade_stop / 100.0) * num_levels,
-                 self._texkey.detail_opacity_start / 100.0,
-                 self._texkey.detail_opacity_stop / 100.0)
+        # This is all float math in _korlib, so don't let anything get promoted to a double.
+        num_levels = np.float32(self.num_levels)
+        return ((np.float32(self._texkey.detail_fade_start) / np.float32(100.0)) * num_levels,
+                (np.float32(self._texkey.detail_fade_stop) / np.float32(100.0)) * num_levels,
+                 np.float32(self._texkey.detail_opacity_start) / np.float32(100.0),
+                 np.float32(self._texkey.detail_opacity_stop) / np.float32(100.0))
 
     def get_level_data(self, level=0, calc_alpha=False, report=None, fast=False):
         """Gets the uncompressed pixel data for a requested mip level, optionally calculating the alpha
@@ -200,19 +249,20 @@ class GLTexture:
             if detail_blend == TEX_DETAIL_ALPHA:
                 self._make_detail_map_alpha(buf, level)
             elif detail_blend == TEX_DETAIL_ADD:
-                self._make_detail_map_alpha(buf, level)
+                self._make_detail_map_add(buf, level)
             elif detail_blend == TEX_DETAIL_MULTIPLY:
                 self._make_detail_map_mult(buf, level)
 
         # Do we need to calculate the alpha component?
         if calc_alpha:
-            for i in range(0, len(buf), 4):
-                buf[i+3] = int(sum(buf[i:i+3]) / 3)
+            pixels = self._pixels(buf)
+            pixels[:, 3] = pixels[:, :3].sum(axis=1, dtype=np.uint16) // 3
 
         return bytes(buf)
 
     def _get_detail_alpha(self, level, dropoff_start, dropoff_stop, detail_max, detail_min):
-        alpha = (level - dropoff_start) * (detail_min - detail_max) / (dropoff_stop - dropoff_start) + detail_max
+        with np.errstate(divide="ignore", invalid="ignore"):
+            alpha = (np.float32(level) - dropoff_start) * (detail_min - detail_max) / (dropoff_stop - dropoff_start) + detail_max
         if detail_min < detail_max:
             return min(detail_max, max(detail_min, alpha))
         else:
@@ -233,12 +283,13 @@ class GLTexture:
 
     @property
     def has_alpha(self):
-        data, xparency = self._image_data, False
-        for i in range(3, len(data), 4):
-            if data[i] == 0:
-                xparency = True
-            elif data[i] != 255:
+        # Scan in chunks so we can bail as soon as we see a partially transparent pixel.
+        alpha, xparency = self._pixels(self._image_data)[:, 3], False
+        for i in range(0, len(alpha), _ALPHA_SCAN_CHUNK):
+            chunk = alpha[i:i+_ALPHA_SCAN_CHUNK]
+            if np.any((chunk != 0) & (chunk != 255)):
                 return TextureAlpha.full
+            xparency = xparency or bool(np.any(chunk == 0))
         return TextureAlpha.on_off if xparency else TextureAlpha.opaque
 
     def _get_image_data(self):
@@ -248,34 +299,32 @@ class GLTexture:
     image_data = property(_get_image_data, _set_image_data)
 
     def _invert_image(self, width, height, buf):
-        size = width * height * 4
-        finalBuf = bytearray(size)
-        row_stride = width * 4
-        for i in range(height):
-            src, dst = i * row_stride, (height - (i+1)) * row_stride
-            finalBuf[dst:dst+row_stride] = buf[src:src+row_stride]
-        return bytes(finalBuf)
+        rows = np.frombuffer(buf, dtype=np.uint8, count=width * height * 4).reshape(height, width * 4)
+        return rows[::-1].tobytes()
 
     def _make_detail_map_add(self, data, level):
         dropoff_start, dropoff_stop, detail_max, detail_min = self._detail_falloff
         alpha = self._get_detail_alpha(level, dropoff_start, dropoff_stop, detail_max, detail_min)
-        for i in range(0, len(data), 4):
-            data[i] = int(data[i] * alpha)
-            data[i+1] = int(data[i+1] * alpha)
-            data[i+2] = int(data[i+2] * alpha)
+        pixels = self._pixels(data)
+        pixels[:, :3] = pixels[:, :3].astype(np.float32) * alpha
 
     def _make_detail_map_alpha(self, data, level):
         dropoff_start, dropoff_end, detail_max, detail_min = self._detail_falloff
         alpha = self._get_detail_alpha(level, dropoff_start, dropoff_end, detail_max, detail_min)
-        for i in range(0, len(data), 4):
-            data[i+3] = int(data[i+3] * alpha)
+        pixels = self._pixels(data)
+        pixels[:, 3] = pixels[:, 3].astype(np.float32) * alpha
 
     def _make_detail_map_mult(self, data, level):
         dropoff_start, dropoff_end, detail_max, detail_min = self._detail_falloff
         alpha = self._get_detail_alpha(level, dropoff_start, dropoff_end, detail_max, detail_min)
-        invert_alpha = (1.0 - alpha) * 255.0
-        for i in range(0, len(data), 4):
-            data[i+3] = int(invert_alpha + data[i+3] * alpha)
+        invert_alpha = (np.float32(1.0) - alpha) * np.float32(255.0)
+        pixels = self._pixels(data)
+        pixels[:, 3] = (invert_alpha + pixels[:, 3].astype(np.float32)) * alpha
+
+    @staticmethod
+    def _pixels(buf):
+        """Views an RGBA buffer as an array of pixels. Writes go through to mutable buffers."""
+        return np.frombuffer(buf, dtype=np.uint8).reshape(-1, 4)
 
     @property
     def num_levels(self):
@@ -70,9 +70,23 @@ class PlasmaAgeExportOperator(ExportOperator, bpy.types.Operator):
                                            "description": "Texture Cache Settings",
                                            "items": [("skip", "Don't Use Texture Cache", "The texture cache is neither used nor updated."),
                                                      ("use", "Use Texture Cache", "Use (and update, if needed) cached textures."),
-                                                     ("rebuild", "Rebuild Texture Cache", "Rebuilds the texture cache from scratch.")],
+                                                     ("rebuild", "Rebuild Texture Cache", "Rebuilds the texture cache from scratch."),
+                                                     ("compact", "Compact Texture Cache", "Use cached textures, then rewrite the texture cache without any stale data.")],
                                            "default": "use"}),
 
+        "incremental_export": (BoolProperty, {"name": "Incremental Export",
+                                              "description": "Only re-export pages that have changed since the last export",
+                                              "default": False}),
+
+        "texture_threads": (IntProperty, {"name": "Texture Threads",
+                                          "description": "Number of threads used to compress textures (0 uses one thread per CPU core)",
+                                          "min": 0,
+                                          "default": 0}),
+
+        "optimize_vertex_cache": (BoolProperty, {"name": "Optimize Vertex Cache",
+                                                 "description": "Reorders triangles and vertices for better GPU vertex cache use (slower export)",
+                                                 "default": False}),
+
         "lighting_method": (EnumProperty, {"name": "Static Lighting",
                                            "description": "Static Lighting Settings",
                                            "items": [("skip", "Don't Bake Lighting", "Static lighting is not baked during this export (fastest export)"),
@@ -81,6 +95,20 @@ class PlasmaAgeExportOperator(ExportOperator, bpy.types.Operator):
                                                      ("force_lightmap", "Force Lightmap Bake", "All static lighting is baked as lightmaps (slower export)")],
                                            "default": "bake"}),
 
+        "lightmap_atlas_size": (EnumProperty, {"name": "Lightmap Atlases",
+                                               "description": "Packs the lightmaps of many objects into shared atlas textures",
+                                               "items": [("0", "Don't Use Atlases", "Every lightmapped object gets its own lightmap texture"),
+                                                         ("1024", "1024px Atlases", "Lightmaps are packed into atlases of up to 1024x1024 pixels"),
+                                                         ("2048", "2048px Atlases", "Lightmaps are packed into atlases of up to 2048x2048 pixels"),
+                                                         ("4096", "4096px Atlases", "Lightmaps are packed into atlases of up to 4096x4096 pixels")],
+                                               "default": "0"}),
+
+        "lightmap_texel_density": (FloatProperty, {"name": "Lightmap Texel Density",
+                                                   "description": "Number of lightmap pixels per Blender unit when packing lightmap atlases",
+                                                   "min": 0.1,
+                                                   "soft_max": 256.0,
+                                                   "default": 16.0}),
+
         "envmap_method": (EnumProperty, {"name": "Environment Maps",
                                          "description": "Environment Map Settings",
                                          "items": [("skip", "Don't Export EnvMaps", "Environment Maps are not exported"),
@@ -129,6 +157,7 @@ class PlasmaAgeExportOperator(ExportOperator, bpy.types.Operator):
                            default={"EXPORT"},
                            items=[("EXPORT", "Export", "Export the age data"),
                                   ("PROFILE", "Profile", "Profile the exporter"),
+                                  ("TIMING", "Timing Report", "Write a report of how long each export step, object, modifier, and texture took"),
                                   ("LAUNCH", "Launch Age", "Launch the age in Plasma")],
                            options={"ENUM_FLAG"})
 
@@ -163,6 +192,7 @@ class PlasmaAgeExportOperator(ExportOperator, bpy.types.Operator):
                 layout.alert = False
         layout.prop(age, "texcache_method", text="")
         layout.prop(age, "lighting_method")
+        layout.prop(age, "incremental_export")
         row = layout.row()
         row.enabled = korlib.ConsoleToggler.is_platform_supported()
         row.prop(age, "show_console")
@@ -15,10 +15,11 @@
 
 import bpy
 from bpy.props import *
+import numpy as np
 from pathlib import Path
 
 from ..helpers import TemporaryObject, ensure_power_of_two
-from ..korlib import ConsoleToggler, GLTexture, scale_image
+from ..korlib import ConsoleToggler, GLTexture, load_image_pixels, scale_image, use_pixel_loader
 from ..exporter.explosions import *
 from ..exporter.logger import ExportProgressLogger
 from ..exporter.material import BLENDER_CUBE_MAP
@@ -149,35 +150,31 @@ class PlasmaBuildCubeMapOperator(ImageOperator, bpy.types.Operator):
             image.generated_height = image_height
         else:
             image = bpy.data.images.new(req_name, image_width, image_height, True)
-        image_datasz = image_width * image_height * 4
-        image_data = bytearray(image_datasz)
+        image_data = np.empty((image_height, image_width, 4), dtype=np.float32)
         face_num = len(BLENDER_CUBE_MAP)
 
         # This is the inverse of the operation found in MaterialConverter._finalize_cube_map
         for i in range(face_num):
             col_id = i if i < 3 else i - 3
             row_start = 0 if i < 3 else face_height
-            row_end = face_height if i < 3 else image_height
+            col_start = col_id * face_width
 
             # TIL: Blender's coordinate system has its origin in the lower left, while Plasma's
             # is in the upper right. We could do some fancy flipping stuff, but there are already
             # mitigations in code for that. So, we disabled the GLTexture's flipping helper and
             # will just swap the locations of the images in the list. le wout.
             j = i + 3 if i < 3 else i - 3
-            for row_current in range(row_start, row_end, 1):
-                src_start_idx = (row_current - row_start) * face_width * 4
-                src_end_idx = src_start_idx + (face_width * 4)
-                dst_start_idx = (row_current * image_width * 4) + (col_id * face_width * 4)
-                dst_end_idx = dst_start_idx + (face_width * 4)
-                image_data[dst_start_idx:dst_end_idx] = face_data[j][src_start_idx:src_end_idx]
-
-        # FFFUUUUU... Blender wants a list of floats
-        pixels = [None] * image_datasz
-        for i in range(image_datasz):
-            pixels[i] = image_data[i] / 255
-
-        # Obligatory remark: "Blender sucks"
-        image.pixels = pixels
+            face = np.frombuffer(face_data[j], dtype=np.uint8).reshape(face_height, face_width, 4)
+            image_data[row_start:row_start+face_height, col_start:col_start+face_width] = face
+
+        # Blender wants floats, and it wants them all at once, if at all possible.
+        image_data /= 255.0
+        pixels = image_data.reshape(-1)
+        if hasattr(image.pixels, "foreach_set"):
+            image.pixels.foreach_set(pixels)
+        else:
+            # Obligatory remark: "Blender sucks"
+            image.pixels = pixels.tolist()
         image.update()
         image.pack(True)
         image.plasma_image.texcache_method = "rebuild"
@@ -206,6 +203,8 @@ class PlasmaBuildCubeMapOperator(ImageOperator, bpy.types.Operator):
     def _load_single_image_data(self, filepath):
         images = bpy.data.images
         with TemporaryObject(images.load(filepath), images.remove) as blimage:
+            if use_pixel_loader(blimage):
+                return load_image_pixels(blimage, inverted=True)
             with GLTexture(image=blimage, fast=True) as glimage:
                 return glimage.image_data
 
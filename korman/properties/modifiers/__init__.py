@@ -13,8 +13,13 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 import bpy
 
+from contextlib import contextmanager
+from typing import *
+
 from .base import PlasmaModifierProperties
 from .anim import *
 from .avatar import *
@@ -38,7 +43,31 @@ for mixin in _mod_mixins:
                 "overriding PlasmaModifierProperties!"
                 )
 
+# Modifier properties that are aggregated for each object when taking a snapshot
+_SNAPSHOT_PROPERTIES = (
+    "copy_material",
+    "draw_framebuf",
+    "draw_late",
+    "draw_no_defer",
+    "draw_opaque",
+    "face_sort",
+    "no_face_sort",
+    "requires_actor",
+)
+
+
+class _ModifierSnapshot(NamedTuple):
+    pl_ids: Tuple[str, ...]
+    properties: Dict[str, bool]
+
+
 class PlasmaModifiers(bpy.types.PropertyGroup):
+    # The pl_id of every modifier, in the order of the old dir() scan. Filled in by register().
+    _pl_ids = None
+
+    # Enabled modifiers of each object by name, only available during an export.
+    _snapshot = None
+
     def determine_next_id(self):
         """Gets the ID for the next modifier in the UI"""
         # This is NOT a property, otherwise the modifiers property would access this...
@@ -54,13 +83,27 @@ class PlasmaModifiers(bpy.types.PropertyGroup):
         """Generates all of the enabled modifiers.
            NOTE: We do not promise to return modifiers in their display_order!
         """
-        for i in dir(self):
-            attr = getattr(self, i, None)
-            # Assumes each modifier is a single pointer to PlasmaModifierProperties
-            if isinstance(attr, PlasmaModifierProperties):
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            for i in snapshot.pl_ids:
+                yield getattr(self, i)
+        else:
+            for i in self._pl_ids:
+                attr = getattr(self, i)
                 if attr.enabled:
                     yield attr
 
+    def _get_snapshot(self) -> Optional[_ModifierSnapshot]:
+        if PlasmaModifiers._snapshot is None:
+            return None
+        return PlasmaModifiers._snapshot.get(self.id_data.name)
+
+    @classmethod
+    def forget_snapshot(cls, bo: bpy.types.Object):
+        """Discards the snapshot of an object's modifiers after they have been changed"""
+        if cls._snapshot is not None:
+            cls._snapshot.pop(bo.name, None)
+
     @classmethod
     def register(cls):
         # Okay, so we have N plasma modifer property groups...
@@ -76,10 +119,35 @@ class PlasmaModifiers(bpy.types.PropertyGroup):
             for name, (prop, kwargs) in PlasmaModifierProperties._subprops.items():
                 setattr(i, name, prop(**kwargs))
             setattr(cls, i.pl_id, bpy.props.PointerProperty(type=i))
+        cls._pl_ids = tuple(sorted(i.pl_id for i in PlasmaModifierProperties.__subclasses__()))
         bpy.types.Object.plasma_modifiers = bpy.props.PointerProperty(type=cls)
 
+    @classmethod
+    @contextmanager
+    def snapshot(cls, objects: Iterable[bpy.types.Object]):
+        """Remembers the enabled modifiers of the given objects, and their combined rendering and
+           export flags, until the end of the with statement. Objects must not have their modifiers
+           or pages changed without calling forget_snapshot().
+        """
+        snapshot = {}
+        for bo in objects:
+            mods = bo.plasma_modifiers
+            enabled = [i for i in cls._pl_ids if getattr(mods, i).enabled]
+            properties = {name: any(getattr(getattr(mods, i), name) for i in enabled)
+                          for name in _SNAPSHOT_PROPERTIES}
+            snapshot[bo.name] = _ModifierSnapshot(tuple(enabled), properties)
+
+        cls._snapshot = snapshot
+        try:
+            yield
+        finally:
+            cls._snapshot = None
+
     def test_property(self, property : str) -> bool:
         """Tests a property on all enabled Plasma modifiers"""
+        snapshot = self._get_snapshot()
+        if snapshot is not None and property in snapshot.properties:
+            return snapshot.properties[property]
         return any((getattr(i, property) for i in self.modifiers))
 
 
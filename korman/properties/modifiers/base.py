@@ -78,6 +78,7 @@ class PlasmaModifierProperties(bpy.types.PropertyGroup):
     @enabled.setter
     def enabled(self, value: bool) -> None:
         plmods = self.id_data.plasma_modifiers
+        plmods.forget_snapshot(self.id_data)
         if value and self.enabled is False:
             self.display_order = plmods.determine_next_id()
             self.created()
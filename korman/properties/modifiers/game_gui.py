@@ -1307,8 +1307,8 @@ class PlasmaGameGuiDialogModifier(_GameGuiMixin, PlasmaModifierProperties):
         # Find all of the visible objects in the GUI page for use in hither/yon raycast and
         # camera matrix calculations.
         visible_objects = [
-            i for i in exporter.get_objects(bo.plasma_object.page)
-            if i.type == "MESH" and i.data.materials
+            i for i in exporter.get_objects(bo.plasma_object.page, type="MESH")
+            if i.data.materials
         ]
 
         camera_object = self.id_data if self.id_data.type == "CAMERA" else self.camera_object
@@ -1384,8 +1384,7 @@ class PlasmaGameGuiDialogModifier(_GameGuiMixin, PlasmaModifierProperties):
         dialog = exporter.mgr.find_object(pfGUIDialogMod, bl=bo, so=so)
         control_modifiers: Iterable[_GameGuiMixin] = itertools.chain.from_iterable(
             obj.plasma_modifiers.gui_control.iterate_control_modifiers()
-            for obj in exporter.get_objects(bo.plasma_object.page)
-            if obj.plasma_modifiers.gui_control.enabled
+            for obj in exporter.get_objects(bo.plasma_object.page, modifier="gui_control")
         )
         for control_modifier in control_modifiers:
             control = control_modifier.get_control(exporter)
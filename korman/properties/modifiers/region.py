@@ -19,13 +19,19 @@ from bpy.props import *
 from PyHSPlasma import *
 
 from ...exporter import ExportError, ExportAssertionError
-from ...helpers import bmesh_from_object
 from ... import idprops
 
 from .base import PlasmaModifierProperties, PlasmaModifierUpgradable, PlasmaModifierLogicWiz
 from ... import enum_props
 from ..prop_camera import PlasmaCameraProperties
 
+# Faces whose planes are this close are merged into a single plConvexIsect plane
+_COPLANAR_NORMAL_DOT = 0.9999
+_COPLANAR_DISTANCE = 0.001
+
+# How far a vertex may poke out of a convex region's planes before the region is deemed concave
+_CONVEX_TOLERANCE = 0.001
+
 footstep_surface_ids = {
     "dirt": 0,
     # 1 = NULL
@@ -519,7 +525,7 @@ class PlasmaSoftVolume(idprops.IDPropMixin, PlasmaModifierProperties):
 
         # Initialize the plVolumeIsect. Currently, we only support convex isects. If you want parallel
         # isects from empties, be my guest...
-        with bmesh_from_object(bo) as mesh:
+        with exporter.mesh_cache.get_bmesh(bo) as mesh:
             matrix = bo.matrix_world
             xform = matrix.inverted()
             xform.transpose()
@@ -530,16 +536,41 @@ class PlasmaSoftVolume(idprops.IDPropMixin, PlasmaModifierProperties):
             bmesh.ops.recalc_face_normals(mesh, faces=mesh.faces)
             bmesh.ops.reverse_faces(mesh, faces=mesh.faces, flip_multires=True)
 
-            isect = plConvexIsect()
+            # Every face of the mesh is a half-space of the region, but a face that is split up into
+            # several coplanar polygons (eg triangulated) is still only one half-space. Plasma tests
+            # every plane for every listener, so only export each unique plane once.
+            verts = [matrix * i.co for i in mesh.verts]
+            planes = []
             for ngon in mesh.faces:
                 normal = xform * ngon.normal * -1
+                if normal.length_squared == 0.0:
+                    continue
                 normal.normalize()
-                normal = hsVector3(*normal)
-                for vertex in ngon.verts:
-                    pos = matrix * vertex.co
-                    isect.addPlane(normal, hsVector3(*pos))
+                pos = verts[ngon.verts[0].index]
+                dist = normal.dot(pos)
+                for plane_normal, plane_pos, plane_dist in planes:
+                    if normal.dot(plane_normal) >= _COPLANAR_NORMAL_DOT and abs(dist - plane_dist) <= _COPLANAR_DISTANCE:
+                        break
+                else:
+                    planes.append((normal, pos, dist))
+
+            if not planes:
+                raise ExportError("SoftVolume '{}': Simple SoftVolumes need at least one face!".format(bo.name))
+
+            # If any vertex is in front of any of the planes, the mesh isn't convex, and the region
+            # would not be what the artist sees in Blender.
+            for plane_normal, plane_pos, plane_dist in planes:
+                if any(plane_normal.dot(i) - plane_dist > _CONVEX_TOLERANCE for i in verts):
+                    raise ExportError("SoftVolume '{}': Simple SoftVolumes must be convex!".format(bo.name))
+
+            isect = plConvexIsect()
+            for plane_normal, plane_pos, plane_dist in planes:
+                isect.addPlane(hsVector3(*plane_normal), hsVector3(*plane_pos))
             sv.volume = isect
 
+            num_naive = sum(len(i.verts) for i in mesh.faces)
+            exporter.report.msg("Convex region: {} planes (down from {})", len(planes), num_naive)
+
     def _export_sv_nodes(self, exporter, bo, so):
         tree = self.get_node_tree()
         # Stash for later
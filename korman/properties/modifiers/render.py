@@ -479,7 +479,8 @@ class PlasmaLightMapGen(idprops.IDPropMixin, PlasmaModifierProperties, PlasmaMod
 
     @property
     def copy_material(self):
-        return self.bake_lightmap
+        # Objects in a lightmap atlas share their materials with everything else in the atlas.
+        return self.bake_lightmap and not self.use_atlas
 
     def export(self, exporter, bo, so):
         # If we're exporting vertex colors, who gives a rat's behind?
@@ -501,6 +502,11 @@ class PlasmaLightMapGen(idprops.IDPropMixin, PlasmaModifierProperties, PlasmaMod
             raise ExportError("'{}': Lightmap UV Texture '{}' seems to be missing. Did you delete it?", bo.name, uvtex_name)
 
         for matKey in materials:
+            # Materials shared through an atlas only need to be lightmapped once.
+            mat = matKey.object
+            if mat.compFlags & hsGMaterial.kCompIsLightMapped:
+                continue
+
             layer = exporter.mgr.add_object(plLayer, name="{}_LIGHTMAPGEN".format(matKey.name), so=so)
             layer.UVWSrc = uvw_src
 
@@ -516,7 +522,6 @@ class PlasmaLightMapGen(idprops.IDPropMixin, PlasmaModifierProperties, PlasmaMod
             gstate.ZFlags |= hsGMatState.kZNoZWrite
             gstate.miscFlags |= hsGMatState.kMiscLightMap
 
-            mat = matKey.object
             mat.compFlags |= hsGMaterial.kCompIsLightMapped
             mat.addPiggyBack(layer.key)
 
@@ -545,6 +550,13 @@ class PlasmaLightMapGen(idprops.IDPropMixin, PlasmaModifierProperties, PlasmaMod
     def resolution(self):
         return int(self.quality)
 
+    @property
+    def use_atlas(self):
+        if not self.bake_lightmap or self.image is not None:
+            return False
+        age = bpy.context.scene.world.plasma_age
+        return age.export_active and age.lightmap_atlas_size != "0"
+
     def upgrade(self):
         # In version 1, bake passes were assigned on a per modifier basis by setting
         # the view layers on the modifier. Version 2 moves them into a global list
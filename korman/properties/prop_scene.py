@@ -140,3 +140,8 @@ class PlasmaScene(bpy.types.PropertyGroup):
                                            type=bpy.types.Object)
     modifier_copy_id = StringProperty(name="INTERNAL: Modifier to copy from",
                                       options={"HIDDEN", "SKIP_SAVE"})
+
+    idprops_upgraded = BoolProperty(name="INTERNAL: ID Properties Upgraded",
+                                    description="Have all old StringProperties in this file been upgraded to ID Datablock Properties?",
+                                    default=False,
+                                    options={"HIDDEN"})
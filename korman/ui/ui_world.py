@@ -292,9 +292,15 @@ class PlasmaAgePanel(AgeButtonsPanel, bpy.types.Panel):
         layout.separator()
         layout.prop(age, "envmap_method")
         layout.prop(age, "lighting_method")
+        layout.prop(age, "lightmap_atlas_size")
+        if age.lightmap_atlas_size != "0":
+            layout.prop(age, "lightmap_texel_density")
         layout.prop(age, "localization_method")
         layout.prop(age, "python_method")
         layout.prop(age, "texcache_method")
+        layout.prop(age, "texture_threads")
+        layout.prop(age, "optimize_vertex_cache")
+        layout.prop(age, "incremental_export")
 
 
 class PlasmaEnvironmentPanel(AgeButtonsPanel, bpy.types.Panel):
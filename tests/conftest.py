@@ -0,0 +1,52 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lets the parts of Korman that don't actually need Blender be tested outside of it.
+
+The Blender modules (and PyHSPlasma, if it's missing) are replaced by empty stand-ins, and the
+korman and korman.korlib packages are set up without running their __init__ modules, which
+would otherwise try to register the whole addon.
+"""
+
+from pathlib import Path
+import sys
+import types
+
+_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _stub_module(name, **attrs):
+    if name in sys.modules:
+        return
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+
+
+def _stub_package(name, path):
+    package = types.ModuleType(name)
+    package.__path__ = [str(path)]
+    sys.modules[name] = package
+
+
+for i in ("bgl", "bmesh", "bpy", "mathutils"):
+    _stub_module(i)
+try:
+    import PyHSPlasma
+except ImportError:
+    _stub_module("PyHSPlasma", plBitmap=type("plBitmap", (), {}))
+
+_stub_package("korman", _ROOT / "korman")
+_stub_package("korman.korlib", _ROOT / "korman" / "korlib")
@@ -0,0 +1,219 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from types import SimpleNamespace
+
+from korman.korlib import texture
+
+# Source and destination sizes, including non power of two and non integer ratios
+_SCALES = [
+    (16, 16, 8, 8),
+    (24, 20, 8, 16),
+    (17, 13, 4, 4),
+    (5, 7, 12, 9),
+    (64, 4, 16, 1),
+    (3, 3, 1, 1),
+]
+
+
+def _reference_scale_image(buf, srcW, srcH, dstW, dstH):
+    """A line by line port of _scale_image from korlib/texture.cpp using float32 math"""
+    f32 = np.float32
+    scaleX, scaleY = f32(srcW) / f32(dstW), f32(srcH) / f32(dstH)
+    filterW, filterH = max(scaleX, f32(1.0)), max(scaleY, f32(1.0))
+    dst, dstIdx = bytearray(dstW * dstH * 4), 0
+
+    for dstY in range(dstH):
+        srcY = f32(dstY) * scaleY
+        srcY_start = max(int(srcY - filterH), 0)
+        srcY_end = min(int(srcY + filterH), srcH - 1)
+        for dstX in range(dstW):
+            srcX = f32(dstX) * scaleX
+            srcX_start = max(int(srcX - filterW), 0)
+            srcX_end = min(int(srcX + filterW), srcW - 1)
+
+            accum_color = [f32(0.0)] * 4
+            weight_total = f32(0.0)
+            for i in range(srcY_start, srcY_end + 1):
+                weightY = f32(1.0) - abs((f32(i) - srcY) / filterH)
+                if weightY <= 0.0:
+                    continue
+                srcIdx = (i * srcW + srcX_start) * 4
+                for j in range(srcX_start, srcX_end + 1):
+                    weightX = f32(1.0) - abs((f32(j) - srcX) / filterW)
+                    weight = weightX * weightY
+                    if weight > 0.0:
+                        for k in range(4):
+                            accum_color[k] += (f32(buf[srcIdx+k]) / f32(255.0)) * weight
+                        weight_total += weight
+                    srcIdx += 4
+
+            for k in range(4):
+                accum_color[k] *= f32(1.0) / weight_total
+            for k in range(4):
+                dst[dstIdx+k] = int(accum_color[k] * f32(255.0))
+            dstIdx += 4
+    return bytes(dst)
+
+
+def _reference_detail_map(buf, level, num_levels, texkey):
+    """A line by line port of _generate_detail_map from korlib/texture.cpp using float32 math"""
+    f32 = np.float32
+    dropoff_start = f32(texkey.detail_fade_start) / f32(100.0) * f32(num_levels)
+    dropoff_stop = f32(texkey.detail_fade_stop) / f32(100.0) * f32(num_levels)
+    detail_max = f32(texkey.detail_opacity_start) / f32(100.0)
+    detail_min = f32(texkey.detail_opacity_stop) / f32(100.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = (f32(level) - dropoff_start) * (detail_min - detail_max) / (dropoff_stop - dropoff_start) + detail_max
+    if detail_min < detail_max:
+        alpha = min(detail_max, max(detail_min, alpha))
+    else:
+        alpha = min(detail_min, max(detail_max, alpha))
+
+    buf = bytearray(buf)
+    if texkey.detail_blend == texture.TEX_DETAIL_ALPHA:
+        for i in range(0, len(buf), 4):
+            buf[i+3] = int(f32(buf[i+3]) * alpha)
+    elif texkey.detail_blend == texture.TEX_DETAIL_ADD:
+        for i in range(0, len(buf), 4):
+            for j in range(3):
+                buf[i+j] = int(f32(buf[i+j]) * alpha)
+    elif texkey.detail_blend == texture.TEX_DETAIL_MULTIPLY:
+        invert_alpha = (f32(1.0) - alpha) * f32(255.0)
+        for i in range(0, len(buf), 4):
+            buf[i+3] = int((invert_alpha + f32(buf[i+3])) * alpha)
+    return bytes(buf)
+
+
+def _reference_calc_alpha(buf):
+    """A port of the calc_alpha loop from korlib/texture.cpp, treating the channels as unsigned"""
+    buf = bytearray(buf)
+    for i in range(0, len(buf), 4):
+        buf[i+3] = (buf[i+0] + buf[i+1] + buf[i+2]) // 3
+    return bytes(buf)
+
+
+def _random_image(width, height, seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=width * height * 4, dtype=np.uint8).tobytes()
+
+
+@pytest.mark.parametrize("srcW,srcH,dstW,dstH", _SCALES)
+def test_scale_image_matches_reference(srcW, srcH, dstW, dstH):
+    buf = _random_image(srcW, srcH, srcW * srcH + dstW)
+    assert texture.scale_image(buf, srcW, srcH, dstW, dstH) == _reference_scale_image(buf, srcW, srcH, dstW, dstH)
+
+
+@pytest.mark.parametrize("srcW,srcH,dstW,dstH", _SCALES)
+def test_scale_image_matches_korlib(srcW, srcH, dstW, dstH):
+    _korlib = pytest.importorskip("_korlib")
+    buf = _random_image(srcW, srcH, srcW * srcH + dstW)
+    assert texture.scale_image(buf, srcW, srcH, dstW, dstH) == _korlib.scale_image(buf, srcW, srcH, dstW, dstH)
+
+
+def test_scale_image_rejects_bad_size():
+    with pytest.raises(ValueError):
+        texture.scale_image(bytes(15), 2, 2, 1, 1)
+
+
+def test_invert_image():
+    buf = bytes(range(2 * 3 * 4))
+    inverted = texture.GLTexture(image=object())._invert_image(2, 3, buf)
+    assert inverted == buf[16:24] + buf[8:16] + buf[0:8]
+
+
+@pytest.mark.parametrize("alpha,expected", [
+    ((255, 255, 255), texture.TextureAlpha.opaque),
+    ((255, 0, 255), texture.TextureAlpha.on_off),
+    ((255, 0, 128), texture.TextureAlpha.full),
+])
+def test_has_alpha(alpha, expected):
+    tex = texture.GLTexture(image=object())
+    tex.image_data = (len(alpha), 1, bytes(b for a in alpha for b in (1, 2, 3, a)))
+    assert tex.has_alpha == expected
+
+
+# Fade start/stop and opacity start/stop, in percent. Thirds and sevenths land the falloff near
+# integer boundaries, and the last one divides by zero.
+_FALLOFFS = [
+    (0, 100, 100, 0),
+    (10, 90, 33, 67),
+    (25, 75, 70, 10),
+    (33, 66, 100, 14),
+    (50, 50, 80, 20),
+]
+
+_DETAIL_BLENDS = [texture.TEX_DETAIL_ALPHA, texture.TEX_DETAIL_ADD, texture.TEX_DETAIL_MULTIPLY]
+
+
+def _make_texkey(detail_blend, falloff):
+    fade_start, fade_stop, opacity_start, opacity_stop = falloff
+    return SimpleNamespace(image=object(), is_detail_map=True, detail_blend=detail_blend,
+                           detail_fade_start=fade_start, detail_fade_stop=fade_stop,
+                           detail_opacity_start=opacity_start, detail_opacity_stop=opacity_stop)
+
+
+def _get_all_levels(tex_type, texkey, buf, width, height, **kwargs):
+    tex = tex_type(texkey=texkey)
+    tex.image_data = (width, height, buf)
+    return [tex.get_level_data(i, **kwargs) for i in range(tex.num_levels)]
+
+
+@pytest.mark.parametrize("falloff", _FALLOFFS)
+@pytest.mark.parametrize("detail_blend", _DETAIL_BLENDS)
+def test_detail_map_matches_reference(detail_blend, falloff):
+    texkey = _make_texkey(detail_blend, falloff)
+    buf = _random_image(16, 16, detail_blend * 100 + falloff[0])
+    levels = _get_all_levels(texture.GLTexture, texkey, buf, 16, 16)
+
+    num_levels = len(levels)
+    for level, data in enumerate(levels):
+        size = 16 >> level
+        expected = _reference_scale_image(buf, 16, 16, size, size) if level else buf
+        assert data == _reference_detail_map(expected, level, num_levels, texkey)
+
+
+@pytest.mark.parametrize("falloff", _FALLOFFS)
+@pytest.mark.parametrize("detail_blend", _DETAIL_BLENDS)
+def test_detail_map_matches_korlib(detail_blend, falloff):
+    _korlib = pytest.importorskip("_korlib")
+    texkey = _make_texkey(detail_blend, falloff)
+    buf = _random_image(16, 16, detail_blend * 100 + falloff[0])
+    assert (_get_all_levels(texture.GLTexture, texkey, buf, 16, 16) ==
+            _get_all_levels(_korlib.GLTexture, texkey, buf, 16, 16))
+
+
+def test_calc_alpha_matches_reference():
+    buf = _random_image(8, 8, 42)
+    tex = texture.GLTexture(image=object())
+    tex.image_data = (8, 8, buf)
+    assert tex.get_level_data(calc_alpha=True) == _reference_calc_alpha(buf)
+
+
+def test_calc_alpha_matches_korlib():
+    _korlib = pytest.importorskip("_korlib")
+    # texture.cpp sums the channels as plain chars, which are signed on most platforms, so only
+    # compare the range where that doesn't make a difference.
+    buf = (np.frombuffer(_random_image(8, 8, 42), dtype=np.uint8) >> 1).tobytes()
+    texkey = SimpleNamespace(image=object(), is_detail_map=False)
+    results = []
+    for tex_type in (texture.GLTexture, _korlib.GLTexture):
+        tex = tex_type(texkey=texkey)
+        tex.image_data = (8, 8, buf)
+        results.append(tex.get_level_data(calc_alpha=True))
+    assert results[0] == results[1]